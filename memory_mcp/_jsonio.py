@@ -0,0 +1,42 @@
+"""
+JSON 编解码兼容层
+
+优先使用 orjson（C 实现，直接读写 UTF-8 bytes），未安装时回退到标准库 json。
+hooks 也会导入本模块，因此这里不能引入任何重型依赖。
+"""
+
+import json
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于安装环境
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """解析 JSON，接受 bytes 或 str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj: Any, indent: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """序列化为 UTF-8 bytes（不转义非 ASCII 字符），indent=True 时缩进 2 格"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(
+        obj, ensure_ascii=False, indent=2 if indent else None, default=default
+    ).encode('utf-8')
+
+
+def dumps_str(obj: Any, indent: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """序列化为 str，用于需要文本的场景（如 MCP TextContent）"""
+    return dumps(obj, indent=indent, default=default).decode('utf-8')
@@ -0,0 +1,135 @@
+"""
+hook 与监控进程之间的本地 IPC
+
+监控进程（session_monitor.py）与会话同生命周期，常驻一个 MemoryManager 且编码器已预热。
+auto_save / save_response 每次被调用都是新进程，如果各自初始化 MemoryManager，
+需要导入 chromadb 并打开数据库，耗时远超 hook 本身的工作量。
+
+因此监控进程在本地监听一个地址，hook 把请求发过去由它代为执行：
+  - Unix: {project}/.claude/memory/hook.sock（路径过长时改用 /tmp 下按项目路径哈希命名的 socket）
+  - Windows: \\\\.\\pipe\\memory-mcp-<项目路径哈希>
+
+消息为一帧 JSON（multiprocessing.connection 的 send_bytes/recv_bytes）：
+  请求: {"op": "cache_message", "role": "user", "content": "...", "recall_top_k": 3}
+  响应: {"ok": true, "memories": {...} 或 null} / {"ok": false, "error": "..."}
+
+监控进程不在运行时 request() 返回 None，调用方回退到进程内 MemoryManager。
+"""
+
+import os
+import sys
+import threading
+import zlib
+from typing import Callable, Dict, Optional
+
+from memory_mcp import _jsonio
+
+# Unix socket 文件名
+HOOK_SOCKET_FILE = "hook.sock"
+
+# AF_UNIX 路径长度上限约 104~108 字节，留出余量
+_MAX_UNIX_PATH = 100
+
+
+def _project_digest(project_path: str) -> str:
+    """项目路径的短哈希，用于命名管道/备用 socket 名"""
+    normalized = os.path.normcase(os.path.realpath(project_path))
+    return f"{zlib.crc32(normalized.encode('utf-8')):08x}"
+
+
+def get_hook_address(project_path: str) -> str:
+    """获取项目对应的监听地址"""
+    if sys.platform == "win32":
+        return rf"\\.\pipe\memory-mcp-{_project_digest(project_path)}"
+
+    path = os.path.join(os.path.realpath(project_path), ".claude", "memory", HOOK_SOCKET_FILE)
+    if len(path.encode('utf-8')) < _MAX_UNIX_PATH:
+        return path
+    return f"/tmp/memory-mcp-{os.getuid()}-{_project_digest(project_path)}.sock"
+
+
+def request(project_path: str, payload: Dict, timeout: float = 5.0) -> Optional[Dict]:
+    """
+    向监控进程发送一次请求并等待响应
+
+    Returns:
+        响应 dict；监控进程不在运行（连接失败）时返回 None。
+        请求已发出但未收到响应时返回 {"ok": False, ...}：此时请求可能已被执行，
+        调用方不应再回退到进程内重复处理
+    """
+    address = get_hook_address(project_path)
+    if sys.platform != "win32" and not os.path.exists(address):
+        return None
+
+    try:
+        from multiprocessing.connection import Client
+        conn = Client(address)
+    except (OSError, EOFError, ValueError):
+        return None
+
+    try:
+        with conn:
+            conn.send_bytes(_jsonio.dumps(payload))
+            if not conn.poll(timeout):
+                return {"ok": False, "error": "timeout"}
+            return _jsonio.loads(conn.recv_bytes())
+    except (OSError, EOFError, ValueError) as e:
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+class HookServer:
+    """监控进程侧的监听器：在后台线程中逐个处理 hook 请求"""
+
+    def __init__(self, project_path: str, handler: Callable[[Dict], Dict]):
+        self.address = get_hook_address(project_path)
+        self.handler = handler
+        self._listener = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        from multiprocessing.connection import Listener
+
+        if sys.platform != "win32":
+            # 上一个监控进程异常退出时可能遗留 socket 文件，导致 bind 失败
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+        self._listener = Listener(self.address)
+        self._thread = threading.Thread(target=self._serve, daemon=True, name="hook-ipc")
+        self._thread.start()
+
+    def close(self):
+        """停止监听（AF_UNIX 的 socket 文件由 Listener.close 删除）"""
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except OSError:
+                pass
+            self._listener = None
+
+    def _serve(self):
+        while True:
+            listener = self._listener
+            if listener is None:
+                return
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                # 监听器已关闭
+                return
+
+            try:
+                with conn:
+                    try:
+                        req = _jsonio.loads(conn.recv_bytes())
+                        resp = self.handler(req)
+                    except (OSError, EOFError):
+                        continue
+                    except Exception as e:
+                        resp = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                    conn.send_bytes(_jsonio.dumps(resp, default=str))
+            except (OSError, EOFError):
+                # hook 已超时退出，丢弃响应
+                continue
@@ -0,0 +1,313 @@
+"""
+监控进程的事件等待
+
+session_monitor.py 需要在以下情况发生时尽快醒来：
+  - 被监控的父进程（终端/IDE）退出
+  - 记忆目录中出现关闭信号文件、情景文件被改写、hook 暂存了消息
+
+以前主循环每 2 秒轮询一次，每次都要 stat/读取/解析 JSON。LifecycleWaiter 改为阻塞在
+操作系统的事件通知上，只有事件发生或到达兜底超时时才返回：
+  - Linux: epoll 同时监听 pidfd（父进程退出时可读）和 inotify（目录内文件写入完成/移入；
+    关闭信号由 session_end.py 写临时文件后改名投递，对应 IN_MOVED_TO）
+  - macOS/BSD: kqueue 的 EVFILT_PROC(NOTE_EXIT) + EVFILT_VNODE(NOTE_WRITE)
+  - Windows: WaitForMultipleObjects 同时等待进程句柄和 FindFirstChangeNotification 句柄
+
+任一机制不可用时对应事件退化为按超时轮询，调用方的检查逻辑保持不变。
+
+SIGTERM/SIGINT 的处理函数只设置标志；Python 在 EINTR 后会自动重试 epoll/kqueue 等待，
+因此 enable_signal_wakeup() 通过 signal.set_wakeup_fd 把信号转成管道上的一个字节，
+让 wait() 立即返回，调用方随即检查标志并退出。
+"""
+
+import os
+import select
+import signal
+import sys
+import time
+from typing import Optional
+
+# inotify 常量（<sys/inotify.h>）
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+
+class LifecycleWaiter:
+    """阻塞等待父进程退出或目录变化"""
+
+    def __init__(self, parent_pid: int, watch_dir: str):
+        self.parent_pid = parent_pid
+        self.watch_dir = watch_dir
+        # 父进程退出、目录变化是否都能由事件通知（否则调用方应缩短超时）
+        self.watches_parent = False
+        self.watches_dir = False
+
+        self._epoll = None
+        self._pidfd = -1
+        self._inotify_fd = -1
+        self._kqueue = None
+        self._dir_fd = -1
+        self._win_handles = []
+        self._win_change_handle = None
+        # kqueue 的进程退出事件只投递一次，记录下来供 parent_exited 查询
+        self._kqueue_parent_exited = False
+        # 信号唤醒管道（enable_signal_wakeup 创建）
+        self._wakeup_r = -1
+        self._wakeup_w = -1
+
+        try:
+            if sys.platform == "win32":
+                self._init_windows()
+            elif hasattr(select, "epoll"):
+                self._init_epoll()
+            elif hasattr(select, "kqueue"):
+                self._init_kqueue()
+        except Exception:
+            self.close()
+
+    @property
+    def event_driven(self) -> bool:
+        return self.watches_parent and self.watches_dir
+
+    # ==================== Linux ====================
+
+    def _init_epoll(self):
+        self._epoll = select.epoll()
+
+        # pidfd 需要 Linux 5.3+ / Python 3.9+；父进程已退出时抛出 ProcessLookupError
+        if hasattr(os, "pidfd_open"):
+            try:
+                self._pidfd = os.pidfd_open(self.parent_pid)
+                self._epoll.register(self._pidfd, select.EPOLLIN)
+                self.watches_parent = True
+            except OSError:
+                self._pidfd = -1
+
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd < 0:
+                return
+            wd = libc.inotify_add_watch(
+                fd, os.fsencode(self.watch_dir), _IN_CLOSE_WRITE | _IN_MOVED_TO
+            )
+            if wd < 0:
+                os.close(fd)
+                return
+            self._inotify_fd = fd
+            self._epoll.register(fd, select.EPOLLIN)
+            self.watches_dir = True
+        except (OSError, AttributeError):
+            pass
+
+    def _drain_inotify(self):
+        """读空 inotify 事件队列（只关心是否有变化，不解析具体事件）"""
+        self._drain_fd(self._inotify_fd)
+
+    @staticmethod
+    def _drain_fd(fd: int):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    # ==================== macOS / BSD ====================
+
+    def _init_kqueue(self):
+        self._kqueue = select.kqueue()
+        try:
+            self._kqueue.control([select.kevent(
+                self.parent_pid,
+                filter=select.KQ_FILTER_PROC,
+                flags=select.KQ_EV_ADD,
+                fflags=select.KQ_NOTE_EXIT,
+            )], 0)
+            self.watches_parent = True
+        except OSError:
+            pass
+
+        try:
+            self._dir_fd = os.open(self.watch_dir, os.O_RDONLY)
+            self._kqueue.control([select.kevent(
+                self._dir_fd,
+                filter=select.KQ_FILTER_VNODE,
+                flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                fflags=select.KQ_NOTE_WRITE,
+            )], 0)
+            # NOTE_WRITE 只在目录项增删时触发，原地改写文件内容不会唤醒，由兜底超时覆盖
+            self.watches_dir = True
+        except OSError:
+            pass
+
+    # ==================== Windows ====================
+
+    def _init_windows(self):
+        import ctypes
+        from ctypes import wintypes
+
+        SYNCHRONIZE = 0x00100000
+        FILE_NOTIFY_CHANGE_FILE_NAME = 0x00000001
+        FILE_NOTIFY_CHANGE_LAST_WRITE = 0x00000010
+        INVALID_HANDLE_VALUE = wintypes.HANDLE(-1).value
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.OpenProcess.restype = wintypes.HANDLE
+        kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+        kernel32.FindFirstChangeNotificationW.restype = wintypes.HANDLE
+        kernel32.FindFirstChangeNotificationW.argtypes = [wintypes.LPCWSTR, wintypes.BOOL, wintypes.DWORD]
+        kernel32.FindNextChangeNotification.argtypes = [wintypes.HANDLE]
+        kernel32.FindCloseChangeNotification.argtypes = [wintypes.HANDLE]
+        kernel32.WaitForMultipleObjects.restype = wintypes.DWORD
+        kernel32.WaitForMultipleObjects.argtypes = [
+            wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE), wintypes.BOOL, wintypes.DWORD
+        ]
+        kernel32.WaitForSingleObject.restype = wintypes.DWORD
+        kernel32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+        kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+        self._kernel32 = kernel32
+
+        handle = kernel32.OpenProcess(SYNCHRONIZE, False, self.parent_pid)
+        if handle:
+            self._win_handles.append(handle)
+            self.watches_parent = True
+
+        change = kernel32.FindFirstChangeNotificationW(
+            self.watch_dir, False, FILE_NOTIFY_CHANGE_FILE_NAME | FILE_NOTIFY_CHANGE_LAST_WRITE
+        )
+        if change and change != INVALID_HANDLE_VALUE:
+            self._win_change_handle = change
+            self._win_handles.append(change)
+            self.watches_dir = True
+
+    def _wait_windows(self, timeout: float):
+        from ctypes import wintypes
+
+        WAIT_OBJECT_0 = 0
+        count = len(self._win_handles)
+        handles = (wintypes.HANDLE * count)(*self._win_handles)
+        result = self._kernel32.WaitForMultipleObjects(count, handles, False, int(timeout * 1000))
+        index = result - WAIT_OBJECT_0
+        if 0 <= index < count and self._win_handles[index] == self._win_change_handle:
+            # 重新武装目录变化通知
+            self._kernel32.FindNextChangeNotification(self._win_change_handle)
+
+    # ==================== 公共接口 ====================
+
+    def enable_signal_wakeup(self) -> bool:
+        """
+        信号到来时立即打断 wait()（只能在主线程调用）
+
+        Windows 上 set_wakeup_fd 只接受 socket，无法加入 WaitForMultipleObjects，
+        返回 False，信号最迟在本次等待超时后被处理
+        """
+        if sys.platform == "win32" or self._wakeup_r >= 0:
+            return self._wakeup_r >= 0
+        try:
+            r, w = os.pipe()
+            os.set_blocking(r, False)
+            os.set_blocking(w, False)
+            signal.set_wakeup_fd(w, warn_on_full_buffer=False)
+        except (OSError, ValueError):
+            return False
+        self._wakeup_r, self._wakeup_w = r, w
+
+        try:
+            if self._epoll is not None:
+                self._epoll.register(r, select.EPOLLIN)
+            elif self._kqueue is not None:
+                self._kqueue.control([select.kevent(
+                    r, filter=select.KQ_FILTER_READ, flags=select.KQ_EV_ADD
+                )], 0)
+        except OSError:
+            pass
+        return True
+
+    def wait(self, timeout: float):
+        """阻塞直到有事件发生或超时（秒）；返回后调用方自行检查各项状态"""
+        try:
+            if self._epoll is not None:
+                for fd, _ in self._epoll.poll(timeout):
+                    if fd == self._inotify_fd:
+                        self._drain_inotify()
+                    elif fd == self._wakeup_r:
+                        self._drain_fd(fd)
+                return
+            if self._kqueue is not None:
+                for event in self._kqueue.control(None, 4, timeout):
+                    if event.filter == select.KQ_FILTER_PROC:
+                        self._kqueue_parent_exited = True
+                    elif event.ident == self._wakeup_r:
+                        self._drain_fd(self._wakeup_r)
+                return
+            if self._win_handles:
+                self._wait_windows(timeout)
+                return
+            if self._wakeup_r >= 0:
+                if select.select([self._wakeup_r], [], [], timeout)[0]:
+                    self._drain_fd(self._wakeup_r)
+                return
+        except InterruptedError:
+            return
+        except OSError:
+            pass
+        time.sleep(timeout)
+
+    def parent_exited(self) -> Optional[bool]:
+        """
+        父进程是否已退出（不阻塞）
+
+        pidfd 可读 / 进程句柄有信号即表示已退出，只需一次系统调用，
+        不需要 psutil 构造 Process 对象或扫描 /proc。无法判断时返回 None，由调用方回退
+        """
+        if not self.watches_parent:
+            return None
+        try:
+            if self._pidfd >= 0:
+                readable, _, _ = select.select([self._pidfd], [], [], 0)
+                return bool(readable)
+            if self._kqueue is not None:
+                if not self._kqueue_parent_exited:
+                    for event in self._kqueue.control(None, 4, 0):
+                        if event.filter == select.KQ_FILTER_PROC:
+                            self._kqueue_parent_exited = True
+                return self._kqueue_parent_exited
+            if self._win_handles and self._win_handles[0] != self._win_change_handle:
+                WAIT_OBJECT_0 = 0
+                return self._kernel32.WaitForSingleObject(self._win_handles[0], 0) == WAIT_OBJECT_0
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def close(self):
+        """释放所有文件描述符/句柄"""
+        if self._wakeup_w >= 0:
+            try:
+                signal.set_wakeup_fd(-1)
+            except ValueError:
+                pass
+        for fd in (self._pidfd, self._inotify_fd, self._dir_fd, self._wakeup_r, self._wakeup_w):
+            if fd >= 0:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._pidfd = self._inotify_fd = self._dir_fd = self._wakeup_r = self._wakeup_w = -1
+
+        if self._epoll is not None:
+            self._epoll.close()
+            self._epoll = None
+        if self._kqueue is not None:
+            self._kqueue.close()
+            self._kqueue = None
+
+        if self._win_handles:
+            for handle in self._win_handles:
+                if handle == self._win_change_handle:
+                    self._kernel32.FindCloseChangeNotification(handle)
+                else:
+                    self._kernel32.CloseHandle(handle)
+            self._win_handles = []
+            self._win_change_handle = None
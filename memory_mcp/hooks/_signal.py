@@ -0,0 +1,65 @@
+"""
+关闭信号文件的读写
+
+SessionEnd hook（session_end.py）写入、监控进程（session_monitor.py）读取后删除。
+信号只在这两个脚本之间传递，格式完全由我们决定，因此不用 JSON，
+而是一条定长头部 + UTF-8 原因字符串的二进制记录：
+
+  magic (u32, "MSS1") | timestamp_ns (u64) | pid (u32) | reason_len (u16) | reason (UTF-8)
+
+写入方先写 .close_signal.tmp 再 os.replace 改名，读取方看到的文件总是完整的。
+"""
+
+import os
+import struct
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+# 关闭信号文件名（位于 {project}/.claude/memory/ 下）
+CLOSE_SIGNAL_FILE = ".close_signal"
+
+SIGNAL_MAGIC = 0x3153534D  # 小端字节序下为 b"MSS1"
+SIGNAL_STRUCT = struct.Struct("<IQIH")
+
+
+def write_close_signal(path: str, reason: str, pid: int):
+    """原子写入关闭信号（一次 write + 一次 rename）"""
+    reason_bytes = reason.encode('utf-8')[:0xFFFF]
+    data = SIGNAL_STRUCT.pack(SIGNAL_MAGIC, time.time_ns(), pid, len(reason_bytes)) + reason_bytes
+
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+
+
+def read_close_signal(path: str) -> Optional[Dict]:
+    """
+    读取关闭信号
+
+    Returns:
+        {"reason", "timestamp", "pid"}；文件不存在时返回 None。
+        无法识别的内容（如旧版本写入的 JSON）同样视为关闭信号，reason 为 "unknown"
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(data) < SIGNAL_STRUCT.size:
+        return {"reason": "unknown", "timestamp": None, "pid": 0}
+    magic, timestamp_ns, pid, reason_len = SIGNAL_STRUCT.unpack_from(data)
+    if magic != SIGNAL_MAGIC:
+        return {"reason": "unknown", "timestamp": None, "pid": 0}
+
+    reason = data[SIGNAL_STRUCT.size:SIGNAL_STRUCT.size + reason_len].decode('utf-8', 'replace')
+    return {
+        "reason": reason,
+        "timestamp": datetime.fromtimestamp(timestamp_ns / 1e9).isoformat(),
+        "pid": pid,
+    }
@@ -6,44 +6,146 @@
 """
 
 import sys
-import json
 import os
-import io
+import signal
 import threading
+from datetime import datetime
 
 # Hook 超时设置（秒）- 必须小于 Claude Code hook 的 10 秒超时
 HOOK_TIMEOUT = 8
 
-# Windows 下设置 stdin/stdout 为 UTF-8 编码
-if sys.platform == 'win32':
-    sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+from memory_mcp import _jsonio
+from memory_mcp.hooks import _ipc
 
-from memory_mcp.memory import MemoryManager
-from memory_mcp.vector import is_encoder_ready
+# 暂存消息文件名（与 MemoryManager.pending_messages_file 保持一致）
+PENDING_MESSAGES_FILE = "pending_messages.jsonl"
 
 
-def timeout_handler():
+def write_output(output: dict):
+    """
+    输出 hook 结果
+
+    直接向 stdout 的二进制缓冲写入 UTF-8 JSON，不依赖控制台编码（Windows 下无需包装 stdout）
+    """
+    sys.stdout.buffer.write(_jsonio.dumps(output) + b"\n")
+    sys.stdout.buffer.flush()
+
+
+def timeout_handler(*_):
     """超时时强制退出，返回空结果"""
-    print(json.dumps({}))
+    write_output({})
     os._exit(0)
 
 
-def main():
-    # 设置超时保护（使用 threading.Timer 因为 Windows 不支持 signal.alarm）
-    timer = threading.Timer(HOOK_TIMEOUT, timeout_handler)
+# 已启动的线程版超时保护，cancel_watchdog 时统一取消
+_watchdog_timers = []
+
+
+def start_watchdog(seconds: float):
+    """
+    启动超时保护
+
+    Unix 使用 SIGALRM 定时器，不需要额外线程；Windows 不支持 SIGALRM，使用 threading.Timer
+    """
+    if hasattr(signal, "setitimer"):
+        signal.signal(signal.SIGALRM, timeout_handler)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+    else:
+        start_thread_watchdog(seconds)
+
+
+def start_thread_watchdog(seconds: float):
+    """线程版超时保护：即使主线程阻塞在 C 扩展调用中也能触发"""
+    timer = threading.Timer(max(seconds, 0.0), timeout_handler)
     timer.daemon = True
     timer.start()
+    _watchdog_timers.append(timer)
+
+
+def cancel_watchdog():
+    """取消所有超时保护"""
+    for timer in _watchdog_timers:
+        timer.cancel()
+    _watchdog_timers.clear()
+    if hasattr(signal, "setitimer"):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def build_context(memories: dict) -> str:
+    """把 recall 结果整理为注入给 Claude 的上下文文本，没有记忆时返回空字符串"""
+    context_parts = []
+
+    # 添加相关情景
+    if memories.get("episodes"):
+        context_parts.append("【相关情景记忆】")
+        for ep in memories["episodes"][:2]:
+            context_parts.append(f"- {ep.get('content', '')[:200]}")
+
+    # 添加相关实体
+    if memories.get("entities"):
+        context_parts.append("\n【相关知识/决策】")
+        for ent in memories["entities"][:3]:
+            ent_type = ent.get("metadata", {}).get("type", "")
+            context_parts.append(f"- [{ent_type}] {ent.get('content', '')[:150]}")
+
+    # 添加当前情景信息
+    current = memories.get("current", {})
+    if current.get("episode"):
+        context_parts.append(f"\n【当前任务】{current['episode'].get('title', '')}")
+
+    return "\n".join(context_parts)
+
+
+def append_pending_message(project_path: str, role: str, content: str):
+    """
+    把消息追加到暂存文件（只写一行 JSON，不初始化 MemoryManager）
+
+    监控进程编码器就绪后会把暂存消息并入情景；MCP 服务或下一次创建的 MemoryManager 也会并入
+    """
+    memory_dir = os.path.join(project_path, ".claude", "memory")
+    os.makedirs(memory_dir, exist_ok=True)
+    line = _jsonio.dumps({
+        "role": role,
+        "content": content,
+        "timestamp": datetime.now().isoformat(),
+    }) + b"\n"
+    # O_APPEND 单次写入一行，多个 hook 并发追加也不会交错
+    with open(os.path.join(memory_dir, PENDING_MESSAGES_FILE), 'ab') as f:
+        f.write(line)
+
+
+def cache_and_recall(project_path: str, role: str, content: str, top_k: int = 3):
+    """
+    保存消息并在编码器就绪时检索相关记忆
+
+    优先交给监控进程处理（常驻 MemoryManager，编码器已预热）；
+    监控进程不在运行时本进程的编码器必然未加载，无法 recall，
+    因此只把消息追加到暂存文件，不再为保存一条消息初始化 MemoryManager。
+    返回 recall 结果，编码器未就绪时返回 None
+    """
+    reply = _ipc.request(
+        project_path,
+        {"op": "cache_message", "role": role, "content": content, "recall_top_k": top_k},
+        timeout=HOOK_TIMEOUT - 1,
+    )
+    if reply is not None:
+        return reply.get("memories") if reply.get("ok") else None
+
+    append_pending_message(project_path, role, content)
+    return None
 
+
+def main():
     content = ""
     role = "user"
     hook_input = {}  # 初始化，确保后续使用时不会报 NameError
 
     # 从 stdin 读取 hook 输入（JSON 格式）
     try:
-        input_data = sys.stdin.read()
+        # 直接读取原始字节交给 JSON 解析，省去一次文本解码
+        input_data = sys.stdin.buffer.read()
         if input_data:
-            hook_input = json.loads(input_data)
+            hook_input = _jsonio.loads(input_data)
             content = hook_input.get("prompt", "")
     except:
         pass
@@ -54,10 +156,12 @@ def main():
         content = sys.argv[2]
 
     if not content:
-        timer.cancel()
-        print(json.dumps({}))
+        write_output({})
         sys.exit(0)
 
+    # 设置超时保护（没有内容时直接退出，无需定时器）
+    start_watchdog(HOOK_TIMEOUT)
+
     try:
         # 获取项目路径
         # 优先使用 os.getcwd()，因为 hook 传入的 cwd 在 Windows 上可能有中文编码问题
@@ -65,47 +169,13 @@ def main():
         hook_cwd = hook_input.get("cwd", "")
         project_path = actual_cwd or hook_cwd or os.environ.get("CLAUDE_PROJECT_DIR", "")
 
-        # 初始化记忆管理器
-        manager = MemoryManager(project_path=project_path)
-
-        # 1. 保存用户消息（这个操作很快，不会阻塞）
-        manager.cache_message(role, content)
-
-        # 2. 检查编码器是否就绪，如果没就绪就跳过 recall
-        if not is_encoder_ready():
-            # 编码器还在加载中，跳过 recall，只保存消息
-            timer.cancel()
-            print(json.dumps({}))
-            sys.exit(0)
+        memories = cache_and_recall(project_path, role, content, top_k=3)
 
-        # 3. 检索相关记忆（只在编码器就绪时执行）
-        memories = manager.recall(content, top_k=3)
-
-        # 3. 构建上下文
-        context_parts = []
-
-        # 添加相关情景
-        if memories.get("episodes"):
-            context_parts.append("【相关情景记忆】")
-            for ep in memories["episodes"][:2]:
-                context_parts.append(f"- {ep.get('content', '')[:200]}")
-
-        # 添加相关实体
-        if memories.get("entities"):
-            context_parts.append("\n【相关知识/决策】")
-            for ent in memories["entities"][:3]:
-                ent_type = ent.get("metadata", {}).get("type", "")
-                context_parts.append(f"- [{ent_type}] {ent.get('content', '')[:150]}")
-
-        # 添加当前情景信息
-        current = memories.get("current", {})
-        if current.get("episode"):
-            context_parts.append(f"\n【当前任务】{current['episode'].get('title', '')}")
+        # 编码器还在加载中时只保存了消息，不注入上下文
+        additional_context = build_context(memories) if memories else ""
 
         # 如果有记忆，返回上下文
-        if context_parts:
-            additional_context = "\n".join(context_parts)
-
+        if additional_context:
             # 返回 hook 输出，添加上下文
             output = {
                 "hookSpecificOutput": {
@@ -113,16 +183,16 @@ def main():
                     "additionalContext": additional_context
                 }
             }
-            timer.cancel()
-            print(json.dumps(output, ensure_ascii=False))
+            cancel_watchdog()
+            write_output(output)
         else:
-            timer.cancel()
-            print(json.dumps({}))
+            cancel_watchdog()
+            write_output({})
 
     except Exception as e:
         # 出错时不阻塞，静默失败
-        timer.cancel()
-        print(json.dumps({}))
+        cancel_watchdog()
+        write_output({})
 
     sys.exit(0)
 
@@ -6,63 +6,86 @@
 """
 
 import sys
-import json
 import os
-import io
+import mmap
+from typing import Optional
 
-# Windows 下设置 stdin/stdout 为 UTF-8 编码
-if sys.platform == 'win32':
-    sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+from memory_mcp import _jsonio
+from memory_mcp.hooks import _ipc
 
-from memory_mcp.memory import MemoryManager
+# assistant 条目必然包含的字节串（不限定冒号两侧空格，紧凑与带空格的 JSON 都能命中）
+_ASSISTANT_MARKER = b'"assistant"'
+
+
+def _assistant_text(entry: dict) -> Optional[str]:
+    """从 transcript 条目中提取 assistant 文本；不是带文本的 assistant 条目时返回 None"""
+    if entry.get("type") != "assistant":
+        return None
+
+    # 提取文本内容
+    message = entry.get("message", {})
+    content_parts = message.get("content", [])
+
+    text_parts = []
+    for part in content_parts:
+        if isinstance(part, dict) and part.get("type") == "text":
+            text_parts.append(part.get("text", ""))
+        elif isinstance(part, str):
+            text_parts.append(part)
+
+    if not text_parts:
+        return None
+    return "\n".join(text_parts)
 
 
 def extract_last_assistant_message(transcript_path: str) -> str:
-    """从 transcript 文件提取最后一条 assistant 消息"""
+    """
+    从 transcript 文件提取最后一条 assistant 消息
+
+    transcript 会随会话无限增长，这里用 mmap 从文件末尾逐行向前查找，
+    找到第一条带文本的 assistant 条目即返回，不解析前面的历史记录
+    """
     if not transcript_path or not os.path.exists(transcript_path):
         return ""
 
-    last_assistant_content = ""
-
     try:
-        with open(transcript_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                if not line.strip():
-                    continue
-                try:
-                    entry = json.loads(line)
-                    # 查找 assistant 类型的消息
-                    if entry.get("type") == "assistant":
-                        # 提取文本内容
-                        message = entry.get("message", {})
-                        content_parts = message.get("content", [])
-
-                        text_parts = []
-                        for part in content_parts:
-                            if isinstance(part, dict) and part.get("type") == "text":
-                                text_parts.append(part.get("text", ""))
-                            elif isinstance(part, str):
-                                text_parts.append(part)
-
-                        if text_parts:
-                            last_assistant_content = "\n".join(text_parts)
-                except json.JSONDecodeError:
-                    continue
+        with open(transcript_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = len(mm)
+                while end > 0:
+                    start = mm.rfind(b"\n", 0, end) + 1
+                    line = mm[start:end]
+                    end = start - 1
+                    # 先做字节级过滤：不含 "assistant" 的行（用户消息、工具结果等）不进入 JSON 解析
+                    if _ASSISTANT_MARKER not in line:
+                        continue
+                    try:
+                        entry = _jsonio.loads(line)
+                    except ValueError:
+                        # 末尾可能是正在写入的半行
+                        continue
+                    if not isinstance(entry, dict):
+                        continue
+                    text = _assistant_text(entry)
+                    if text is not None:
+                        return text
     except Exception:
         pass
 
-    return last_assistant_content
+    return ""
 
 
 def main():
     # 从 stdin 读取 hook 输入
     try:
-        input_data = sys.stdin.read()
+        # 直接读取原始字节交给 JSON 解析，省去一次文本解码
+        input_data = sys.stdin.buffer.read()
         if not input_data:
             sys.exit(0)
 
-        hook_input = json.loads(input_data)
+        hook_input = _jsonio.loads(input_data)
         transcript_path = hook_input.get("transcript_path", "")
 
         if not transcript_path:
@@ -84,11 +107,14 @@ def main():
         hook_cwd = hook_input.get("cwd", "")
         project_path = actual_cwd or hook_cwd or os.environ.get("CLAUDE_PROJECT_DIR", "")
 
-        # 初始化记忆管理器
-        manager = MemoryManager(project_path=project_path)
+        # 优先交给监控进程保存；监控进程不在运行时才在本进程初始化记忆管理器
+        reply = _ipc.request(project_path, {"op": "cache_message", "role": "assistant", "content": content})
+        if reply is None:
+            from memory_mcp.memory import MemoryManager
+            manager = MemoryManager(project_path=project_path)
 
-        # 保存 assistant 消息
-        manager.cache_message("assistant", content)
+            # 保存 assistant 消息
+            manager.cache_message("assistant", content)
 
     except Exception as e:
         # 出错时静默失败，不阻塞
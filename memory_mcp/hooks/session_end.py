@@ -9,37 +9,56 @@
 """
 
 import sys
-import json
+import atexit
 import os
-import io
+import functools
+import json
+import mmap
 from datetime import datetime
 from pathlib import Path
 
-# Windows 下设置 stdin/stdout 为 UTF-8 编码
-if sys.platform == 'win32':
-    sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-
 # 日志文件路径（用户级，始终可写）
 LOG_FILE = Path.home() / ".claude" / "memory" / "hook_debug.log"
 
-# 关闭信号文件名（与 session_monitor.py 保持一致）
-CLOSE_SIGNAL_FILE = ".close_signal"
+from memory_mcp.hooks._signal import CLOSE_SIGNAL_FILE, write_close_signal as _write_signal_file
+
+# 活跃情景的状态字段（兼容带缩进与紧凑两种 JSON 写法）
+# 消息内容中的引号会被转义为 \"，不会误命中
+_ACTIVE_MARKERS = (b'"status": "active"', b'"status":"active"')
+
+
+# 日志先缓存在内存中，进程退出时一次性追加写入，避免每行一次 open/close
+# 设置环境变量 MEMORY_MCP_HOOK_LOG=0 可完全关闭调试日志
+_LOG_ENABLED = os.environ.get("MEMORY_MCP_HOOK_LOG", "1") != "0"
+_log_buffer: list = []
 
 
 def log(message: str):
-    """写入调试日志"""
+    """写入调试日志（缓存，退出时落盘）"""
+    if _LOG_ENABLED:
+        _log_buffer.append(f"[{datetime.now().isoformat()}] [SessionEnd] {message}\n")
+
+
+def _flush_log():
+    """把缓存的日志一次性写入文件"""
+    if not _log_buffer:
+        return
     try:
         LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
         with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"[{datetime.now().isoformat()}] [SessionEnd] {message}\n")
+            f.write("".join(_log_buffer))
+        _log_buffer.clear()
     except:
         pass
 
 
+atexit.register(_flush_log)
+
+
+@functools.lru_cache(maxsize=8)
 def get_close_signal_path(project_path: str) -> Path:
-    """获取关闭信号文件路径"""
-    return Path(project_path) / ".claude" / "memory" / CLOSE_SIGNAL_FILE
+    """获取关闭信号文件路径（按项目路径缓存，避免重复拼接 Path）"""
+    return Path(project_path, ".claude", "memory", CLOSE_SIGNAL_FILE)
 
 
 def write_close_signal(project_path: str, reason: str = "session_end"):
@@ -47,29 +66,26 @@ def write_close_signal(project_path: str, reason: str = "session_end"):
     signal_file = get_close_signal_path(project_path)
     signal_file.parent.mkdir(parents=True, exist_ok=True)
 
-    signal = {
-        "reason": reason,
-        "timestamp": datetime.now().isoformat(),
-        "pid": os.getpid()
-    }
-
-    with open(signal_file, 'w', encoding='utf-8') as f:
-        json.dump(signal, f, ensure_ascii=False)
+    # 二进制定长记录，先写临时文件再原子改名（格式见 _signal.py）
+    _write_signal_file(str(signal_file), reason, os.getpid())
 
     log(f"关闭信号已写入: {signal_file}")
 
 
 def episode_still_active(project_path: str) -> bool:
-    """检查情景是否仍然活跃"""
+    """
+    检查情景是否仍然活跃
+
+    只需要一个布尔结果，用 mmap 直接在文件字节中查找状态字段，
+    不构建完整的 JSON 对象（消息较多时 active_episode.json 可能较大）
+    """
     try:
         episode_file = Path(project_path) / ".claude" / "memory" / "active_episode.json"
-        if not episode_file.exists():
-            return False
-
-        with open(episode_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            episode = data.get("episode")
-            return episode is not None and episode.get("status") == "active"
+        with open(episode_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return any(mm.find(marker) != -1 for marker in _ACTIVE_MARKERS)
     except Exception:
         return False
 
@@ -81,17 +97,31 @@ def remove_project_trust(project_path: str):
     """
     try:
         claude_json = Path.home() / ".claude.json"
-        if not claude_json.exists():
-            return
-
-        with open(claude_json, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        projects = data.get('projects', {})
 
         # .claude.json 中 key 使用正斜杠格式，os.getcwd() 返回反斜杠
         project_key = project_path.replace('\\', '/')
 
+        # 快速路径：.claude.json 可能有几百 KB，先在原始字节中查找项目 key 和字段名，
+        # 两者缺一即可确定无需修改，省去完整的解析与重写
+        with open(claude_json, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm.find(b'"hasTrustDialogAccepted"') == -1:
+                    log(f"项目 {project_key} 没有 hasTrustDialogAccepted，跳过")
+                    return
+                if mm.find(json.dumps(project_key, ensure_ascii=False).encode('utf-8')) == -1:
+                    log(f"项目 {project_key} 不在 .claude.json 中，跳过")
+                    return
+
+        # 只有确实需要改写时才导入 orjson 兼容层（orjson 自身导入约十几毫秒，
+        # 对只处理几十字节 JSON 的常规路径来说比标准库解析还贵）
+        from memory_mcp import _jsonio
+
+        data = _jsonio.loads(claude_json.read_bytes())
+
+        projects = data.get('projects', {})
+
         if project_key not in projects:
             log(f"项目 {project_key} 不在 .claude.json 中，跳过")
             return
@@ -103,10 +133,20 @@ def remove_project_trust(project_path: str):
 
         del project_data['hasTrustDialogAccepted']
 
-        with open(claude_json, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        # 先写同目录临时文件再原子替换，避免中途崩溃留下空文件或半截 JSON
+        # 保持 2 空格缩进，与 Claude Code 自身写出的格式一致
+        tmp_file = claude_json.with_name(claude_json.name + '.tmp')
+        tmp_file.write_bytes(_jsonio.dumps(data, indent=True))
+        try:
+            os.replace(tmp_file, claude_json)
+        except PermissionError:
+            # Windows 上目标文件被其他进程占用时无法替换，退回直接覆盖
+            claude_json.write_bytes(tmp_file.read_bytes())
+            tmp_file.unlink(missing_ok=True)
 
         log(f"已移除项目 {project_key} 的 hasTrustDialogAccepted")
+    except FileNotFoundError:
+        return
     except Exception as e:
         log(f"移除信任状态失败: {e}")
 
@@ -119,8 +159,9 @@ def main():
 
     try:
         # 从 stdin 读取 hook 输入
-        input_data = sys.stdin.read()
-        log(f"stdin 输入: {input_data[:500] if input_data else '(空)'}")
+        # 直接读取原始字节交给 JSON 解析，省去一次文本解码
+        input_data = sys.stdin.buffer.read()
+        log(f"stdin 输入: {input_data[:500].decode('utf-8', 'replace') if input_data else '(空)'}")
 
         hook_input = json.loads(input_data) if input_data else {}
         log(f"解析后的 hook_input: {hook_input}")
@@ -140,6 +181,8 @@ def main():
         else:
             # 写入关闭信号，由监控进程处理
             reason = hook_input.get("reason", "session_end")
+            # 监控进程收到信号后会写同一个日志文件，先落盘本进程的缓存
+            _flush_log()
             write_close_signal(project_path, reason=reason)
             log(f"关闭信号已发送，原因: {reason}")
 
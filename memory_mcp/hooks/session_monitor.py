@@ -11,131 +11,399 @@
 2. 监听终端退出
 3. 监听关闭信号文件（由 session_end.py 写入）
 4. 执行情景关闭（此时编码器已就绪）
+5. 代 auto_save / save_response 执行消息缓存与检索（见 _ipc.py），
+   hook 无需各自初始化 MemoryManager
 """
 
 import sys
 import os
-import json
+import functools
+import mmap
 import time
 import argparse
-from datetime import datetime
+import signal
+import threading
+from collections import namedtuple
 from pathlib import Path
 
+from memory_mcp import _jsonio
+from memory_mcp.hooks._signal import CLOSE_SIGNAL_FILE, read_close_signal
+
+# 监控进程启动后必然预热编码器，向量存储与记忆管理器在模块加载时导入一次，
+# 之后 wait_for_encoder 的轮询、每次 hook 请求都不再经过 import 机制。
+# 导入失败时监控进程仍能监听终端生命周期，只是无法预热编码器和关闭情景
+try:
+    from memory_mcp.vector.store import (
+        start_encoder_warmup,
+        is_encoder_ready,
+        wait_for_encoder as _wait_for_encoder,
+        begin_shutdown_encoder as _begin_shutdown_encoder,
+    )
+    from memory_mcp.memory import MemoryManager
+    _import_error = None
+except Exception as e:
+    start_encoder_warmup = is_encoder_ready = _wait_for_encoder = _begin_shutdown_encoder = MemoryManager = None
+    _import_error = e
+
 # 日志文件路径（用户级，始终可写）
 LOG_FILE = Path.home() / ".claude" / "memory" / "hook_debug.log"
 
-# 关闭信号文件名
-CLOSE_SIGNAL_FILE = ".close_signal"
+# 心跳文件名（与 session_start.py 保持一致），监控进程存活期间定期更新其 mtime
+HEARTBEAT_FILE = "monitor.heartbeat"
+HEARTBEAT_INTERVAL = 10  # 秒
+
+# hook 在 IPC 不可用时暂存消息的文件名（与 auto_save.py、MemoryManager 保持一致）
+PENDING_MESSAGES_FILE = "pending_messages.jsonl"
+# 并入过程中的暂存消息文件名（与 MemoryManager.drain_pending_messages 保持一致）
+PENDING_DRAINING_FILE = "pending_messages.draining"
+
+# 监控进程长期运行，日志文件只打开一次并保持打开；
+# 行缓冲保证每条日志一次 write 落盘（O_APPEND 追加，与 hook 进程并发写入也不会交错）
+_log_file = None
+
+# 时间戳中到秒的部分每秒只格式化一次（[整秒, 前缀]），格式与 datetime.isoformat() 一致，
+# 便于和 hook 进程写入同一日志文件的行对齐
+_ts_cache = [0, ""]
+
+
+def _timestamp() -> str:
+    now = time.time()
+    sec = int(now)
+    if sec != _ts_cache[0]:
+        _ts_cache[0] = sec
+        _ts_cache[1] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(sec))
+    return f"{_ts_cache[1]}.{int((now - sec) * 1e6):06d}"
 
 
 def log(message: str):
     """写入调试日志"""
+    global _log_file
     try:
-        LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"[{datetime.now().isoformat()}] [Monitor] {message}\n")
+        if _log_file is None:
+            LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+            _log_file = open(LOG_FILE, "a", encoding="utf-8", buffering=1)
+        _log_file.write(f"[{_timestamp()}] [Monitor] {message}\n")
     except:
         pass
 
 
+def _is_pid_alive_windows(pid: int) -> bool:
+    """
+    Windows: 通过 OpenProcess(SYNCHRONIZE) + WaitForSingleObject(0) 检查进程是否存活（不启动 tasklist）
+
+    进程对象在退出时变为有信号状态，WAIT_TIMEOUT 即存活；
+    不依赖退出码，避免退出码恰好为 STILL_ACTIVE(259) 的进程被误判为存活
+    """
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        SYNCHRONIZE = 0x00100000
+        WAIT_TIMEOUT = 0x00000102
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.OpenProcess.restype = wintypes.HANDLE
+        kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+        kernel32.WaitForSingleObject.restype = wintypes.DWORD
+        kernel32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+        kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+
+        handle = kernel32.OpenProcess(SYNCHRONIZE, False, pid)
+        if not handle:
+            # ERROR_ACCESS_DENIED 说明进程存在但无权访问
+            return ctypes.get_last_error() == 5
+        try:
+            return kernel32.WaitForSingleObject(handle, 0) == WAIT_TIMEOUT
+        finally:
+            kernel32.CloseHandle(handle)
+    except Exception:
+        return False
+
+
 def is_process_alive(pid: int) -> bool:
     """检查进程是否存活（跨平台）"""
+    if sys.platform == "win32":
+        # 一次 OpenProcess + WaitForSingleObject 即可，无需导入 psutil
+        return _is_pid_alive_windows(pid)
     try:
         import psutil
         proc = psutil.Process(pid)
         return proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE
     except ImportError:
-        # psutil 不可用时，使用系统命令
-        if sys.platform == "win32":
-            import subprocess
-            try:
-                result = subprocess.run(
-                    ["tasklist", "/FI", f"PID eq {pid}"],
-                    capture_output=True,
-                    text=True,
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-                return str(pid) in result.stdout
-            except:
-                return False
-        else:
-            # Unix: 发送信号 0 检查进程是否存在
-            try:
-                os.kill(pid, 0)
-                return True
-            except OSError:
-                return False
+        # psutil 不可用时，发送信号 0 检查进程是否存在
+        try:
+            os.kill(pid, 0)
+            return True
+        except OSError:
+            return False
     except Exception:
         return False
 
 
-def get_active_episode_path(project_path: str) -> Path:
-    """获取活跃情景文件路径"""
-    return Path(project_path) / ".claude" / "memory" / "active_episode.json"
+def is_parent_alive(waiter, parent_pid: int) -> bool:
+    """
+    检查被监控的父进程是否存活
+
+    优先查询事件等待器持有的 pidfd / 进程句柄（一次非阻塞系统调用），
+    无法判断时回退到 is_process_alive
+    """
+    if waiter is not None:
+        exited = waiter.parent_exited()
+        if exited is not None:
+            return not exited
+    return is_process_alive(parent_pid)
+
+
+# 监控进程用到的各文件路径（均为 str：os.stat/open 直接接受，不必每次由 Path 转换）
+MonitorPaths = namedtuple("MonitorPaths", "project memory_dir episode close_signal heartbeat pending")
+
+
+@functools.lru_cache(maxsize=8)
+def get_monitor_paths(project_path: str) -> MonitorPaths:
+    """按项目路径一次性拼好所有文件路径，main() 中构造后传给主循环里的各个检查函数"""
+    memory_dir = os.path.join(project_path, ".claude", "memory")
+    return MonitorPaths(
+        project=project_path,
+        memory_dir=memory_dir,
+        episode=os.path.join(memory_dir, "active_episode.json"),
+        close_signal=os.path.join(memory_dir, CLOSE_SIGNAL_FILE),
+        heartbeat=os.path.join(memory_dir, HEARTBEAT_FILE),
+        pending=os.path.join(memory_dir, PENDING_MESSAGES_FILE),
+    )
 
 
-def get_close_signal_path(project_path: str) -> Path:
-    """获取关闭信号文件路径"""
-    return Path(project_path) / ".claude" / "memory" / CLOSE_SIGNAL_FILE
+def touch_heartbeat(paths: MonitorPaths):
+    """更新心跳文件的 mtime，让 SessionStart 不必遍历进程树即可确认监控进程在运行"""
+    try:
+        os.utime(paths.heartbeat)
+    except FileNotFoundError:
+        try:
+            open(paths.heartbeat, 'ab').close()
+        except OSError:
+            pass
+    except OSError:
+        pass
+
+
+def remove_heartbeat(paths: MonitorPaths):
+    """监控进程退出时删除心跳文件"""
+    try:
+        os.unlink(paths.heartbeat)
+    except OSError:
+        pass
 
 
-def check_close_signal(project_path: str) -> dict:
+# 超过该大小的 JSON 文件通过 mmap 解析，不再先读出一份 bytes 副本
+# （active_episode.json 会随消息增多而变大；小文件直接 read 更快）
+MMAP_MIN_SIZE = 64 * 1024
+
+
+def read_json_file(path: str):
+    """读取并解析 JSON 文件，空文件返回 None；大文件映射到内存后直接交给解析器"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        if size < MMAP_MIN_SIZE:
+            return _jsonio.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # memoryview 必须在 mmap 关闭前释放
+            with memoryview(mm) as view:
+                return _jsonio.loads(view)
+
+
+def check_close_signal(paths: MonitorPaths) -> dict:
     """
     检查是否有关闭信号文件
 
     Returns:
         信号内容（dict），如果没有信号则返回 None
     """
-    signal_file = get_close_signal_path(project_path)
-    if signal_file.exists():
-        try:
-            with open(signal_file, 'r', encoding='utf-8') as f:
-                signal = json.load(f)
-            # 读取后删除信号文件
-            signal_file.unlink()
-            return signal
-        except Exception as e:
-            log(f"读取关闭信号文件出错: {e}")
-            # 删除可能损坏的信号文件
+    # session_end.py 先写 .close_signal.tmp 再 os.replace 改名，信号文件一旦出现内容就是完整的
+    signal = read_close_signal(paths.close_signal)
+    if signal is None:
+        return None
+    # 读取后删除信号文件
+    try:
+        os.unlink(paths.close_signal)
+    except FileNotFoundError:
+        pass
+    return signal
+
+
+# 常驻的记忆管理器（首个 hook 请求到来时创建），hook 请求在 IPC 线程中串行处理
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def _reload_manager(project_path: str):
+    """获取常驻的记忆管理器并从磁盘刷新状态（调用方需持有 _manager_lock）"""
+    global _manager
+
+    if _manager is None:
+        if MemoryManager is None:
+            raise RuntimeError(f"无法导入 MemoryManager: {_import_error}")
+        _manager = MemoryManager(project_path=project_path)
+    else:
+        # 情景文件和待确认实体可能被 MCP 服务或其他 hook 修改过，先从磁盘刷新
+        _manager._load_active_episode()
+        _manager._load_pending_entities()
+        # 先并入 hook 暂存的消息，保持消息顺序
+        _manager.drain_pending_messages()
+    return _manager
+
+
+def handle_hook_request(project_path: str, req: dict) -> dict:
+    """处理来自 hook 的 IPC 请求"""
+    op = req.get("op")
+    if op != "cache_message":
+        return {"ok": False, "error": f"unknown op: {op}"}
+
+    with _manager_lock:
+        manager = _reload_manager(project_path)
+        manager.cache_message(req.get("role", "user"), req.get("content", ""))
+
+        memories = None
+        top_k = req.get("recall_top_k", 0)
+        if top_k and encoder_ready():
+            memories = manager.recall(req.get("content", ""), top_k=top_k)
+
+    return {"ok": True, "memories": memories}
+
+
+def try_signal_shutdown(paths: MonitorPaths) -> bool:
+    """有关闭信号时按信号关闭情景，返回 True 表示监控进程应退出"""
+    signal = check_close_signal(paths)
+    if not signal:
+        return False
+
+    log(f"收到关闭信号: {signal}")
+    if episode_still_active(paths):
+        close_episode(paths.project, reason="session_end_signal")
+    else:
+        log("情景已被关闭，跳过")
+    return True
+
+
+def has_pending_messages(paths: MonitorPaths) -> bool:
+    """hook 是否在 IPC 不可用期间暂存了消息（含上次并入中断时留下的 pending_messages.draining）"""
+    return os.path.exists(paths.pending) or os.path.exists(os.path.join(paths.memory_dir, PENDING_DRAINING_FILE))
+
+
+def drain_pending_messages(project_path: str):
+    """编码器就绪后把 hook 暂存的消息并入情景"""
+    try:
+        with _manager_lock:
+            # 首次创建 MemoryManager 时构造函数内已完成并入
+            count = _reload_manager(project_path).drain_pending_messages()
+        if count:
+            log(f"已并入 {count} 条暂存消息")
+    except Exception as e:
+        log(f"并入暂存消息失败: {type(e).__name__}: {e}")
+
+
+def start_hook_server(project_path: str):
+    """启动 hook IPC 监听，失败时 hook 会自动回退到进程内处理"""
+    try:
+        from memory_mcp.hooks._ipc import HookServer
+        server = HookServer(project_path, lambda req: handle_hook_request(project_path, req))
+        server.start()
+        log(f"hook IPC 已监听: {server.address}")
+        return server
+    except Exception as e:
+        log(f"启动 hook IPC 失败: {e}")
+        return None
+
+
+def create_waiter(parent_pid: int, paths: MonitorPaths):
+    """创建事件等待器，失败时返回 None（主循环回退到定时轮询）"""
+    try:
+        from memory_mcp.hooks._lifecycle import LifecycleWaiter
+        waiter = LifecycleWaiter(parent_pid, paths.memory_dir)
+        log(f"事件等待: 父进程={waiter.watches_parent}, 目录={waiter.watches_dir}")
+        return waiter
+    except Exception as e:
+        log(f"创建事件等待器失败，回退到轮询: {e}")
+        return None
+
+
+# 收到 SIGTERM/SIGINT 时置位，主循环在下一次唤醒时退出并执行 finally 中的清理
+_stop_event = threading.Event()
+
+
+def _handle_stop_signal(signum, frame):
+    _stop_event.set()
+
+
+def install_stop_handlers(waiter):
+    """注册终止信号处理（supervisor 通常先发 SIGTERM），并让信号立即打断事件等待"""
+    for name in ("SIGTERM", "SIGINT"):
+        signum = getattr(signal, name, None)
+        if signum is not None:
             try:
-                signal_file.unlink()
-            except:
+                signal.signal(signum, _handle_stop_signal)
+            except (OSError, ValueError):
                 pass
-    return None
+    if waiter is not None:
+        waiter.enable_signal_wakeup()
+
+
+def encoder_ready() -> bool:
+    """编码器是否已就绪（向量存储模块导入失败时视为未就绪）"""
+    return is_encoder_ready is not None and is_encoder_ready()
 
 
 def warmup_encoder():
     """预热向量编码器"""
     log("开始预热向量编码器...")
+    if start_encoder_warmup is None:
+        log(f"启动编码器预热失败: {_import_error}")
+        return
     try:
-        from memory_mcp.vector.store import start_encoder_warmup, is_encoder_ready
         start_encoder_warmup()
         log("编码器预热任务已启动（后台加载中）")
     except Exception as e:
         log(f"启动编码器预热失败: {e}")
 
 
-def shutdown_encoder():
-    """关闭向量编码器进程池"""
+def begin_shutdown_encoder():
+    """开始关闭向量编码器进程（后台等待其退出），返回 Future；无法关闭时返回 None"""
     log("关闭向量编码器进程池...")
+    if _begin_shutdown_encoder is None:
+        return None
     try:
-        from memory_mcp.vector.store import shutdown_encoder as _shutdown
-        _shutdown()
-        log("编码器进程池已关闭")
+        return _begin_shutdown_encoder()
     except Exception as e:
         log(f"关闭编码器进程池失败: {e}")
+        return None
+
+
+def finish_shutdown_encoder(future, timeout: float = 6.0):
+    """等待 begin_shutdown_encoder 启动的关闭完成"""
+    if future is None:
+        return
+    try:
+        future.result(timeout=timeout)
+        log("编码器进程池已关闭")
+    except Exception as e:
+        log(f"关闭编码器进程池失败: {type(e).__name__}: {e}")
 
 
 def wait_for_encoder(timeout: float = 60.0) -> bool:
     """等待编码器就绪"""
+    if _wait_for_encoder is None:
+        log(f"编码器不可用: {_import_error}")
+        return False
     try:
-        from memory_mcp.vector.store import is_encoder_ready
+        # 阻塞在加载完成事件上，编码器就绪的瞬间即返回，不再每 0.5 秒轮询
         start_time = time.time()
-        while not is_encoder_ready():
-            if time.time() - start_time > timeout:
+        if not _wait_for_encoder(timeout):
+            elapsed = time.time() - start_time
+            if elapsed >= timeout:
                 log(f"编码器加载超时（{timeout}秒）")
-                return False
-            time.sleep(0.5)
+            else:
+                log(f"编码器加载失败（{elapsed:.1f}s）")
+            return False
         log(f"编码器已就绪，耗时 {time.time() - start_time:.1f}s")
         return True
     except Exception as e:
@@ -143,17 +411,33 @@ def wait_for_encoder(timeout: float = 60.0) -> bool:
         return False
 
 
-def episode_still_active(project_path: str) -> bool:
-    """检查情景是否仍然活跃"""
+# active_episode.json 的解析缓存：(st_ino, st_mtime_ns, st_size) 未变化时直接复用上次的解析结果
+# （SessionStart 用 os.replace 整体替换文件，inode 也会变化）
+_episode_cache = {"key": None, "data": None}
+
+
+def read_episode_state(paths: MonitorPaths) -> dict:
+    """读取活跃情景文件（按 mtime/size 缓存），文件不存在时返回空 dict"""
+    episode_file = paths.episode
     try:
-        episode_file = get_active_episode_path(project_path)
-        if not episode_file.exists():
-            return False
+        st = os.stat(episode_file)
+    except FileNotFoundError:
+        _episode_cache["key"] = None
+        _episode_cache["data"] = None
+        return {}
 
-        with open(episode_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            episode = data.get("episode")
-            return episode is not None and episode.get("status") == "active"
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    if _episode_cache["key"] != key:
+        _episode_cache["data"] = read_json_file(episode_file) or {}
+        _episode_cache["key"] = key
+    return _episode_cache["data"]
+
+
+def episode_still_active(paths: MonitorPaths) -> bool:
+    """检查情景是否仍然活跃"""
+    try:
+        episode = read_episode_state(paths).get("episode")
+        return episode is not None and episode.get("status") == "active"
     except Exception as e:
         log(f"检查活跃情景时出错: {e}")
         return False
@@ -162,11 +446,7 @@ def episode_still_active(project_path: str) -> bool:
 def get_monitor_pid_from_episode(project_path: str) -> int:
     """从活跃情景文件中获取监控进程 PID"""
     try:
-        episode_file = get_active_episode_path(project_path)
-        if episode_file.exists():
-            with open(episode_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("monitor_pid", 0)
+        return read_episode_state(get_monitor_paths(project_path)).get("monitor_pid", 0)
     except:
         pass
     return 0
@@ -183,33 +463,41 @@ def close_episode(project_path: str, reason: str = "terminal_closed"):
     log(f"开始关闭情景，项目路径: {project_path}, 原因: {reason}")
 
     try:
-        # 等待编码器就绪（最多等待 60 秒）
+        # 与 hook IPC 请求互斥，避免关闭过程中又有消息写入情景文件
+        with _manager_lock:
+            manager = _manager or MemoryManager(project_path=project_path)
+
+            current = manager.get_current_episode()
+            if not current:
+                log("没有活跃情景，无需关闭")
+                return
+
+            # 检查是否有消息记录
+            if not manager.current_messages:
+                # 没有消息的空情景，直接清除不归档，也不必等待编码器
+                log("空情景（无消息），直接清除")
+                manager.current_episode = None
+                manager._save_active_episode()
+                return
+
+        # 只有确实需要归档时才等待编码器就绪（最多等待 60 秒）；
+        # 等待期间不持有锁，hook 请求仍可正常处理
         if not wait_for_encoder(timeout=60.0):
             log("警告：编码器未就绪，尝试继续关闭...")
 
-        from memory_mcp.memory import MemoryManager
-        manager = MemoryManager(project_path=project_path)
-
-        current = manager.get_current_episode()
-        if not current:
-            log("没有活跃情景，无需关闭")
-            return
+        with _manager_lock:
+            # 等待期间情景可能已被 MCP 服务关闭，重新读取
+            if not manager.get_current_episode():
+                log("情景已被关闭，跳过")
+                return
 
-        # 检查是否有消息记录
-        if not manager.current_messages:
-            # 没有消息的空情景，直接清除不归档
-            log("空情景（无消息），直接清除")
-            manager.current_episode = None
-            manager._save_active_episode()
-            return
+            # 生成摘要
+            summary = generate_summary(manager, reason)
+            log(f"生成摘要: {summary[:100]}...")
 
-        # 生成摘要
-        summary = generate_summary(manager, reason)
-        log(f"生成摘要: {summary[:100]}...")
-
-        # 关闭情景并归档
-        manager.close_episode(summary=summary)
-        log("情景关闭成功（由监控进程触发）")
+            # 关闭情景并归档
+            manager.close_episode(summary=summary)
+            log("情景关闭成功（由监控进程触发）")
 
     except Exception as e:
         log(f"关闭情景时出错: {type(e).__name__}: {e}")
@@ -228,12 +516,17 @@ def generate_summary(manager, reason: str = "terminal_closed") -> str:
     if not messages:
         return f"{episode.get('title', '空会话')} - 无对话记录"
 
-    # 统计信息
-    user_count = sum(1 for m in messages if m.get("role") == "user")
-    assistant_count = sum(1 for m in messages if m.get("role") == "assistant")
-
-    # 提取用户的主要问题/请求
-    user_messages = [m.get("content", "")[:100] for m in messages if m.get("role") == "user"]
+    # 一次遍历完成统计，并收集用户的前几个问题/请求作为话题
+    user_count = assistant_count = 0
+    user_previews = []
+    for m in messages:
+        role = m.get("role")
+        if role == "user":
+            user_count += 1
+            if len(user_previews) < 5:
+                user_previews.append(m.get("content", "")[:100])
+        elif role == "assistant":
+            assistant_count += 1
 
     # 根据原因生成不同的关闭说明
     reason_text = {
@@ -241,32 +534,23 @@ def generate_summary(manager, reason: str = "terminal_closed") -> str:
         "session_end_signal": "[由监控进程关闭 - 收到 SessionEnd 信号]",
     }.get(reason, f"[由监控进程关闭 - {reason}]")
 
-    # 构建摘要
-    summary_parts = [
-        f"## {episode.get('title', '开发会话')}",
-        f"",
-        f"**对话统计**: {user_count} 条用户消息, {assistant_count} 条助手回复",
-        f"",
-        reason_text,
-        f"",
-        f"**主要话题**:",
-    ]
-
-    # 添加用户的前几个问题作为话题
-    for i, msg in enumerate(user_messages[:5], 1):
-        first_line = msg.split('\n')[0][:80]
-        summary_parts.append(f"- {first_line}")
-
-    if len(user_messages) > 5:
-        summary_parts.append(f"- ... 等 {len(user_messages) - 5} 条更多")
-
-    # 添加关联的实体
+    # 固定部分一次格式化，只有话题列表需要拼接
+    header = (
+        f"## {episode.get('title', '开发会话')}\n\n"
+        f"**对话统计**: {user_count} 条用户消息, {assistant_count} 条助手回复\n\n"
+        f"{reason_text}\n\n"
+        f"**主要话题**:"
+    )
+
+    # 用户的前几个问题作为话题
+    topics = "".join("\n- " + msg.split("\n", 1)[0][:80] for msg in user_previews)
+    more = f"\n- ... 等 {user_count - 5} 条更多" if user_count > 5 else ""
+
+    # 关联的实体
     entity_ids = episode.get("entity_ids", [])
-    if entity_ids:
-        summary_parts.append(f"")
-        summary_parts.append(f"**关联实体**: {len(entity_ids)} 个")
+    entities = f"\n\n**关联实体**: {len(entity_ids)} 个" if entity_ids else ""
 
-    return "\n".join(summary_parts)
+    return header + topics + more + entities
 
 
 def main():
@@ -277,6 +561,8 @@ def main():
 
     parent_pid = args.ppid
     project_path = args.project_path
+    # 主循环每次唤醒都要访问这些文件，路径只拼接一次
+    paths = get_monitor_paths(project_path)
 
     log(f"=== 监控进程启动 ===")
     log(f"监控 PID: {os.getpid()}")
@@ -286,41 +572,48 @@ def main():
     # 启动时预热编码器（后台加载，不阻塞）
     warmup_encoder()
 
-    # 检查间隔（秒）
+    # 接收 hook 的消息缓存/检索请求
+    hook_server = start_hook_server(project_path)
+
+    # 检查间隔（秒）：无法使用事件通知时的轮询间隔
     CHECK_INTERVAL = 2  # 缩短间隔以更快响应信号
     # 父进程退出后的等待时间（秒），给 SessionEnd 信号文件写入机会
     GRACE_PERIOD = 3  # 缩短等待时间，因为现在由监控进程负责关闭
 
+    # 阻塞等待父进程退出 / 记忆目录变化，事件到来时立即醒来检查，
+    # 否则只在心跳间隔到期时醒来一次做兜底检查
+    waiter = create_waiter(parent_pid, paths)
+    wait_timeout = HEARTBEAT_INTERVAL if waiter is not None and waiter.event_driven else CHECK_INTERVAL
+    install_stop_handlers(waiter)
+
+    last_heartbeat = 0.0
+
     try:
-        while True:
+        while not _stop_event.is_set():
+            now = time.time()
+            if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                touch_heartbeat(paths)
+                last_heartbeat = now
+
             # 1. 检查是否有关闭信号（由 session_end.py 写入）
-            signal = check_close_signal(project_path)
-            if signal:
-                log(f"收到关闭信号: {signal}")
-                if episode_still_active(project_path):
-                    close_episode(project_path, reason="session_end_signal")
-                else:
-                    log("情景已被关闭，跳过")
+            if try_signal_shutdown(paths):
                 break
 
             # 2. 检查父进程是否存活
-            if not is_process_alive(parent_pid):
+            if not is_parent_alive(waiter, parent_pid):
                 log(f"父进程 {parent_pid} 已退出")
 
                 # 等待一小段时间，给 session_end.py 写入信号文件的机会
                 log(f"等待 {GRACE_PERIOD} 秒，检查是否有关闭信号...")
-                time.sleep(GRACE_PERIOD)
+                if _stop_event.wait(GRACE_PERIOD):
+                    break
 
                 # 再次检查是否有关闭信号
-                signal = check_close_signal(project_path)
-                if signal:
-                    log(f"收到关闭信号: {signal}")
-                    if episode_still_active(project_path):
-                        close_episode(project_path, reason="session_end_signal")
+                if try_signal_shutdown(paths):
                     break
 
                 # 没有信号，直接关闭（终端被强制关闭的情况）
-                if episode_still_active(project_path):
+                if episode_still_active(paths):
                     log("没有收到关闭信号，监控进程直接关闭情景")
                     close_episode(project_path, reason="terminal_closed")
                 else:
@@ -329,21 +622,35 @@ def main():
                 break
 
             # 3. 检查情景是否已被关闭（用户可能通过其他方式关闭了）
-            if not episode_still_active(project_path):
+            if not episode_still_active(paths):
                 log("情景已不再活跃，监控进程退出")
                 break
 
-            time.sleep(CHECK_INTERVAL)
+            # 4. 编码器就绪后并入 hook 暂存的消息（实体检测可能需要编码）
+            if has_pending_messages(paths) and encoder_ready():
+                drain_pending_messages(project_path)
+
+            if waiter is not None:
+                waiter.wait(wait_timeout)
+            else:
+                _stop_event.wait(CHECK_INTERVAL)
 
-    except KeyboardInterrupt:
-        log("监控进程被中断")
+        if _stop_event.is_set():
+            log("收到终止信号，监控进程退出")
     except Exception as e:
         log(f"监控进程出错: {type(e).__name__}: {e}")
         import traceback
         log(traceback.format_exc())
     finally:
-        # 关闭编码器进程池，防止子进程变成孤儿进程
-        shutdown_encoder()
+        # 关闭编码器进程池，防止子进程变成孤儿进程；
+        # 情景已在循环中归档完毕，工作进程退出期间先完成其余清理
+        encoder_shutdown = begin_shutdown_encoder()
+        if hook_server is not None:
+            hook_server.close()
+        if waiter is not None:
+            waiter.close()
+        remove_heartbeat(paths)
+        finish_shutdown_encoder(encoder_shutdown)
 
     log("=== 监控进程结束 ===\n")
 
@@ -5,33 +5,59 @@
 """
 
 import sys
+import atexit
 import json
 import os
-import shutil
-import subprocess
+import time
+from collections import namedtuple
 from datetime import datetime
 from pathlib import Path
 
-# 确保 stdin/stdout 使用 UTF-8 编码
-if sys.platform == "win32":
-    import io
-    sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-
 # 日志文件路径（用户级，始终可写）
 LOG_FILE = Path.home() / ".claude" / "memory" / "hook_debug.log"
 
+# 监控进程心跳文件（与 session_monitor.py 保持一致）及其有效期（秒）
+HEARTBEAT_FILE = "monitor.heartbeat"
+HEARTBEAT_TTL = 30
+
+# 日志先缓存在内存中，进程退出时一次性追加写入，避免每行一次 open/close
+# 环境变量 MEMORY_MCP_HOOK_LOG：0 关闭日志；debug 额外记录进程树遍历等明细
+_LOG_LEVEL = os.environ.get("MEMORY_MCP_HOOK_LOG", "1").lower()
+_LOG_ENABLED = _LOG_LEVEL != "0"
+_DEBUG_ENABLED = _LOG_LEVEL == "debug"
+_log_buffer: list = []
+
+
+def log(message: str, *args):
+    """写入调试日志（缓存，退出时落盘）；传入 args 时按 % 格式化，日志关闭时不做格式化"""
+    if _LOG_ENABLED:
+        if args:
+            message = message % args
+        _log_buffer.append(f"[{datetime.now().isoformat()}] {message}\n")
 
-def log(message: str):
-    """写入调试日志"""
+
+def debug(message: str, *args):
+    """明细日志，仅在 MEMORY_MCP_HOOK_LOG=debug 时记录"""
+    if _DEBUG_ENABLED:
+        log(message, *args)
+
+
+def _flush_log():
+    """把缓存的日志一次性写入文件"""
+    if not _log_buffer:
+        return
     try:
         LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
         with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"[{datetime.now().isoformat()}] {message}\n")
+            f.write("".join(_log_buffer))
+        _log_buffer.clear()
     except:
         pass
 
 
+atexit.register(_flush_log)
+
+
 def is_valid_path(path: str) -> bool:
     """检查路径是否有效"""
     try:
@@ -42,10 +68,30 @@ def is_valid_path(path: str) -> bool:
         return False
 
 
+# psutil 导入结果缓存（包括"未安装"），避免每次调用都重新搜索 sys.path
+_psutil = None
+_psutil_missing = False
+
+
+def _import_psutil():
+    """导入 psutil 并缓存结果，不可用时抛出 ImportError"""
+    global _psutil, _psutil_missing
+    if _psutil is None:
+        if _psutil_missing:
+            raise ImportError("psutil is not installed")
+        try:
+            import psutil
+        except ImportError:
+            _psutil_missing = True
+            raise
+        _psutil = psutil
+    return _psutil
+
+
 def get_parent_pid() -> int:
     """获取父进程 PID（跨平台）- 直接父进程"""
     try:
-        import psutil
+        psutil = _import_psutil()
         return psutil.Process(os.getpid()).ppid()
     except ImportError:
         if sys.platform == "win32":
@@ -58,6 +104,64 @@ def get_parent_pid() -> int:
 
 def _get_parent_pid_windows(pid: int) -> int:
     """Windows: 获取指定进程的父进程 PID"""
+    ppid = _get_parent_pid_ntquery(pid)
+    if ppid > 0:
+        return ppid
+    # NtQueryInformationProcess 不可用或无权限时，退回遍历进程快照
+    return _get_parent_pid_toolhelp(pid)
+
+
+def _get_parent_pid_ntquery(pid: int) -> int:
+    """Windows: 通过 NtQueryInformationProcess 直接读取父进程 PID（单次系统调用，失败返回 0）"""
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        ProcessBasicInformation = 0
+
+        # 字段均按指针宽度对齐，32/64 位下都可用 c_void_p 表示
+        class PROCESS_BASIC_INFORMATION(ctypes.Structure):
+            _fields_ = [
+                ("ExitStatus", ctypes.c_void_p),
+                ("PebBaseAddress", ctypes.c_void_p),
+                ("AffinityMask", ctypes.c_void_p),
+                ("BasePriority", ctypes.c_void_p),
+                ("UniqueProcessId", ctypes.c_void_p),
+                ("InheritedFromUniqueProcessId", ctypes.c_void_p),
+            ]
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        ntdll = ctypes.WinDLL("ntdll")
+        kernel32.OpenProcess.restype = wintypes.HANDLE
+        kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+        kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+        ntdll.NtQueryInformationProcess.restype = ctypes.c_long
+        ntdll.NtQueryInformationProcess.argtypes = [
+            wintypes.HANDLE, ctypes.c_int, ctypes.c_void_p, wintypes.ULONG, ctypes.POINTER(wintypes.ULONG)
+        ]
+
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return 0
+        try:
+            pbi = PROCESS_BASIC_INFORMATION()
+            ret_len = wintypes.ULONG()
+            status = ntdll.NtQueryInformationProcess(
+                handle, ProcessBasicInformation, ctypes.byref(pbi), ctypes.sizeof(pbi), ctypes.byref(ret_len)
+            )
+            if status != 0:
+                return 0
+            return pbi.InheritedFromUniqueProcessId or 0
+        finally:
+            kernel32.CloseHandle(handle)
+    except Exception as e:
+        log(f"NtQueryInformationProcess 获取父进程失败: {e}")
+        return 0
+
+
+def _get_parent_pid_toolhelp(pid: int) -> int:
+    """Windows: 遍历 Toolhelp32 进程快照查找父进程 PID（兜底方案）"""
     try:
         import ctypes
         from ctypes import wintypes
@@ -98,6 +202,36 @@ def _get_parent_pid_windows(pid: int) -> int:
         return 0
 
 
+# 祖先进程信息（比 dict 更省内存，按属性访问）
+ProcInfo = namedtuple("ProcInfo", "pid name cmdline create_time")
+
+# 监控目标进程名（均为小写，与遍历时 lower() 后的进程名比较）
+# IDE 主进程：最稳定，不会因为 Claude 启动而被替换
+IDE_NAMES = frozenset({
+    "code.exe",  # VS Code
+    "idea64.exe", "idea.exe",  # IntelliJ IDEA
+    "webstorm64.exe", "webstorm.exe",  # WebStorm
+    "pycharm64.exe", "pycharm.exe",  # PyCharm
+    "cursor.exe",  # Cursor
+})
+
+# 独立终端进程（Windows Terminal、外部终端等）
+STANDALONE_TERMINAL_NAMES = frozenset({
+    "windowsterminal.exe", "wt.exe",  # Windows Terminal
+    # Mac/Linux
+    "terminal", "iterm2", "gnome-terminal", "konsole", "alacritty", "kitty"
+})
+
+# IDE 集成终端中的 shell 进程（可能被替换，优先级最低）
+INTEGRATED_TERMINAL_NAMES = frozenset({
+    "cmd.exe", "powershell.exe", "pwsh.exe", "conhost.exe",
+    "bash", "zsh", "fish", "sh"
+})
+
+# VS Code 等 Electron IDE 的 utility 子进程命令行包含该参数，主进程不包含
+_UTILITY_MARKER = "--type="
+
+
 def get_claude_or_terminal_pid() -> int:
     """
     向上遍历进程树，找到稳定的终端进程或 IDE 进程
@@ -110,101 +244,90 @@ def get_claude_or_terminal_pid() -> int:
     因此我们需要监控更稳定的进程：终端进程(cmd.exe) 或 IDE 进程(code.exe)。
     """
     try:
-        import psutil
+        psutil = _import_psutil()
 
         current = psutil.Process(os.getpid())
         ancestors = []
 
-        # 收集所有祖先进程信息
-        proc = current
-        while proc:
+        # 收集祖先进程信息（遇到 IDE 主进程时提前返回）
+        # 每个祖先只进入一次 oneshot()，name/cmdline/create_time/ppid 共用一次 /proc 或进程表读取
+        with current.oneshot():
+            pid = current.ppid()
+            child_create_time = current.create_time()
+        while pid > 0:
             try:
-                parent = proc.parent()
-                if parent is None:
-                    break
-
-                proc_info = {
-                    "pid": parent.pid,
-                    "name": parent.name().lower(),
-                    "cmdline": " ".join(parent.cmdline()).lower() if parent.cmdline() else "",
-                    "create_time": parent.create_time()
-                }
-                ancestors.append(proc_info)
-                log(f"祖先进程: PID={proc_info['pid']}, name={proc_info['name']}, cmdline={proc_info['cmdline'][:100]}")
-                proc = parent
+                parent = psutil.Process(pid)
+                with parent.oneshot():
+                    cmdline = parent.cmdline()
+                    proc_info = ProcInfo(
+                        pid,
+                        parent.name().lower(),
+                        " ".join(cmdline).lower() if cmdline else "",
+                        parent.create_time(),
+                    )
+                    next_pid = parent.ppid()
             except (psutil.NoSuchProcess, psutil.AccessDenied):
                 break
 
+            # 父进程比子进程晚创建，说明 PID 已被复用（与 psutil.Process.parent() 的判断一致）
+            if proc_info.create_time > child_create_time:
+                break
+
+            debug("祖先进程: PID=%s, name=%s, cmdline=%.100s", pid, proc_info.name, proc_info.cmdline)
+
+            # 策略1: IDE 主进程（最稳定，VS Code、JetBrains 等）优先级最高，
+            # 遇到即可返回，无需继续遍历到 PID 1
+            if proc_info.name in IDE_NAMES:
+                # VS Code 主进程命令行不包含 --type=，utility 子进程包含
+                if _UTILITY_MARKER not in proc_info.cmdline:
+                    log(f"找到 IDE 主进程: PID={proc_info.pid}, name={proc_info.name}")
+                    return proc_info.pid
+                debug("跳过 IDE utility 进程: PID=%s", proc_info.pid)
+
+            ancestors.append(proc_info)
+            if next_pid == pid:
+                break
+            pid = next_pid
+            child_create_time = proc_info.create_time
+
         if not ancestors:
             log("无法获取祖先进程，使用直接父进程")
             return get_parent_pid()
 
-        # 策略1: 优先查找 IDE 进程（最稳定，VS Code、JetBrains 等）
-        # IDE 进程比终端进程更稳定，不会因为 Claude 启动而被替换
-        ide_names = {
-            "code.exe",  # VS Code
-            "idea64.exe", "idea.exe",  # IntelliJ IDEA
-            "webstorm64.exe", "webstorm.exe",  # WebStorm
-            "pycharm64.exe", "pycharm.exe",  # PyCharm
-            "cursor.exe",  # Cursor
-        }
-
-        for proc_info in ancestors:
-            # 只选择主 IDE 进程，跳过 utility 子进程
-            if proc_info["name"] in ide_names:
-                cmdline = proc_info["cmdline"]
-                # VS Code 主进程命令行不包含 --type=
-                if "--type=" not in cmdline:
-                    log(f"找到 IDE 主进程: PID={proc_info['pid']}, name={proc_info['name']}")
-                    return proc_info["pid"]
-                else:
-                    log(f"跳过 IDE utility 进程: PID={proc_info['pid']}")
-
         # 策略2: 查找独立终端进程（Windows Terminal、外部终端等）
         # 注意：VS Code 集成终端的 pwsh.exe 不够稳定，可能会被替换
-        standalone_terminal_names = {
-            "windowsterminal.exe", "wt.exe",  # Windows Terminal
-            # Mac/Linux
-            "terminal", "iterm2", "gnome-terminal", "konsole", "alacritty", "kitty"
-        }
-
         for proc_info in ancestors:
-            if proc_info["name"] in standalone_terminal_names:
-                log(f"找到独立终端进程: PID={proc_info['pid']}, name={proc_info['name']}")
-                return proc_info["pid"]
+            if proc_info.name in STANDALONE_TERMINAL_NAMES:
+                log(f"找到独立终端进程: PID={proc_info.pid}, name={proc_info.name}")
+                return proc_info.pid
 
         # 策略3: 查找 Claude Code 主进程（node.exe 运行 claude-code/cli.js）
-        node_procs = [p for p in ancestors if "node" in p["name"]]
+        node_procs = [p for p in ancestors if "node" in p.name]
         for proc_info in node_procs:
-            cmdline = proc_info["cmdline"]
+            cmdline = proc_info.cmdline
             # 只选择 Claude Code 主进程，命令行包含 claude-code
             if "claude-code" in cmdline or "cli.js" in cmdline:
-                log(f"找到 Claude Code 主进程: PID={proc_info['pid']}")
-                return proc_info["pid"]
+                log(f"找到 Claude Code 主进程: PID={proc_info.pid}")
+                return proc_info.pid
 
         # 策略4: 查找 VS Code 集成终端进程（pwsh.exe/cmd.exe/powershell.exe）
         # 放在最后是因为这些进程可能不够稳定
-        integrated_terminal_names = {
-            "cmd.exe", "powershell.exe", "pwsh.exe", "conhost.exe",
-            "bash", "zsh", "fish", "sh"
-        }
-
         for proc_info in ancestors:
-            if proc_info["name"] in integrated_terminal_names:
-                cmdline = proc_info["cmdline"]
+            if proc_info.name in INTEGRATED_TERMINAL_NAMES:
+                cmdline = proc_info.cmdline
                 # 跳过 hook runner 的临时 cmd.exe（命令行包含 /d /s /c 和 python）
-                if proc_info["name"] == "cmd.exe":
+                if proc_info.name == "cmd.exe":
                     if "/d /s /c" in cmdline and "python" in cmdline:
-                        log(f"跳过 hook runner cmd.exe: PID={proc_info['pid']}")
+                        debug("跳过 hook runner cmd.exe: PID=%s", proc_info.pid)
                         continue
-                log(f"找到集成终端进程: PID={proc_info['pid']}, name={proc_info['name']}")
-                return proc_info["pid"]
+                log(f"找到集成终端进程: PID={proc_info.pid}, name={proc_info.name}")
+                return proc_info.pid
 
         # 策略5: 使用最早创建的 node 进程（兜底）
         if node_procs:
-            oldest_node = min(node_procs, key=lambda p: p["create_time"])
-            log(f"使用最早的 node 进程（兜底）: PID={oldest_node['pid']}")
-            return oldest_node["pid"]
+            oldest_node = min(node_procs, key=lambda p: p.create_time)
+            log(f"使用最早的 node 进程（兜底）: PID={oldest_node.pid}")
+            return oldest_node.pid
 
         # 兜底: 返回直接父进程
         log("未找到合适的进程，使用直接父进程")
@@ -220,40 +343,77 @@ def get_claude_or_terminal_pid() -> int:
         return get_parent_pid()
 
 
+def _is_pid_alive_windows(pid: int) -> bool:
+    """
+    Windows: 通过 OpenProcess(SYNCHRONIZE) + WaitForSingleObject(0) 检查进程是否存活（不启动 tasklist）
+
+    进程对象在退出时变为有信号状态，WAIT_TIMEOUT 即存活；
+    不依赖退出码，避免退出码恰好为 STILL_ACTIVE(259) 的进程被误判为存活
+    """
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        SYNCHRONIZE = 0x00100000
+        WAIT_TIMEOUT = 0x00000102
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        kernel32.OpenProcess.restype = wintypes.HANDLE
+        kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+        kernel32.WaitForSingleObject.restype = wintypes.DWORD
+        kernel32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+        kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+
+        handle = kernel32.OpenProcess(SYNCHRONIZE, False, pid)
+        if not handle:
+            # ERROR_ACCESS_DENIED 说明进程存在但无权访问
+            return ctypes.get_last_error() == 5
+        try:
+            return kernel32.WaitForSingleObject(handle, 0) == WAIT_TIMEOUT
+        finally:
+            kernel32.CloseHandle(handle)
+    except Exception:
+        return False
+
+
 def is_monitor_running(monitor_pid: int) -> bool:
     """检查监控进程是否仍在运行"""
     if monitor_pid <= 0:
         return False
 
     try:
-        import psutil
+        psutil = _import_psutil()
         proc = psutil.Process(monitor_pid)
-        return proc.is_running() and "session_monitor" in proc.cmdline()[-1]
+        # 源码方式的命令行包含 session_monitor.py，入口点方式包含 memory-mcp-monitor
+        cmdline = " ".join(proc.cmdline())
+        return proc.is_running() and ("session_monitor" in cmdline or "memory-mcp-monitor" in cmdline)
     except ImportError:
         # 简单检查进程是否存在
-        if sys.platform == "win32":
-            try:
-                result = subprocess.run(
-                    ["tasklist", "/FI", f"PID eq {monitor_pid}"],
-                    capture_output=True,
-                    text=True,
-                    creationflags=subprocess.CREATE_NO_WINDOW
-                )
-                return str(monitor_pid) in result.stdout
-            except:
-                return False
-        else:
-            try:
-                os.kill(monitor_pid, 0)
-                return True
-            except OSError:
-                return False
+        return is_pid_alive(monitor_pid)
     except Exception:
         return False
 
 
+def is_pid_alive(pid: int) -> bool:
+    """只检查进程是否存在（一次系统调用，不导入 psutil）"""
+    if pid <= 0:
+        return False
+    if sys.platform == "win32":
+        return _is_pid_alive_windows(pid)
+    try:
+        os.kill(pid, 0)
+        return True
+    except PermissionError:
+        # 进程存在但属于其他用户
+        return True
+    except OSError:
+        return False
+
+
 def _find_monitor_script() -> str:
     """查找 session_monitor 脚本路径，优先使用 pip 安装的入口点"""
+    import shutil
+
     # 优先查找 pip 安装的入口点命令
     monitor_cmd = shutil.which("memory-mcp-monitor")
     if monitor_cmd:
@@ -267,6 +427,29 @@ def _find_monitor_script() -> str:
     return ""
 
 
+def _posix_spawn_detached(args: list) -> int:
+    """
+    Unix 下用 os.posix_spawn 启动脱离会话的后台进程，返回 PID
+
+    posix_spawn 不复制父进程的地址空间（Linux 上走 vfork 语义），比 fork + exec 启动更快。
+    stdin/stdout/stderr 重定向到 /dev/null；不支持 setsid 的平台（如 macOS 10.15 之前）返回 0，
+    由调用方回退到 subprocess.Popen
+    """
+    if not hasattr(os, "posix_spawn"):
+        return 0
+
+    file_actions = [
+        (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+        (os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0),
+        (os.POSIX_SPAWN_DUP2, 1, 2),
+    ]
+    try:
+        # 其余文件描述符默认不可继承（PEP 446），无需 close_fds
+        return os.posix_spawn(args[0], args, os.environ, file_actions=file_actions, setsid=True)
+    except NotImplementedError:
+        return 0
+
+
 def start_monitor_process(parent_pid: int, project_path: str) -> int:
     """启动监控进程，返回监控进程 PID"""
     monitor_path = _find_monitor_script()
@@ -304,29 +487,39 @@ def start_monitor_process(parent_pid: int, project_path: str) -> int:
         ]
 
     log(f"启动监控进程: {' '.join(args)}")
+    # 监控进程写同一个日志文件，先落盘本进程的缓存，保证日志按时间顺序
+    _flush_log()
 
     try:
-        if sys.platform == "win32":
-            # Windows: 使用 cmd /c start 启动完全独立的进程
-            # 这样可以确保子进程不继承任何句柄
-            cmd_args = ["cmd", "/c", "start", "/b"] + args
+        if sys.platform != "win32":
+            pid = _posix_spawn_detached(args)
+            if pid:
+                log(f"监控进程已启动，PID: {pid}")
+                return pid
+
+        # subprocess 只在需要启动监控进程时才导入，已有监控进程的常见路径不加载它
+        import subprocess
 
+        if sys.platform == "win32":
+            # Windows: 直接创建脱离控制台的独立进程（不再经过 cmd /c start），
+            # close_fds=True 保证不继承任何句柄，同时能拿到真实 PID
             proc = subprocess.Popen(
-                cmd_args,
+                args,
                 stdin=subprocess.DEVNULL,
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.DEVNULL,
-                creationflags=subprocess.CREATE_NO_WINDOW
+                creationflags=(
+                    subprocess.DETACHED_PROCESS
+                    | subprocess.CREATE_NEW_PROCESS_GROUP
+                    | subprocess.CREATE_NO_WINDOW
+                ),
+                close_fds=True
             )
-            # 等待 cmd 退出（它会立即返回，因为 start /b 是异步的）
-            proc.wait()
 
-            # 由于使用 start /b，我们无法获取实际的 PID
-            # 但进程已经启动，返回一个占位值
-            log(f"监控进程已通过 start /b 启动")
-            return 1  # 返回占位值表示成功
+            log(f"监控进程已启动，PID: {proc.pid}")
+            return proc.pid
         else:
-            # Unix: 使用 start_new_session 使进程独立运行
+            # Unix 回退: 使用 start_new_session 使进程独立运行
             proc = subprocess.Popen(
                 args,
                 stdin=subprocess.DEVNULL,
@@ -346,8 +539,28 @@ def start_monitor_process(parent_pid: int, project_path: str) -> int:
         return 0
 
 
-def save_monitor_pid(project_path: str, monitor_pid: int):
-    """将监控进程 PID 保存到活跃情景文件"""
+def _atomic_write_json(path: Path, obj: dict):
+    """
+    原子写入 JSON：先写同目录临时文件，再 os.replace 覆盖
+
+    并发的 hook 不会读到写了一半的文件；输出紧凑格式（无缩进）。
+    临时文件名带 PID，不使用 tempfile 模块（其导入链会拖慢 hook 启动）。
+    """
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        raise
+
+
+def save_monitor_pid(project_path: str, monitor_pid: int, target_pid: int = 0):
+    """将监控进程 PID（以及它监控的目标进程 PID）保存到活跃情景文件"""
     try:
         episode_file = Path(project_path) / ".claude" / "memory" / "active_episode.json"
         if episode_file.exists():
@@ -355,26 +568,40 @@ def save_monitor_pid(project_path: str, monitor_pid: int):
                 data = json.load(f)
 
             data["monitor_pid"] = monitor_pid
+            if target_pid > 0:
+                data["target_pid"] = target_pid
 
-            with open(episode_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            _atomic_write_json(episode_file, data)
 
             log(f"监控进程 PID {monitor_pid} 已保存到活跃情景文件")
     except Exception as e:
         log(f"保存监控进程 PID 失败: {e}")
 
 
-def get_existing_monitor_pid(project_path: str) -> int:
-    """从活跃情景文件获取已有的监控进程 PID"""
+def monitor_heartbeat_fresh(memory_dir: Path) -> bool:
+    """
+    监控进程的心跳文件是否在有效期内
+
+    监控进程每 HEARTBEAT_INTERVAL 秒更新一次心跳文件，退出时删除。
+    心跳新鲜说明监控进程正在运行，可以跳过进程树遍历和 is_monitor_running 检查。
+    """
     try:
-        episode_file = Path(project_path) / ".claude" / "memory" / "active_episode.json"
-        if episode_file.exists():
-            with open(episode_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return data.get("monitor_pid", 0)
-    except:
-        pass
-    return 0
+        return time.time() - os.stat(memory_dir / HEARTBEAT_FILE).st_mtime < HEARTBEAT_TTL
+    except OSError:
+        return False
+
+
+def resolve_target_pid(cached_pid: int) -> int:
+    """
+    获取监控目标进程（IDE/终端）PID
+
+    目标进程在会话期间不变，情景文件中缓存的 target_pid 仍存活时直接复用，
+    只需一次存活检查；否则遍历进程树重新查找
+    """
+    if is_pid_alive(cached_pid):
+        log("复用情景文件中的目标进程 PID: %s", cached_pid)
+        return cached_pid
+    return get_claude_or_terminal_pid()
 
 
 def main():
@@ -382,8 +609,9 @@ def main():
 
     try:
         # 从 stdin 读取 hook 输入
-        input_data = sys.stdin.read()
-        log(f"stdin 输入: {input_data[:500] if input_data else '(空)'}")
+        # 直接读取原始字节交给 JSON 解析，省去一次文本解码
+        input_data = sys.stdin.buffer.read()
+        log(f"stdin 输入: {input_data[:500].decode('utf-8', 'replace') if input_data else '(空)'}")
 
         hook_input = json.loads(input_data) if input_data else {}
         log(f"解析后的 hook_input: {hook_input}")
@@ -413,6 +641,7 @@ def main():
 
         # 检查是否已有活跃情景
         current_episode = None
+        data = {}
         if episode_file.exists():
             try:
                 with open(episode_file, 'r', encoding='utf-8') as f:
@@ -439,17 +668,23 @@ def main():
                 # 已有活跃情景且未过期，不重复创建
                 log("已有活跃情景，跳过创建")
 
-                # 但仍需确保监控进程在运行
-                parent_pid = get_claude_or_terminal_pid()
+                # 但仍需确保监控进程在运行；心跳新鲜时无需遍历进程树
+                if monitor_heartbeat_fresh(memory_dir):
+                    log("监控进程心跳正常，跳过检查")
+                    sys.exit(0)
+
+                # 监控进程仍在运行时不需要目标进程 PID，也就不必遍历进程树
+                existing_monitor_pid = data.get("monitor_pid", 0)
+                if existing_monitor_pid > 0 and is_monitor_running(existing_monitor_pid):
+                    log(f"监控进程已在运行 (PID: {existing_monitor_pid})")
+                    sys.exit(0)
+
+                parent_pid = resolve_target_pid(data.get("target_pid", 0))
                 if parent_pid > 0:
-                    existing_monitor_pid = get_existing_monitor_pid(project_path)
-                    if existing_monitor_pid > 0 and is_monitor_running(existing_monitor_pid):
-                        log(f"监控进程已在运行 (PID: {existing_monitor_pid})")
-                    else:
-                        log("监控进程不存在或已退出，启动新的监控进程")
-                        monitor_pid = start_monitor_process(parent_pid, project_path)
-                        if monitor_pid > 0:
-                            save_monitor_pid(project_path, monitor_pid)
+                    log("监控进程不存在或已退出，启动新的监控进程")
+                    monitor_pid = start_monitor_process(parent_pid, project_path)
+                    if monitor_pid > 0:
+                        save_monitor_pid(project_path, monitor_pid, parent_pid)
 
                 sys.exit(0)
 
@@ -469,26 +704,28 @@ def main():
             "created_at": datetime.now().isoformat(),
             "entity_ids": []
         }
-        with open(episode_file, 'w', encoding='utf-8') as f:
-            json.dump({"episode": episode, "messages": []}, f, ensure_ascii=False, indent=2)
+        # 保留这份 dict，启动监控进程后直接填入 PID 再写一次，无需重新读取文件
+        episode_data = {"episode": episode, "messages": [], "monitor_pid": 0}
+        _atomic_write_json(episode_file, episode_data)
         log(f"情景创建成功: {episode}")
 
         # 启动监控进程（监听终端生命周期）
-        parent_pid = get_claude_or_terminal_pid()
-        log(f"监控目标进程 PID: {parent_pid}")
-
-        if parent_pid > 0:
-            # 检查是否已有监控进程在运行
-            existing_monitor_pid = get_existing_monitor_pid(project_path)
-            if existing_monitor_pid > 0 and is_monitor_running(existing_monitor_pid):
-                log(f"监控进程已在运行 (PID: {existing_monitor_pid})，跳过启动")
-            else:
-                # 启动新的监控进程
+        if monitor_heartbeat_fresh(memory_dir):
+            log("监控进程心跳正常，跳过启动")
+        else:
+            parent_pid = get_claude_or_terminal_pid()
+            log(f"监控目标进程 PID: {parent_pid}")
+
+            if parent_pid > 0:
+                # 新情景文件中 monitor_pid 为 0，无需再检查已有监控进程
                 monitor_pid = start_monitor_process(parent_pid, project_path)
                 if monitor_pid > 0:
-                    save_monitor_pid(project_path, monitor_pid)
-        else:
-            log("无法获取父进程 PID，跳过启动监控进程")
+                    episode_data["monitor_pid"] = monitor_pid
+                    episode_data["target_pid"] = parent_pid
+                    _atomic_write_json(episode_file, episode_data)
+                    log(f"监控进程 PID {monitor_pid} 已保存到活跃情景文件")
+            else:
+                log("无法获取父进程 PID，跳过启动监控进程")
 
     except Exception as e:
         log(f"错误: {type(e).__name__}: {e}")
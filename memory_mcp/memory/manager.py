@@ -5,13 +5,287 @@
 
 import os
 import re
+import sys
 import json
+import time
+import atexit
+import functools
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Any, Tuple
-from uuid import uuid4
+from .. import _jsonio
 from ..vector import VectorStore, is_encoder_ready
 
+try:
+    # 可选加速（google-re2）：把全部检测模式编译进一个自动机，一次线性扫描得出哪些模式命中
+    import re2
+except ImportError:  # pragma: no cover - 取决于安装环境
+    re2 = None
+
+try:
+    # 可选加速（pyahocorasick）：全部关键词建成一个多模式自动机，一次扫描找出所有命中
+    import ahocorasick
+except ImportError:  # pragma: no cover - 取决于安装环境
+    ahocorasick = None
+
+# 关键词匹配时按句切分：_SENTENCE_SPLIT 匹配分隔符，_SENTENCE_RE 逐个产出句子（惰性，不构造整张句子表）
+_SENTENCE_SPLIT = re.compile(r'[。！？\n]')
+_SENTENCE_RE = re.compile(r'[^。！？\n]+')
+
+# 代码块（第 1 组）与行内代码合并为一个模式，清理消息时只扫描一遍
+_CODE_RE = re.compile(r'(```[\w]*\n[\s\S]*?```)|`[^`]+`')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+def _code_placeholder(match: re.Match) -> str:
+    return '[代码块已省略]' if match.group(1) is not None else '[代码]'
+
+
+# 清理结果的缓存：同一条消息可能被多条路径（hook 重试、手动缓存等）重复处理。
+# 以内容本身为键（str 的哈希值计算一次后缓存在对象上）；超长内容不缓存，避免常驻内存
+_CLEAN_CACHE_SIZE = 256
+_CLEAN_CACHE_MAX_INPUT = 16 * 1024
+
+
+@functools.lru_cache(maxsize=_CLEAN_CACHE_SIZE)
+def _clean_content_cached(content: str, max_length: int) -> str:
+    return _clean_content_impl(content, max_length)
+
+
+def _clean_content_impl(content: str, max_length: int) -> str:
+    # 代码块、行内代码替换为占位符（保留代码块的说明），一次扫描完成
+    cleaned = _CODE_RE.sub(_code_placeholder, content)
+
+    # 截断长度
+    if len(cleaned) > max_length:
+        cleaned = cleaned[:max_length] + "...[已截断]"
+
+    return cleaned.strip()
+
+
+@functools.lru_cache(maxsize=_CLEAN_CACHE_SIZE)
+def _text_summary_cached(content: str) -> str:
+    return _text_summary_impl(content)
+
+
+def _text_summary_impl(content: str) -> str:
+    # 去除代码块和行内代码
+    text = _CODE_RE.sub('', content)
+    # 去除多余空行（代码块删除后才会形成的空行也要合并，因此不能并入上一步）
+    if '\n\n\n' in text:
+        text = _BLANK_LINES_RE.sub('\n\n', text)
+    # 截断
+    if len(text) > 500:
+        text = text[:500] + "..."
+    return text.strip()
+
+
+# 内部 id 的随机部分（8 位十六进制 = 4 字节）从一次读出的随机字节池中切取，
+# 不必每条消息都调用 uuid4（每次 16 字节 os.urandom）
+_ID_POOL_SIZE = 4096
+_id_lock = threading.Lock()
+_id_pool = b""
+_id_pos = 0
+
+
+def _short_id() -> str:
+    """生成 8 位十六进制随机 id"""
+    global _id_pool, _id_pos
+    with _id_lock:
+        if _id_pos + 4 > len(_id_pool):
+            _id_pool, _id_pos = os.urandom(_ID_POOL_SIZE), 0
+        chunk = _id_pool[_id_pos:_id_pos + 4]
+        _id_pos += 4
+    return chunk.hex()
+
+
+def _reset_id_pool():
+    """fork 出的子进程丢弃继承的随机字节池（及可能处于持有状态的锁），避免与父进程生成相同的 id"""
+    global _id_lock, _id_pool, _id_pos
+    _id_lock = threading.Lock()
+    _id_pool, _id_pos = b"", 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_id_pool)
+
+
+def _write_file_atomic(path: Path, data: bytes) -> os.stat_result:
+    """
+    先写同目录临时文件再 os.replace，读取方看到的总是完整内容；返回写入后文件的 stat
+
+    临时文件名带进程/线程号，多个写入方互不覆盖
+    """
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        st = os.fstat(f.fileno())
+    try:
+        os.replace(tmp, path)
+    except PermissionError:
+        # Windows 上目标文件被其他进程占用时无法替换，退回直接覆盖
+        with open(path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            st = os.fstat(f.fileno())
+        tmp.unlink(missing_ok=True)
+    return st
+
+
+# 缓存行中的 timestamp 字段：JSON 字符串内的引号都被转义，"timestamp" 前是 { 或 , 时必为顶层键
+_TIMESTAMP_RE = re.compile(rb'[{,]\s*"timestamp"\s*:\s*"([^"\\]*)"')
+
+
+def _iso_sort_key(ts: str) -> str:
+    """
+    把 ISO 时间字符串规范为可直接按字典序比较的形式
+
+    本项目写入的时间都是 datetime.now().isoformat()（本地时间、无时区，
+    YYYY-MM-DDTHH:MM:SS[.ffffff]），字典序与时间先后一致，原样返回不做解析；
+    带时区等其他写法才解析并换算为同样的本地无时区形式
+    """
+    if len(ts) in (19, 26) and ts[10] == 'T':
+        return ts
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt.isoformat()
+
+
+def _line_timestamp(line: bytes) -> str:
+    """取缓存行的时间（_iso_sort_key 形式），优先用正则直接截取，不构造整个字典"""
+    match = _TIMESTAMP_RE.search(line)
+    ts = match.group(1).decode('ascii') if match else _jsonio.loads(line)["timestamp"]
+    return _iso_sort_key(ts)
+
+
+# 取值只有少数几种、在大量记录中反复出现的字段（消息角色、实体类型、状态、所属情景）
+_INTERN_VALUE_KEYS = frozenset({"role", "type", "status", "episode_id"})
+
+
+def _intern_record(record: Dict) -> Dict:
+    """
+    驻留从 JSON 读入的记录的键和枚举型字段值
+
+    JSON 解析为每条记录新建全部键字符串，驻留后成千上万条消息/实体共用同一个 str 对象
+    """
+    return {
+        sys.intern(k): sys.intern(v) if k in _INTERN_VALUE_KEYS and type(v) is str else v
+        for k, v in record.items()
+    }
+
+
+def _keyword_trie_pattern(keywords: List[str]) -> Optional[str]:
+    """
+    把关键词表编译成按公共前缀合并的正则（如 决定/决策 -> 决(?:定|策)）
+
+    只用来判断是否包含任一关键词，某个关键词是另一个的前缀时较长的那个可以省略。
+    回溯引擎按前缀树逐字符分支，不必对每个位置逐个尝试全部关键词。关键词表为空时返回 None
+    """
+    trie: Dict[str, Dict] = {}
+    for kw in keywords:
+        node = trie
+        for ch in kw:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: Dict[str, Dict]) -> str:
+        if "" in node:
+            return ""
+        alternatives = [re.escape(ch) + emit(child) for ch, child in sorted(node.items())]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    return emit(trie) if trie else None
+
+
+def _compile_detection_rules(rules: Dict[str, Dict]) -> Dict[str, Dict]:
+    """
+    把检测规则中的正则字符串预编译（导入时执行一次，模式有误时立即报错）
+
+    每个模式带一个全局序号，与 _build_pattern_set 中的添加顺序一致
+    """
+    pattern_ids = iter(range(sum(len(rule.get("patterns", [])) for rule in rules.values())))
+    return {
+        entity_type: {
+            "patterns": [
+                (next(pattern_ids), re.compile(p, re.IGNORECASE)) for p in rule.get("patterns", [])
+            ],
+            "keywords": rule.get("keywords", []),
+            "keyword_re": (
+                re.compile(pattern) if (pattern := _keyword_trie_pattern(rule.get("keywords", []))) else None
+            ),
+            "min_confidence": rule.get("min_confidence", 0.5),
+        }
+        for entity_type, rule in rules.items()
+    }
+
+
+class _PatternPrefilter:
+    """RE2 Set 预筛：一次扫描得出可能命中的模式序号"""
+
+    def __init__(self, pattern_set, set_ids: List[int], unfiltered: frozenset):
+        self._set = pattern_set
+        self._set_ids = set_ids  # Set 内序号 -> 模式序号
+        self._unfiltered = unfiltered  # 不在 Set 中、每次都要逐个匹配的模式序号
+
+    def match(self, content: str) -> Optional[set]:
+        """需要逐个匹配的模式序号集合；无法预筛时返回 None"""
+        try:
+            # 没有模式命中时 Match 返回 None 而不是空列表
+            hits = self._set.Match(content) or ()
+        except (UnicodeError, TypeError):
+            # 无法编码为 UTF-8 的文本（如孤立的代理字符）不预筛
+            return None
+        return self._unfiltered.union(self._set_ids[i] for i in hits)
+
+
+def _build_pattern_set(compiled_rules: Dict[str, Dict]) -> Optional[_PatternPrefilter]:
+    """
+    用 RE2 Set 预筛命中的模式；re2 未安装或有模式不受支持时返回 None（逐个模式匹配）
+
+    Python re 的 $ 还能匹配末尾换行符之前的位置，RE2 的 $ 只匹配文本末尾，
+    含 $ 的模式不放进 Set，每次都交给 re 匹配，保证预筛结果与逐个匹配一致
+    """
+    if re2 is None:
+        return None
+    try:
+        options = re2.Options()
+        options.case_sensitive = False
+        pattern_set = re2.Set.SearchSet(options)
+        set_ids: List[int] = []  # Set 内序号 -> 模式序号
+        unfiltered = set()
+        for rule in compiled_rules.values():
+            for pattern_id, pattern in rule["patterns"]:
+                if "$" in pattern.pattern:
+                    unfiltered.add(pattern_id)
+                    continue
+                if pattern_set.Add(pattern.pattern) != len(set_ids):
+                    return None
+                set_ids.append(pattern_id)
+        pattern_set.Compile()
+    except Exception:
+        return None
+    return _PatternPrefilter(pattern_set, set_ids, frozenset(unfiltered))
+
+
+def _build_keyword_automaton(compiled_rules: Dict[str, Dict]):
+    """把所有类型的关键词建成 Aho-Corasick 自动机（值为 (关键词长度, 实体类型元组)）；未安装时返回 None"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for entity_type, rule in compiled_rules.items():
+        for kw in rule["keywords"]:
+            _, types = automaton.get(kw, (len(kw), ()))
+            automaton.add_word(kw, (len(kw), types + (entity_type,)))
+    automaton.make_automaton()
+    return automaton
+
 
 class MemoryManager:
     """
@@ -82,16 +356,35 @@ class MemoryManager:
         },
     }
 
+    # 预筛字符：任一检测模式的匹配、任一关键词都必然包含其中至少一个字符，
+    # 消息与之不相交时不可能检测出实体（修改 DETECTION_RULES 时需同步维护模式部分）
+    _TRIGGER_CHARS = frozenset("决确选采使方基架设结分模微单喜偏倾更pP是的定什解我用习总一通每.") | frozenset(
+        kw[0] for rule in DETECTION_RULES.values() for kw in rule["keywords"]
+    )
+
+    # 预编译的检测规则，_detect_candidates 每条消息都会用到
+    _COMPILED_RULES = _compile_detection_rules(DETECTION_RULES)
+    _PATTERN_SET = _build_pattern_set(_COMPILED_RULES)
+    _KEYWORD_AUTOMATON = _build_keyword_automaton(_COMPILED_RULES)
+
     # 自动确认的置信度阈值
     AUTO_CONFIRM_THRESHOLD = 0.85
 
     # 情景过期时间（分钟），超过此时间未活动的情景会被自动关闭
     STALE_EPISODE_MINUTES = 30
 
+    # 连续缓存消息时 active_episode.json 的最短写盘间隔（秒），
+    # 间隔内新增的消息由定时器到期后一次写出，避免每条消息都整体重写情景文件
+    EPISODE_SAVE_INTERVAL = 2.0
+
+    # 清理消息缓存时每次搬移的字节数
+    CACHE_COPY_CHUNK = 1 << 20
+
     def __init__(
         self,
         project_path: Optional[str] = None,
-        user_path: Optional[str] = None
+        user_path: Optional[str] = None,
+        warmup_encoder: bool = False
     ):
         # 用户级路径（全局）
         self.user_path = Path(user_path or self._get_default_user_path())
@@ -104,7 +397,8 @@ class MemoryManager:
         # 初始化向量存储
         self.user_store = VectorStore(
             str(self.user_path / "user_db"),
-            collection_name="user_memory"
+            collection_name="user_memory",
+            warmup_encoder=warmup_encoder
         )
         self.project_store = VectorStore(
             str(self.project_path / "project_db"),
@@ -113,6 +407,11 @@ class MemoryManager:
 
         # 消息缓存文件
         self.cache_file = self.project_path / "message_cache.jsonl"
+        # 消息缓存的索引（每行 "<episode_id> <字节偏移>"），按情景取消息时不必扫描整个缓存文件
+        self.cache_index_file = self.project_path / "message_cache.idx"
+
+        # hook 在监控进程不可用时暂存的消息（由 drain_pending_messages 并入情景）
+        self.pending_messages_file = self.project_path / "pending_messages.jsonl"
 
         # 待确认实体文件
         self.pending_file = self.project_path / "pending_entities.json"
@@ -120,13 +419,39 @@ class MemoryManager:
         # 当前活跃情景
         self.current_episode: Optional[Dict] = None
         self.current_messages: List[Dict] = []
-
-        # 待确认的实体候选
-        self.pending_entities: List[Dict] = []
+        self._episode_state_extra: Dict[str, Any] = {}
+
+        # 待确认的实体候选（按 id 索引，dict 保持插入顺序），
+        # _pending_dirty 表示有尚未写盘的修改，batch() 内的修改在退出时统一写盘
+        self._pending_by_id: Dict[str, Dict] = {}
+        self._pending_dirty = False
+        self._batch_depth = 0
+
+        # 状态版本号：情景、消息、待确认实体或实体数量变化时递增。
+        # get_stats_json / get_current_episode_json 以它为键缓存序列化后的 JSON
+        self._version = 0
+        self._stats_cache: Optional[Tuple[tuple, str]] = None
+        self._episode_json_cache: Optional[Tuple[int, str]] = None
+
+        # 延迟写盘的状态：尚未写入情景文件的消息、上次写盘时间、
+        # 上次读写后情景文件的 (st_ino, mtime_ns, size)（用于判断是否被其他进程改写）
+        self._state_lock = threading.RLock()
+        self._unsaved_messages: List[Dict] = []
+        self._last_episode_save = 0.0
+        self._episode_file_sig: Optional[Tuple[int, int, int]] = None
+        self._save_timer: Optional[threading.Timer] = None
+        # 消息缓存文件及其索引的句柄（首次缓存消息时打开，无缓冲追加）
+        self._cache_fh = None
+        self._cache_index_fh = None
+        # 内存中的消息缓存索引（episode_id -> 偏移列表）及其覆盖到的缓存文件位置
+        self._cache_index: Optional[Dict[str, List[int]]] = None
+        self._cache_index_end = 0
+        atexit.register(self.close)
 
         # 加载状态
         self._load_active_episode()
         self._load_pending_entities()
+        self.drain_pending_messages()
 
         # 检测并关闭过期情景
         self._close_stale_episode()
@@ -138,27 +463,67 @@ class MemoryManager:
         else:  # Mac/Linux
             return os.path.expanduser('~/.claude-memory')
 
+    def _episode_file_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.project_path / "active_episode.json")
+        except OSError:
+            return None
+        # 文件通过改名替换写入，inode 变化同样说明被改写过
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
     def _load_active_episode(self):
         """加载未完成的情景"""
-        state_file = self.project_path / "active_episode.json"
-        if state_file.exists():
-            try:
-                with open(state_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.current_episode = data.get("episode")
-                    self.current_messages = data.get("messages", [])
-            except (json.JSONDecodeError, IOError):
-                pass
+        with self._state_lock:
+            # 文件自上次读写后未被其他进程改动：内存中的状态就是最新的（可能还多出未写盘的消息）
+            sig = self._episode_file_signature()
+            if sig is not None and sig == self._episode_file_sig:
+                return
+            self._bump_version()
+
+            unsaved, self._unsaved_messages = self._unsaved_messages, []
+            state_file = self.project_path / "active_episode.json"
+            if state_file.exists():
+                try:
+                    with open(state_file, 'rb') as f:
+                        data = _jsonio.loads(f.read())
+                        self.current_episode = data.pop("episode", None)
+                        self.current_messages = [_intern_record(m) for m in data.pop("messages", [])]
+                        # SessionStart 写入的 monitor_pid / target_pid 等字段，保存时原样写回
+                        self._episode_state_extra = data
+                    self._episode_file_sig = sig
+                except (json.JSONDecodeError, IOError):
+                    pass
+
+            # 其他进程改写了情景文件而本进程还有未写盘的消息：仍是同一情景时合并后写回，
+            # 情景已被关闭或替换时丢弃（消息仍保留在 message_cache.jsonl 中）
+            if unsaved and self.current_episode and self.current_episode["id"] == unsaved[0]["episode_id"]:
+                known = {m.get("id") for m in self.current_messages}
+                self.current_messages.extend(m for m in unsaved if m["id"] not in known)
+                self._save_active_episode()
 
     def _load_pending_entities(self):
         """加载待确认的实体"""
         if self.pending_file.exists():
             try:
-                with open(self.pending_file, 'r', encoding='utf-8') as f:
-                    self.pending_entities = json.load(f)
+                with open(self.pending_file, 'rb') as f:
+                    self.pending_entities = [_intern_record(p) for p in _jsonio.loads(f.read())]
             except (json.JSONDecodeError, IOError):
                 self.pending_entities = []
 
+    @property
+    def pending_entities(self) -> List[Dict]:
+        """待确认的实体候选列表（按检测顺序）"""
+        return list(self._pending_by_id.values())
+
+    @pending_entities.setter
+    def pending_entities(self, entities: List[Dict]):
+        self._pending_by_id = {p["id"]: p for p in entities}
+        self._bump_version()
+
+    def _bump_version(self):
+        """内存状态有变化，使缓存的 JSON 失效（在修改之后调用，构建缓存时先取版本号）"""
+        self._version += 1
+
     def _close_stale_episode(self):
         """检测并关闭过期情景（上次活动超过 STALE_EPISODE_MINUTES 分钟）"""
         if not self.current_episode:
@@ -196,159 +561,430 @@ class MemoryManager:
 
     def _save_pending_entities(self):
         """保存待确认的实体"""
-        with open(self.pending_file, 'w', encoding='utf-8') as f:
-            json.dump(self.pending_entities, f, ensure_ascii=False, indent=2)
+        _write_file_atomic(self.pending_file, _jsonio.dumps(self.pending_entities))
+        self._pending_dirty = False
+
+    def _mark_pending_dirty(self):
+        """待确认实体有修改：batch() 内延迟到退出时写盘，否则立即写盘"""
+        self._pending_dirty = True
+        self._bump_version()
+        if not self._batch_depth:
+            self._save_pending_entities()
+
+    @contextmanager
+    def batch(self):
+        """
+        一组操作（如一次工具调用）内对待确认实体的修改只在结束时写盘一次，可嵌套
+
+        多个线程可同时处于 batch 中，最后一个退出的负责写盘
+        """
+        with self._state_lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._state_lock:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._pending_dirty:
+                    self._save_pending_entities()
 
     def _save_active_episode(self):
-        """保存当前情景状态"""
-        state_file = self.project_path / "active_episode.json"
-        with open(state_file, 'w', encoding='utf-8') as f:
-            json.dump({
+        """保存当前情景状态（立即写盘）"""
+        with self._state_lock:
+            state_file = self.project_path / "active_episode.json"
+            state = {
                 "episode": self.current_episode,
                 "messages": self.current_messages
-            }, f, ensure_ascii=False, indent=2)
+            }
+            # 附加字段属于当前情景的会话，情景关闭后不再保留
+            if self.current_episode:
+                state.update(self._episode_state_extra)
+            # 只供程序读取，不缩进；原子替换，并发读取（如 get_current_episode）不会读到半截文件。
+            # 记录本次写入后的文件状态（取自写入时的 fstat，避免把其他进程紧接着的改写误认成自己的）
+            st = _write_file_atomic(state_file, _jsonio.dumps(state))
+            self._episode_file_sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+            self._unsaved_messages = []
+            self._last_episode_save = time.monotonic()
+
+    def _schedule_episode_save(self):
+        """
+        有未写盘的消息时安排写盘
+
+        距上次写盘已超过 EPISODE_SAVE_INTERVAL 时立即写出，否则启动一个定时器在间隔到期时写出，
+        连续到达的消息合并为一次写盘
+        """
+        with self._state_lock:
+            if not self._unsaved_messages:
+                return
+            delay = self.EPISODE_SAVE_INTERVAL - (time.monotonic() - self._last_episode_save)
+            if delay <= 0:
+                self._save_active_episode()
+            elif self._save_timer is None:
+                self._save_timer = threading.Timer(delay, self.flush_active_episode)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush_active_episode(self):
+        """立即写出尚未写盘的消息"""
+        with self._state_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._unsaved_messages:
+                self._save_active_episode()
+
+    def close(self):
+        """写出未保存的状态并关闭消息缓存文件（进程退出时自动调用）"""
+        self.flush_active_episode()
+        with self._state_lock:
+            for fh in (self._cache_fh, self._cache_index_fh):
+                if fh is not None:
+                    fh.close()
+            self._cache_fh = self._cache_index_fh = None
 
     # ==================== 消息处理 ====================
 
     def _clean_content(self, content: str, max_length: int = 2000) -> str:
         """清理消息内容：去除代码块，截断长度"""
-        # 去除代码块（保留代码块的说明）
-        cleaned = re.sub(
-            r'```[\w]*\n[\s\S]*?```',
-            '[代码块已省略]',
-            content
-        )
-
-        # 去除行内代码
-        cleaned = re.sub(r'`[^`]+`', '[代码]', cleaned)
-
-        # 截断长度
-        if len(cleaned) > max_length:
-            cleaned = cleaned[:max_length] + "...[已截断]"
-
-        return cleaned.strip()
+        if len(content) > _CLEAN_CACHE_MAX_INPUT:
+            return _clean_content_impl(content, max_length)
+        return _clean_content_cached(content, max_length)
 
     def _extract_text_summary(self, content: str) -> str:
         """提取消息的文本摘要（用于向量存储）"""
-        # 去除代码块
-        text = re.sub(r'```[\w]*\n[\s\S]*?```', '', content)
-        # 去除行内代码
-        text = re.sub(r'`[^`]+`', '', text)
-        # 去除多余空行
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        # 截断
-        if len(text) > 500:
-            text = text[:500] + "..."
-        return text.strip()
+        if len(content) > _CLEAN_CACHE_MAX_INPUT:
+            return _text_summary_impl(content)
+        return _text_summary_cached(content)
 
     # ==================== 消息缓存 ====================
 
-    def cache_message(self, role: str, content: str) -> Dict:
-        """缓存消息（实时存储，防丢失）"""
+    def cache_message(self, role: str, content: str, timestamp: Optional[str] = None) -> Dict:
+        """缓存消息（实时存储，防丢失），timestamp 为空时使用当前时间"""
         # 清理内容，避免存储过大
         cleaned_content = self._clean_content(content)
 
         message = {
-            "id": f"msg_{uuid4().hex[:8]}",
+            "id": f"msg_{_short_id()}",
             "role": role,
             "content": cleaned_content,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": timestamp or datetime.now().isoformat(),
             "episode_id": self.current_episode["id"] if self.current_episode else None
         }
 
-        # 追加到缓存文件
-        with open(self.cache_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(message, ensure_ascii=False) + '\n')
+        with self._state_lock:
+            # 追加到缓存文件（句柄常驻、无缓冲，每条消息一次 write 直接落盘）并记录索引
+            if self._cache_fh is None:
+                self._cache_fh = open(self.cache_file, 'ab', buffering=0)
+            line = _jsonio.dumps(message) + b'\n'
+            self._cache_fh.write(line)
+            # O_APPEND 写入后文件位置位于本行末尾，其他进程并发追加也不影响
+            self._write_cache_index(message["episode_id"], self._cache_fh.tell() - len(line))
 
-        # 添加到当前情景
-        self.current_messages.append(message)
+            # 添加到当前情景
+            self.current_messages.append(message)
+            self._unsaved_messages.append(message)
+            self._bump_version()
 
         # 只对用户消息检测实体（用户的决策/偏好，不是 Claude 的建议）
         if role == "user":
             self._detect_and_process_entities(content)
 
-        # 保存状态
-        self._save_active_episode()
+        # 保存状态（连续消息合并写盘）
+        self._schedule_episode_save()
 
         return message
 
+    def _write_cache_index(self, episode_id: Optional[str], offset: int):
+        """追加一条索引（没有所属情景的消息记为 "-"，索引仍需覆盖每一行）"""
+        if self._cache_index_fh is None:
+            self._cache_index_fh = open(self.cache_index_file, 'ab', buffering=0)
+        self._cache_index_fh.write(f"{episode_id or '-'} {offset}\n".encode('utf-8'))
+
+    def _load_cache_index(self):
+        """从索引文件加载内存索引，并确定索引覆盖到的缓存文件位置"""
+        index: Dict[str, List[int]] = {}
+        first_offset, last_offset = None, -1
+        try:
+            data = self.cache_index_file.read_bytes()
+        except FileNotFoundError:
+            data = b""
+        for line in data.splitlines():
+            parts = line.split(b" ")
+            if len(parts) != 2 or not parts[1].isdigit():
+                continue  # 写入时被中断的残行
+            offset = int(parts[1])
+            index.setdefault(parts[0].decode('utf-8'), []).append(offset)
+            last_offset = max(last_offset, offset)
+            first_offset = offset if first_offset is None else min(first_offset, offset)
+
+        if first_offset:
+            # 首行不在索引中：索引创建前已有旧版本写入的消息，整体重建
+            self.cache_index_file.write_bytes(b"")
+            index, last_offset = {}, -1
+
+        end = 0
+        if last_offset >= 0:
+            try:
+                with open(self.cache_file, 'rb') as f:
+                    f.seek(last_offset)
+                    end = last_offset + len(f.readline())
+            except FileNotFoundError:
+                index, end = {}, 0
+        self._cache_index, self._cache_index_end = index, end
+
+    def _catch_up_cache_index(self):
+        """为索引之后追加的行（其他进程写入、旧版本写入）补齐索引"""
+        try:
+            size = os.path.getsize(self.cache_file)
+        except OSError:
+            size = 0
+        if size < self._cache_index_end:
+            # 缓存文件被清空或清理过，重新建立索引
+            self.cache_index_file.write_bytes(b"")
+            self._cache_index, self._cache_index_end = {}, 0
+        if size == self._cache_index_end:
+            return
+
+        with open(self.cache_file, 'rb') as f:
+            f.seek(self._cache_index_end)
+            offset = self._cache_index_end
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # 正在写入的行，下次再补
+                try:
+                    episode_id = _jsonio.loads(line).get("episode_id")
+                except (ValueError, AttributeError):
+                    episode_id = None
+                self._cache_index.setdefault(episode_id or '-', []).append(offset)
+                # 写回索引文件，其他进程下次加载时无需重复扫描（重复的偏移在查询时去重）
+                self._write_cache_index(episode_id, offset)
+                offset += len(line)
+            self._cache_index_end = offset
+
+    def _get_episode_messages(self, episode_id: str) -> List[Dict]:
+        """按索引读取情景的消息；索引与缓存文件不一致时回退为整文件扫描"""
+        with self._state_lock:
+            if self._cache_index is None:
+                self._load_cache_index()
+            self._catch_up_cache_index()
+            offsets = sorted(set(self._cache_index.get(episode_id, ())))
+
+        messages = []
+        try:
+            with open(self.cache_file, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    msg = _jsonio.loads(f.readline())
+                    if msg.get("episode_id") != episode_id:
+                        raise ValueError("stale index")
+                    messages.append(_intern_record(msg))
+            return messages
+        except (OSError, ValueError):
+            # 索引已过期（缓存文件被其他进程清理），下次重新加载
+            with self._state_lock:
+                self._cache_index = None
+
+        messages = []
+        if self.cache_file.exists():
+            # 先在原始字节中查找情景 ID，只解析可能属于该情景的行
+            needle = episode_id.encode('utf-8')
+            with open(self.cache_file, 'rb') as f:
+                for line in f:
+                    if needle not in line:
+                        continue
+                    msg = _jsonio.loads(line)
+                    if msg.get("episode_id") == episode_id:
+                        messages.append(_intern_record(msg))
+        return messages
+
+    def _reset_cache_index(self):
+        """缓存文件被改写后清空索引（原地截断，其他进程的追加句柄仍指向同一文件）"""
+        with self._state_lock:
+            if self.cache_index_file.exists():
+                self.cache_index_file.write_bytes(b"")
+            self._cache_index, self._cache_index_end = {}, 0
+
+    def drain_pending_messages(self) -> int:
+        """
+        并入 hook 暂存的消息，返回并入的条数
+
+        auto_save 在监控进程不可用时只把消息追加到 pending_messages.jsonl，
+        不初始化 MemoryManager。这里先把文件改名再读取，处理期间 hook 追加的新消息
+        会写入新文件，留给下一次处理。
+
+        用户消息的实体检测需要编码器，编码器未就绪时不处理，消息留在文件中等就绪后再并入。
+        中途失败时只把尚未处理的消息写回 pending_messages.draining，已缓存的消息不会重复追加
+        """
+        if not is_encoder_ready():
+            return 0
+
+        draining = self.project_path / "pending_messages.draining"
+        if not draining.exists():
+            try:
+                os.replace(self.pending_messages_file, draining)
+            except FileNotFoundError:
+                return 0
+
+        with open(draining, 'rb') as f:
+            lines = f.readlines()
+
+        count = 0
+        for i, line in enumerate(lines):
+            try:
+                item = _jsonio.loads(line)
+            except json.JSONDecodeError:
+                # 写入时被中断的残行
+                continue
+            if not item.get("content"):
+                continue
+            try:
+                self.cache_message(item.get("role", "user"), item["content"], item.get("timestamp"))
+            except BaseException:
+                # 这条消息已写入缓存（失败发生在其后的实体检测），只保留之后的消息
+                self._rewrite_draining(draining, lines[i + 1:])
+                raise
+            count += 1
+
+        draining.unlink()
+        return count
+
+    @staticmethod
+    def _rewrite_draining(draining: Path, lines: List[bytes]):
+        """用剩余消息原子替换 pending_messages.draining，没有剩余时删除"""
+        if not lines:
+            draining.unlink(missing_ok=True)
+            return
+        tmp = draining.with_name(draining.name + ".tmp")
+        tmp.write_bytes(b"".join(lines))
+        os.replace(tmp, draining)
+
     def _detect_and_process_entities(self, content: str):
         """检测实体并处理（自动确认高置信度的）"""
         candidates = self._detect_candidates(content)
 
+        confirmed = []
         for candidate in candidates:
             if candidate["confidence"] >= self.AUTO_CONFIRM_THRESHOLD:
-                # 高置信度，自动确认
-                self.add_entity(
-                    entity_type=candidate["type"],
-                    content=candidate["extracted_content"],
-                    reason=f"自动确认 (置信度: {candidate['confidence']:.2f})"
-                )
+                # 高置信度，自动确认（一条消息中的多个实体合并为一次批量编码与写入）
+                confirmed.append((
+                    candidate["type"],
+                    candidate["extracted_content"],
+                    f"自动确认 (置信度: {candidate['confidence']:.2f})"
+                ))
             else:
                 # 低置信度，加入待确认列表
-                self.pending_entities.append(candidate)
+                self._pending_by_id[candidate["id"]] = candidate
+                self._pending_dirty = True
+                self._bump_version()
+
+        if confirmed:
+            self.add_entities(confirmed)
 
         # 保存待确认列表
-        self._save_pending_entities()
+        if self._pending_dirty and not self._batch_depth:
+            self._save_pending_entities()
 
     def _detect_candidates(self, content: str) -> List[Dict]:
         """检测可能的实体候选"""
+        # 大多数消息不含任何触发字符，一次 C 层面的集合判断即可跳过全部模式与关键词匹配
+        if self._TRIGGER_CHARS.isdisjoint(content):
+            return []
+
         candidates = []
         detected_contents = set()  # 避免重复
+        existing_types = set()  # 已有候选的类型，随候选追加同步更新
+
+        # 有 RE2 Set 时先一次扫描得出命中的模式序号，只对这些模式提取捕获组
+        matched_ids = None
+        if self._PATTERN_SET is not None:
+            matched_ids = self._PATTERN_SET.match(content)
+        keyword_sentences = self._keyword_sentences(content)
 
-        for entity_type, rules in self.DETECTION_RULES.items():
+        for entity_type, rules in self._COMPILED_RULES.items():
             # 先用正则模式匹配，提取关键内容
-            for pattern in rules.get("patterns", []):
-                try:
-                    matches = re.findall(pattern, content, re.IGNORECASE)
-                    for match in matches:
-                        # match 可能是 tuple（多个捕获组）或 str
-                        if isinstance(match, tuple):
-                            extracted = " ".join(m for m in match if m).strip()
-                        else:
-                            extracted = match.strip()
-
-                        if extracted and len(extracted) > 3 and extracted not in detected_contents:
-                            detected_contents.add(extracted)
-                            candidates.append({
-                                "id": f"cand_{uuid4().hex[:8]}",
-                                "type": entity_type,
-                                "extracted_content": extracted[:200],  # 限制长度
-                                "source_snippet": content[:300],  # 原文片段
-                                "confidence": rules.get("min_confidence", 0.5) + 0.2,  # 模式匹配加分
-                                "status": "pending",
-                                "detected_at": datetime.now().isoformat(),
-                                "detection_method": "pattern"
-                            })
-                except re.error:
+            for pattern_id, pattern in rules["patterns"]:
+                if matched_ids is not None and pattern_id not in matched_ids:
                     continue
+                for match in pattern.findall(content):
+                    # match 可能是 tuple（多个捕获组）或 str
+                    if isinstance(match, tuple):
+                        extracted = " ".join(m for m in match if m).strip()
+                    else:
+                        extracted = match.strip()
+
+                    if extracted and len(extracted) > 3 and extracted not in detected_contents:
+                        detected_contents.add(extracted)
+                        candidates.append({
+                            "id": f"cand_{_short_id()}",
+                            "type": entity_type,
+                            "extracted_content": extracted[:200],  # 限制长度
+                            "source_snippet": content[:300],  # 原文片段
+                            "confidence": rules["min_confidence"] + 0.2,  # 模式匹配加分
+                            "status": "pending",
+                            "detected_at": datetime.now().isoformat(),
+                            "detection_method": "pattern"
+                        })
+                        existing_types.add(entity_type)
+
+            # 再用关键词匹配（置信度较低），每种类型只取第一个包含关键词的句子
+            if keyword_sentences is not None:
+                sentence = keyword_sentences.get(entity_type)
+            else:
+                sentence = self._first_keyword_sentence(content, rules["keyword_re"])
 
-            # 再用关键词匹配（置信度较低）
-            keywords = rules.get("keywords", [])
-            if any(kw in content for kw in keywords):
+            if sentence is not None:
                 # 检查是否已有更高置信度的候选
-                existing_types = {c["type"] for c in candidates}
-                if entity_type not in existing_types:
-                    # 提取包含关键词的句子
-                    sentences = re.split(r'[。！？\n]', content)
-                    for sentence in sentences:
-                        if any(kw in sentence for kw in keywords) and len(sentence) > 5:
-                            if sentence not in detected_contents:
-                                detected_contents.add(sentence)
-                                candidates.append({
-                                    "id": f"cand_{uuid4().hex[:8]}",
-                                    "type": entity_type,
-                                    "extracted_content": sentence[:200],
-                                    "source_snippet": content[:300],
-                                    "confidence": rules.get("min_confidence", 0.5),
-                                    "status": "pending",
-                                    "detected_at": datetime.now().isoformat(),
-                                    "detection_method": "keyword"
-                                })
-                            break  # 每种类型只取一个关键词匹配
+                if entity_type not in existing_types and sentence not in detected_contents:
+                    detected_contents.add(sentence)
+                    candidates.append({
+                        "id": f"cand_{_short_id()}",
+                        "type": entity_type,
+                        "extracted_content": sentence[:200],
+                        "source_snippet": content[:300],
+                        "confidence": rules["min_confidence"],
+                        "status": "pending",
+                        "detected_at": datetime.now().isoformat(),
+                        "detection_method": "keyword"
+                    })
+                    existing_types.add(entity_type)
 
         return candidates
 
+    @staticmethod
+    def _first_keyword_sentence(content: str, keyword_re: Optional[re.Pattern]) -> Optional[str]:
+        """第一个包含任一关键词且长度大于 5 的句子（keyword_re 为 _keyword_trie_pattern 编译的正则）"""
+        if keyword_re is None or not keyword_re.search(content):
+            return None
+        for match in _SENTENCE_RE.finditer(content):
+            if match.end() - match.start() > 5 and keyword_re.search(content, match.start(), match.end()):
+                return match.group()
+        return None
+
+    def _keyword_sentences(self, content: str) -> Optional[Dict[str, str]]:
+        """
+        用关键词自动机一次扫描得出每种类型的关键词句（结果与 _first_keyword_sentence 相同）
+
+        关键词不含句子分隔符，命中位置通过句子起点数组二分定位所在句子；
+        自动机按结束位置递增输出命中，因此每种类型首次记录的就是最靠前的句子
+        """
+        if self._KEYWORD_AUTOMATON is None:
+            return None
+
+        starts = [0]
+        starts.extend(m.end() for m in _SENTENCE_SPLIT.finditer(content))
+        result = {}
+        for end, (length, types) in self._KEYWORD_AUTOMATON.iter(content):
+            index = bisect_right(starts, end - length + 1) - 1
+            start = starts[index]
+            stop = starts[index + 1] - 1 if index + 1 < len(starts) else len(content)
+            if stop - start <= 5:
+                continue
+            for entity_type in types:
+                if entity_type not in result:
+                    result[entity_type] = content[start:stop]
+        return result
+
     # ==================== 情景管理 ====================
 
     def start_episode(self, title: str, tags: List[str] = None) -> Dict:
@@ -358,7 +994,7 @@ class MemoryManager:
             self.close_episode()
 
         self.current_episode = {
-            "id": f"ep_{uuid4().hex[:8]}",
+            "id": f"ep_{_short_id()}",
             "title": title,
             "tags": tags or [],
             "status": "active",
@@ -366,6 +1002,7 @@ class MemoryManager:
             "entity_ids": []
         }
         self.current_messages = []
+        self._bump_version()
 
         self._save_active_episode()
 
@@ -389,6 +1026,8 @@ class MemoryManager:
             "type": "Episode",
             "message_count": len(self.current_messages),
             "created_at": self.current_episode["created_at"],
+            # 数值形式的创建时间，列出情景时直接用作排序键
+            "created_at_ts": datetime.fromisoformat(self.current_episode["created_at"]).timestamp(),
             "closed_at": datetime.now().isoformat()
         }
 
@@ -405,6 +1044,7 @@ class MemoryManager:
         # 清空当前状态
         self.current_episode = None
         self.current_messages = []
+        self._bump_version()
         self._save_active_episode()
 
         return closed_episode
@@ -428,8 +1068,20 @@ class MemoryManager:
     def get_current_episode(self) -> Optional[Dict]:
         """获取当前情景（每次从磁盘重新加载，以便感知外部 hook 的修改）"""
         self._load_active_episode()
+        self.drain_pending_messages()
         return self.current_episode
 
+    def get_current_episode_json(self) -> str:
+        """get_current_episode() 的 JSON 文本；状态未变时直接返回上次序列化的结果"""
+        self.get_current_episode()
+        version = self._version
+        cached = self._episode_json_cache
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        text = _jsonio.dumps_str(self.current_episode, default=str)
+        self._episode_json_cache = (version, text)
+        return text
+
     # ==================== 实体管理 ====================
 
     def add_entity(
@@ -440,61 +1092,90 @@ class MemoryManager:
         related_ids: List[str] = None
     ) -> Dict:
         """添加实体"""
-        entity_id = f"ent_{uuid4().hex[:8]}"
-
-        metadata = {
-            "type": entity_type,
-            "status": "active",
-            "reason": reason or "",
-            "related_ids": ",".join(related_ids or []),
-            "episode_id": self.current_episode["id"] if self.current_episode else "",
-            "created_at": datetime.now().isoformat()
-        }
+        entity = self._new_entity(entity_type, content, reason, related_ids)
 
         # 根据类型选择存储位置
         if entity_type in self.USER_LEVEL_TYPES:
-            self.user_store.add(entity_id, content, metadata)
+            self.user_store.add(entity["id"], content, entity["metadata"])
         else:
-            self.project_store.add(entity_id, content, metadata)
+            self.project_store.add(entity["id"], content, entity["metadata"])
 
-        # 关联到当前情景
-        if self.current_episode:
-            self.current_episode["entity_ids"].append(entity_id)
-            self._save_active_episode()
+        self._link_entities([entity])
+        return entity
 
+    def add_entities(self, entries: List[Tuple[str, str, Optional[str]]]) -> List[Dict]:
+        """
+        批量添加实体，entries 为 (entity_type, content, reason)
+
+        每个存储只做一次批量编码和一次写入，情景文件也只保存一次
+        """
+        entities = [self._new_entity(t, c, r) for t, c, r in entries]
+        user_items = []
+        project_items = []
+        for entity in entities:
+            items = user_items if entity["type"] in self.USER_LEVEL_TYPES else project_items
+            items.append((entity["id"], entity["content"], entity["metadata"]))
+        if user_items:
+            self.user_store.add_many(user_items)
+        if project_items:
+            self.project_store.add_many(project_items)
+
+        self._link_entities(entities)
+        return entities
+
+    def _new_entity(
+        self,
+        entity_type: str,
+        content: str,
+        reason: Optional[str] = None,
+        related_ids: List[str] = None
+    ) -> Dict:
         return {
-            "id": entity_id,
+            "id": f"ent_{_short_id()}",
             "type": entity_type,
             "content": content,
-            "metadata": metadata
+            "metadata": {
+                "type": entity_type,
+                "status": "active",
+                "reason": reason or "",
+                "related_ids": ",".join(related_ids or []),
+                "episode_id": self.current_episode["id"] if self.current_episode else "",
+                "created_at": datetime.now().isoformat()
+            }
         }
 
+    def _link_entities(self, entities: List[Dict]):
+        """把新实体关联到当前情景"""
+        if self.current_episode:
+            self.current_episode["entity_ids"].extend(e["id"] for e in entities)
+            self._save_active_episode()
+        self._bump_version()
+
     def confirm_entity(self, candidate_id: str, entity_type: str, content: str) -> Dict:
         """确认候选实体"""
         # 移除候选
-        self.pending_entities = [
-            p for p in self.pending_entities if p["id"] != candidate_id
-        ]
-        self._save_pending_entities()
+        if self._pending_by_id.pop(candidate_id, None) is not None:
+            self._mark_pending_dirty()
 
         # 添加正式实体
         return self.add_entity(entity_type, content)
 
     def reject_candidate(self, candidate_id: str):
         """拒绝候选实体"""
-        self.pending_entities = [
-            p for p in self.pending_entities if p["id"] != candidate_id
-        ]
-        self._save_pending_entities()
+        if self._pending_by_id.pop(candidate_id, None) is not None:
+            self._mark_pending_dirty()
 
     def clear_old_pending(self, days: int = 7):
         """清理超过指定天数的待确认实体"""
-        cutoff = datetime.now().timestamp() - (days * 24 * 3600)
-        self.pending_entities = [
-            p for p in self.pending_entities
-            if datetime.fromisoformat(p["detected_at"]).timestamp() > cutoff
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        expired = [
+            pid for pid, p in self._pending_by_id.items()
+            if _iso_sort_key(p["detected_at"]) <= cutoff
         ]
-        self._save_pending_entities()
+        for pid in expired:
+            del self._pending_by_id[pid]
+        if expired:
+            self._mark_pending_dirty()
 
     def deprecate_entity(self, entity_id: str, superseded_by: Optional[str] = None):
         """废弃实体"""
@@ -537,26 +1218,32 @@ class MemoryManager:
         # Episode 过滤条件：completed（已归档的情景）
         episode_filter = {"$and": [{"type": "Episode"}, {"status": "completed"}]}
 
+        # 查询只编码一次，三次检索复用同一向量（两个 store 共用同一个编码器）
+        vector = self.project_store.encode(query)
+
         # 检索项目级实体（排除 Episode）
         entity_filter_with_type = {"$and": [{"type": {"$ne": "Episode"}}, {"status": "active"}]} if not include_deprecated else {"type": {"$ne": "Episode"}}
-        project_entities = self.project_store.search(
-            query,
+        project_entities = self.project_store.search_by_vector(
+            vector,
             top_k=top_k,
-            where=entity_filter_with_type
+            where=entity_filter_with_type,
+            query=query
         )
 
         # 单独检索 Episode（使用 completed 状态）
-        episodes = self.project_store.search(
-            query,
+        episodes = self.project_store.search_by_vector(
+            vector,
             top_k=top_k,
-            where=episode_filter
+            where=episode_filter,
+            query=query
         )
 
         # 检索用户级
-        user_results = self.user_store.search(
-            query,
+        user_results = self.user_store.search_by_vector(
+            vector,
             top_k=top_k,
-            where=entity_filter
+            where=entity_filter,
+            query=query
         )
 
         # 合并实体结果
@@ -615,22 +1302,16 @@ class MemoryManager:
             return None
 
         # 获取关联的消息
-        messages = []
-        if self.cache_file.exists():
-            with open(self.cache_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    msg = json.loads(line)
-                    if msg.get("episode_id") == episode_id:
-                        messages.append(msg)
+        messages = self._get_episode_messages(episode_id)
 
         # 获取关联的实体
-        entity_ids = episode["metadata"].get("entity_ids", "").split(",")
-        entities = []
-        for eid in entity_ids:
-            if eid:
-                ent = self.project_store.get(eid) or self.user_store.get(eid)
-                if ent:
-                    entities.append(ent)
+        # 每个库一次批量查询：先查项目级，剩下的再查用户级，最后按原顺序合并
+        entity_ids = [eid for eid in episode["metadata"].get("entity_ids", "").split(",") if eid]
+        found = {ent["id"]: ent for ent in self.project_store.get_many(entity_ids)}
+        missing = [eid for eid in entity_ids if eid not in found]
+        if missing:
+            found.update((ent["id"], ent) for ent in self.user_store.get_many(missing))
+        entities = [found[eid] for eid in entity_ids if eid in found]
 
         return {
             **episode,
@@ -649,6 +1330,7 @@ class MemoryManager:
             # 清空文件
             with open(self.cache_file, 'w', encoding='utf-8') as f:
                 pass
+            self._reset_cache_index()
 
         return {
             "status": "cleared",
@@ -656,36 +1338,148 @@ class MemoryManager:
             "file": str(self.cache_file)
         }
 
+    @staticmethod
+    def _cache_line_time(f, pos: int) -> Tuple[int, Optional[str]]:
+        """
+        定位到 pos 处或之后的第一个完整行，返回 (行首偏移, 时间戳)
+
+        无法解析的行跳过，继续看下一行；到达文件末尾时时间戳为 None
+        """
+        if pos > 0:
+            f.seek(pos - 1)
+            f.readline()  # 跳过 pos 所在的残行（pos 恰为行首时只读掉上一行的换行符）
+        else:
+            f.seek(0)
+        start = f.tell()
+        while True:
+            line = f.readline()
+            if not line:
+                return start, None
+            try:
+                return start, _line_timestamp(line)
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    def _find_cache_cut(self, f, size: int, cutoff: str) -> Optional[int]:
+        """
+        二分查找第一条晚于 cutoff 的消息的行首偏移
+
+        缓存只追加，时间戳按行单调递增，过期消息构成文件前缀，只需 O(log N) 次 seek。
+        探测到的时间戳与偏移顺序不一致（时钟回拨等）时返回 None，由调用方逐行过滤
+        """
+        probes = []
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, ts = self._cache_line_time(f, mid)
+            if ts is not None:
+                probes.append((start, ts))
+            if ts is None or ts > cutoff:
+                hi = mid
+            else:
+                lo = mid + 1
+
+        cut, ts = self._cache_line_time(f, lo)
+        if ts is not None:
+            probes.append((cut, ts))
+        probes.sort()
+        if any(a[1] > b[1] for a, b in zip(probes, probes[1:])):
+            return None
+        return cut
+
+    @staticmethod
+    def _count_expired_prefix(f, end: int, cutoff: str) -> Optional[int]:
+        """
+        统计 [0, end) 内将被删除的行数，并确认每一行都已过期
+
+        二分只能发现部分乱序，这里逐行核对被删除的前缀（通常远小于整个文件），
+        有未过期或无法解析的行时返回 None，保证不会误删
+        """
+        f.seek(0)
+        count = 0
+        while f.tell() < end:
+            line = f.readline()
+            try:
+                if _line_timestamp(line) > cutoff:
+                    return None
+            except (KeyError, TypeError, ValueError):
+                return None
+            count += 1
+        return count
+
     def cleanup_old_messages(self, days: int = 7) -> Dict:
         """
         清理超过指定天数的消息缓存
 
+        过期消息是文件前缀：二分查找切分点、核对被删除的前缀后把剩余部分原地前移再截断，
+        保留的消息不再逐行解析，也不换文件（其他进程持有的追加句柄仍指向同一文件）
+
         Args:
             days: 保留最近 N 天的消息，默认 7 天
         """
         if not self.cache_file.exists():
             return {"status": "no_cache_file", "removed": 0, "kept": 0}
 
-        cutoff = datetime.now().timestamp() - (days * 24 * 3600)
+        # ISO 时间字符串直接按字典序比较，不逐条解析为 datetime
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+
+        with open(self.cache_file, 'r+b') as f:
+            size = os.fstat(f.fileno()).st_size
+            cut = self._find_cache_cut(f, size, cutoff)
+            removed_count = None if cut is None else self._count_expired_prefix(f, cut, cutoff)
+            if removed_count is None:
+                return self._cleanup_old_messages_linear(f, cutoff, days)
+
+            kept_count = 0
+            read_pos, write_pos = cut, 0
+            if cut > 0:
+                # 读到 EOF 为止，清理期间其他进程追加的行也一并前移
+                while True:
+                    f.seek(read_pos)
+                    chunk = f.read(self.CACHE_COPY_CHUNK)
+                    if not chunk:
+                        break
+                    read_pos += len(chunk)
+                    f.seek(write_pos)
+                    f.write(chunk)
+                    write_pos += len(chunk)
+                    kept_count += chunk.count(b"\n")
+                f.truncate(write_pos)
+            else:
+                f.seek(0)
+                kept_count = sum(1 for _ in f)
+
+        if cut > 0:
+            self._reset_cache_index()
+
+        return {
+            "status": "cleaned",
+            "days_kept": days,
+            "removed": removed_count,
+            "kept": kept_count
+        }
+
+    def _cleanup_old_messages_linear(self, f, cutoff: str, days: int) -> Dict:
+        """时间戳不单调时逐行过滤（f 为以 r+b 打开的缓存文件）"""
         kept_messages = []
         removed_count = 0
 
-        with open(self.cache_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    msg = json.loads(line)
-                    msg_time = datetime.fromisoformat(msg["timestamp"]).timestamp()
-                    if msg_time > cutoff:
-                        kept_messages.append(line)
-                    else:
-                        removed_count += 1
-                except (json.JSONDecodeError, KeyError):
-                    # 保留无法解析的行（避免数据丢失）
+        f.seek(0)
+        for line in f:
+            try:
+                if _line_timestamp(line) > cutoff:
                     kept_messages.append(line)
-
-        # 重写文件
-        with open(self.cache_file, 'w', encoding='utf-8') as f:
-            f.writelines(kept_messages)
+                else:
+                    removed_count += 1
+            except (KeyError, TypeError, ValueError):
+                # 保留无法解析的行（避免数据丢失）
+                kept_messages.append(line)
+
+        # 原地重写
+        f.seek(0)
+        f.writelines(kept_messages)
+        f.truncate()
+        self._reset_cache_index()
 
         return {
             "status": "cleaned",
@@ -706,18 +1500,23 @@ class MemoryManager:
             order: 排序方式，"desc"（最新在前）或 "asc"（最早在前）
             limit: 返回数量限制
         """
-        # 直接从向量存储获取所有 Episode 类型的记录
+        # 先只取元数据排序，正文只为最终返回的记录读取
         all_episodes = self.project_store.get_by_type(
             "Episode",
             limit=limit * 2,  # 多取一些以便排序后截取
-            status="completed"
+            status="completed",
+            with_content=False
         )
 
-        # 按创建时间排序
+        # 按创建时间排序：Chroma 的 get() 不支持排序，取回元数据后按数值时间戳排序
         def get_created_at(ep):
-            created = ep.get("metadata", {}).get("created_at", "")
+            metadata = ep.get("metadata", {})
+            created_ts = metadata.get("created_at_ts")
+            if created_ts is not None:
+                return created_ts
+            # 旧版本归档的情景没有 created_at_ts
             try:
-                return datetime.fromisoformat(created).timestamp()
+                return datetime.fromisoformat(metadata.get("created_at", "")).timestamp()
             except (ValueError, TypeError):
                 return 0
 
@@ -727,34 +1526,59 @@ class MemoryManager:
             reverse=(order == "desc")
         )
 
-        return sorted_episodes[:limit]
+        episodes = self.project_store.get_many([ep["id"] for ep in sorted_episodes[:limit]])
+        for ep in episodes:
+            if ep.get("metadata"):
+                ep["metadata"] = _intern_record(ep["metadata"])
+        return episodes
 
     # ==================== 统计 ====================
 
     def get_stats(self) -> Dict:
         """获取记忆统计"""
+        return self._build_stats(self.project_store.count(), self.user_store.count(), is_encoder_ready())
+
+    def get_stats_json(self) -> str:
+        """
+        get_stats() 的 JSON 文本；状态未变时直接返回上次序列化的结果
+
+        实体数量可能被共用数据库的其他进程（监控进程、hook）改变，
+        因此两个库的 count() 与编码器状态也作为缓存键的一部分，每次仍会查询
+        """
+        project_count = self.project_store.count()
+        user_count = self.user_store.count()
+        encoder_ready = is_encoder_ready()
+        key = (self._version, project_count, user_count, encoder_ready)
+        cached = self._stats_cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        text = _jsonio.dumps_str(self._build_stats(project_count, user_count, encoder_ready), default=str)
+        self._stats_cache = (key, text)
+        return text
+
+    def _build_stats(self, project_count: int, user_count: int, encoder_ready: bool) -> Dict:
         # 统计各类型实体数量
         pending_by_type = {}
-        for p in self.pending_entities:
+        for p in self._pending_by_id.values():
             t = p.get("type", "Unknown")
             pending_by_type[t] = pending_by_type.get(t, 0) + 1
 
         return {
             "project": {
                 "path": str(self.project_path),
-                "count": self.project_store.count()
+                "count": project_count
             },
             "user": {
                 "path": str(self.user_path),
-                "count": self.user_store.count()
+                "count": user_count
             },
             "current_episode": self.current_episode["title"] if self.current_episode else None,
             "current_messages": len(self.current_messages),
             "pending_entities": {
-                "total": len(self.pending_entities),
+                "total": len(self._pending_by_id),
                 "by_type": pending_by_type
             },
             "auto_confirm_threshold": self.AUTO_CONFIRM_THRESHOLD,
-            "encoder_ready": is_encoder_ready(),
+            "encoder_ready": encoder_ready,
             "_tip": "encoder_ready=false 时，语义搜索不可用，但按 ID/类型查询仍可工作"
         }
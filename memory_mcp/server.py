@@ -5,9 +5,17 @@ MCP 记忆服务入口
 
 import os
 import sys
-import json
+import ctypes
+import select
+import signal
+import atexit
 import asyncio
-from typing import Any
+import threading
+import time
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Optional
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import (
@@ -17,570 +25,852 @@ from mcp.types import (
     ResourceTemplate,
 )
 
+from . import _jsonio
 from .memory import MemoryManager
+from .vector import is_encoder_ready, is_encoder_loading, start_encoder_warmup, shutdown_encoder
+
+if sys.platform == 'win32':
+    from ctypes import wintypes
+    _kernel32 = ctypes.windll.kernel32
 
 
 
 
 # ==================== 父进程监控 ====================
 
-_parent_monitor_task = None
+# <linux/prctl.h>
+PR_SET_PDEATHSIG = 1
+
+
+def _set_parent_death_signal() -> bool:
+    """
+    Linux：请求内核在父进程退出时向本进程发送 SIGTERM（prctl(PR_SET_PDEATHSIG)）
+
+    不占用文件描述符，也没有任何唤醒，父进程退出时由内核在其退出路径上直接投递信号。
+    注意内核以创建本进程的"线程"退出为准；MCP 客户端（Node）在主线程中启动子进程，不受影响
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(PR_SET_PDEATHSIG, int(signal.SIGTERM), 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def _watch_parent_windows(loop: asyncio.AbstractEventLoop, parent_pid: int, exited: asyncio.Event) -> bool:
+    """Windows：守护线程阻塞在 WaitForSingleObject 上，父进程退出时通知事件循环"""
+    SYNCHRONIZE = 0x00100000
+    INFINITE = 0xFFFFFFFF
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+    kernel32.WaitForSingleObject.restype = wintypes.DWORD
+    kernel32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+
+    handle = kernel32.OpenProcess(SYNCHRONIZE, False, parent_pid)
+    if not handle:
+        return False
+
+    def wait():
+        # 不用 run_in_executor：默认线程池的线程在解释器退出时会被等待，这里必须是守护线程
+        kernel32.WaitForSingleObject(handle, INFINITE)
+        kernel32.CloseHandle(handle)
+        loop.call_soon_threadsafe(exited.set)
+
+    threading.Thread(target=wait, daemon=True, name="parent-wait").start()
+    return True
+
+
+async def _wait_parent_exit(parent_pid: int) -> bool:
+    """
+    阻塞等待父进程退出（内核事件通知，等待期间不占用 CPU）
+
+    - Linux: pidfd（父进程退出时可读）注册到事件循环
+    - macOS/BSD: kqueue 的 EVFILT_PROC(NOTE_EXIT)，kqueue 描述符本身注册到事件循环
+    - Windows: 进程句柄 + WaitForSingleObject
+
+    父进程退出后返回 True；当前平台都不支持时返回 False，由调用方轮询
+    """
+    loop = asyncio.get_running_loop()
+    exited = asyncio.Event()
+
+    if hasattr(os, "pidfd_open"):
+        try:
+            fd = os.pidfd_open(parent_pid)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            fd = -1
+        if fd >= 0:
+            loop.add_reader(fd, exited.set)
+            try:
+                await exited.wait()
+            finally:
+                loop.remove_reader(fd)
+                os.close(fd)
+            return True
+
+    if hasattr(select, "kqueue"):
+        kq = select.kqueue()
+        try:
+            kq.control([select.kevent(
+                parent_pid,
+                filter=select.KQ_FILTER_PROC,
+                flags=select.KQ_EV_ADD,
+                fflags=select.KQ_NOTE_EXIT,
+            )], 0)
+        except ProcessLookupError:
+            kq.close()
+            return True
+        except OSError:
+            kq.close()
+        else:
+            loop.add_reader(kq.fileno(), exited.set)
+            try:
+                await exited.wait()
+            finally:
+                loop.remove_reader(kq.fileno())
+                kq.close()
+            return True
+
+    if sys.platform == 'win32':
+        try:
+            if _watch_parent_windows(loop, parent_pid, exited):
+                await exited.wait()
+                return True
+        except (OSError, AttributeError):
+            pass
+
+    return False
 
 
 async def monitor_parent_process():
     """
-    监控父进程是否存活。
-    如果父进程死亡（变成孤儿进程），自动退出。
+    监控父进程是否存活，父进程死亡（变成孤儿进程）时返回。
+    main() 随即取消 stdio 服务、关闭编码器并退出，
     这解决了 Claude 进程结束后 MCP 进程变成僵尸的问题。
-    """
-    import signal
 
+    Linux 上由内核在父进程退出时发送 SIGTERM（_set_parent_death_signal），
+    其他平台阻塞等待内核的进程退出通知（_wait_parent_exit），都不支持时才每 5 秒轮询一次
+    """
     parent_pid = os.getppid()
     print(f"[memory-mcp] Monitoring parent process (PID: {parent_pid})", file=sys.stderr)
 
+    # Linux：父进程退出时内核发送 SIGTERM，收到后结束监控（被其他进程 SIGTERM 时同样走正常关闭流程）
+    if _set_parent_death_signal():
+        loop = asyncio.get_running_loop()
+        terminated = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, terminated.set)
+        try:
+            # prctl 之前父进程可能已经退出（本进程已被过继，不会再收到信号）
+            if os.getppid() == parent_pid:
+                await terminated.wait()
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+        print(f"[memory-mcp] Parent process {parent_pid} died or SIGTERM received. Exiting.", file=sys.stderr)
+        return
+
+    try:
+        if await _wait_parent_exit(parent_pid):
+            print(f"[memory-mcp] Parent process {parent_pid} died. Exiting.", file=sys.stderr)
+            return
+    except Exception as e:
+        print(f"[memory-mcp] Parent monitor error: {e}, falling back to polling", file=sys.stderr)
+
     while True:
         await asyncio.sleep(5)  # 每 5 秒检查一次
 
         try:
             if sys.platform == 'win32':
                 # Windows: 检查父进程是否存在
-                import ctypes
-                kernel32 = ctypes.windll.kernel32
                 PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
-                handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, parent_pid)
+                handle = _kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, parent_pid)
                 if handle == 0:
                     # 进程不存在
                     print(f"[memory-mcp] Parent process {parent_pid} died. Exiting.", file=sys.stderr)
-                    os._exit(0)
+                    return
                 else:
-                    kernel32.CloseHandle(handle)
+                    _kernel32.CloseHandle(handle)
             else:
                 # Unix: 如果 ppid 变成 1（init），说明原父进程已死
                 current_ppid = os.getppid()
                 if current_ppid != parent_pid or current_ppid == 1:
                     print(f"[memory-mcp] Parent process {parent_pid} died (now {current_ppid}). Exiting.", file=sys.stderr)
-                    os._exit(0)
+                    return
         except Exception as e:
             print(f"[memory-mcp] Parent monitor error: {e}", file=sys.stderr)
 
 
-def start_parent_monitor():
-    """在后台启动父进程监控"""
-    global _parent_monitor_task
-
-    def run_monitor():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(monitor_parent_process())
-
-    import threading
-    monitor_thread = threading.Thread(target=run_monitor, daemon=True)
-    monitor_thread.start()
-
+# 父进程退出后等待 stdio 服务响应取消的最长时间（秒）
+SHUTDOWN_GRACE_SECONDS = 2.0
 
 # 创建 MCP 服务实例
 server = Server("memory-mcp")
 
 # 记忆管理器（延迟初始化，带锁保护）
-import threading
-_manager_lock = threading.Lock()
+# 锁只在首次初始化时用到，同样延迟创建；_lazy_locks.setdefault 保证并发的首次调用拿到同一把锁
+_manager_lock: Optional[threading.Lock] = None
+_lazy_locks: dict = {}
 memory_manager: MemoryManager = None
 
 
+def _get_manager_lock() -> threading.Lock:
+    global _manager_lock
+    lock = _manager_lock
+    if lock is None:
+        lock = _manager_lock = _lazy_locks.setdefault("manager", threading.Lock())
+    return lock
+
+
 def get_manager() -> MemoryManager:
     """获取记忆管理器实例（线程安全）"""
     global memory_manager
-    if memory_manager is None:
-        with _manager_lock:
-            # 双重检查锁定
-            if memory_manager is None:
-                project_path = os.environ.get("CLAUDE_PROJECT_ROOT", os.getcwd())
-                memory_manager = MemoryManager(project_path=project_path)
-    return memory_manager
+    # 快速路径：已初始化时只读一次全局变量，不取锁
+    manager = memory_manager
+    if manager is not None:
+        return manager
+    with _get_manager_lock():
+        # 双重检查锁定
+        if memory_manager is None:
+            project_path = os.environ.get("CLAUDE_PROJECT_ROOT", os.getcwd())
+            # 编码器若尚未启动，与 ChromaDB 初始化并行加载
+            memory_manager = MemoryManager(project_path=project_path, warmup_encoder=True)
+        return memory_manager
 
 
 # ==================== 工具定义 ====================
 
-@server.list_tools()
-async def list_tools() -> list[Tool]:
-    """列出所有可用工具"""
-    return [
-        # 消息缓存
-        Tool(
-            name="memory_cache_message",
-            description="缓存一条消息到记忆系统（自动检测实体候选）",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "role": {
-                        "type": "string",
-                        "description": "消息角色: user 或 assistant",
-                        "enum": ["user", "assistant"]
-                    },
-                    "content": {
-                        "type": "string",
-                        "description": "消息内容"
-                    }
+# 工具列表是静态的，导入时构造一次，每次 tools/list 直接返回同一个列表
+_TOOLS: list[Tool] = [
+    # 消息缓存
+    Tool(
+        name="memory_cache_message",
+        description="缓存一条消息到记忆系统（自动检测实体候选）",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "role": {
+                    "type": "string",
+                    "description": "消息角色: user 或 assistant",
+                    "enum": ["user", "assistant"]
                 },
-                "required": ["role", "content"]
-            }
-        ),
-
-        # 情景管理
-        Tool(
-            name="memory_start_episode",
-            description="开始一个新的情景（任务/功能开发会话）",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "title": {
-                        "type": "string",
-                        "description": "情景标题，如：登录功能开发"
-                    },
-                    "tags": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "标签列表，如：[\"auth\", \"login\"]"
-                    }
+                "content": {
+                    "type": "string",
+                    "description": "消息内容"
+                }
+            },
+            "required": ["role", "content"]
+        }
+    ),
+
+    # 情景管理
+    Tool(
+        name="memory_start_episode",
+        description="开始一个新的情景（任务/功能开发会话）",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "title": {
+                    "type": "string",
+                    "description": "情景标题，如：登录功能开发"
                 },
-                "required": ["title"]
-            }
-        ),
-        Tool(
-            name="memory_close_episode",
-            description="关闭当前情景，生成摘要并归档",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "summary": {
-                        "type": "string",
-                        "description": "可选的自定义摘要，不提供则自动生成"
-                    }
+                "tags": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "标签列表，如：[\"auth\", \"login\"]"
+                }
+            },
+            "required": ["title"]
+        }
+    ),
+    Tool(
+        name="memory_close_episode",
+        description="关闭当前情景，生成摘要并归档",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "summary": {
+                    "type": "string",
+                    "description": "可选的自定义摘要，不提供则自动生成"
                 }
             }
-        ),
-        Tool(
-            name="memory_get_current_episode",
-            description="获取当前活跃的情景信息",
-            inputSchema={
-                "type": "object",
-                "properties": {}
-            }
-        ),
-
-        # 实体管理
-        Tool(
-            name="memory_add_entity",
-            description="添加一个实体（Decision/Preference/Concept/Habit/File/Architecture）",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "entity_type": {
-                        "type": "string",
-                        "description": "实体类型",
-                        "enum": ["Decision", "Preference", "Concept", "Habit", "File", "Architecture"]
-                    },
-                    "content": {
-                        "type": "string",
-                        "description": "实体内容"
-                    },
-                    "reason": {
-                        "type": "string",
-                        "description": "可选的原因说明"
-                    }
+        }
+    ),
+    Tool(
+        name="memory_get_current_episode",
+        description="获取当前活跃的情景信息",
+        inputSchema={
+            "type": "object",
+            "properties": {}
+        }
+    ),
+
+    # 实体管理
+    Tool(
+        name="memory_add_entity",
+        description="添加一个实体（Decision/Preference/Concept/Habit/File/Architecture）",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "entity_type": {
+                    "type": "string",
+                    "description": "实体类型",
+                    "enum": ["Decision", "Preference", "Concept", "Habit", "File", "Architecture"]
                 },
-                "required": ["entity_type", "content"]
-            }
-        ),
-        Tool(
-            name="memory_confirm_entity",
-            description="确认一个待确认的实体候选",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "candidate_id": {
-                        "type": "string",
-                        "description": "候选实体 ID"
-                    },
-                    "entity_type": {
-                        "type": "string",
-                        "description": "确认的实体类型"
-                    },
-                    "content": {
-                        "type": "string",
-                        "description": "实体内容（可修改）"
-                    }
+                "content": {
+                    "type": "string",
+                    "description": "实体内容"
                 },
-                "required": ["candidate_id", "entity_type", "content"]
-            }
-        ),
-        Tool(
-            name="memory_reject_candidate",
-            description="拒绝一个误判的实体候选",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "candidate_id": {
-                        "type": "string",
-                        "description": "候选实体 ID"
-                    }
+                "reason": {
+                    "type": "string",
+                    "description": "可选的原因说明"
+                }
+            },
+            "required": ["entity_type", "content"]
+        }
+    ),
+    Tool(
+        name="memory_confirm_entity",
+        description="确认一个待确认的实体候选",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "candidate_id": {
+                    "type": "string",
+                    "description": "候选实体 ID"
                 },
-                "required": ["candidate_id"]
-            }
-        ),
-        Tool(
-            name="memory_deprecate_entity",
-            description="废弃一个过时的实体",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "entity_id": {
-                        "type": "string",
-                        "description": "实体 ID"
-                    },
-                    "superseded_by": {
-                        "type": "string",
-                        "description": "取代此实体的新实体 ID"
-                    }
+                "entity_type": {
+                    "type": "string",
+                    "description": "确认的实体类型"
                 },
-                "required": ["entity_id"]
-            }
-        ),
-        Tool(
-            name="memory_get_pending",
-            description="获取所有待确认的实体候选",
-            inputSchema={
-                "type": "object",
-                "properties": {}
-            }
-        ),
-
-        # 检索
-        Tool(
-            name="memory_recall",
-            description="综合检索记忆（情景+实体）。【重要】当用户询问'我是谁'、身份信息、个人偏好、历史决策、之前讨论过的内容时，应主动调用此工具检索相关记忆，而不是凭空回答。",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "query": {
-                        "type": "string",
-                        "description": "检索查询"
-                    },
-                    "top_k": {
-                        "type": "integer",
-                        "description": "返回结果数量",
-                        "default": 5
-                    },
-                    "include_deprecated": {
-                        "type": "boolean",
-                        "description": "是否包含已废弃的实体",
-                        "default": False
-                    }
+                "content": {
+                    "type": "string",
+                    "description": "实体内容（可修改）"
+                }
+            },
+            "required": ["candidate_id", "entity_type", "content"]
+        }
+    ),
+    Tool(
+        name="memory_reject_candidate",
+        description="拒绝一个误判的实体候选",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "candidate_id": {
+                    "type": "string",
+                    "description": "候选实体 ID"
+                }
+            },
+            "required": ["candidate_id"]
+        }
+    ),
+    Tool(
+        name="memory_deprecate_entity",
+        description="废弃一个过时的实体",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "entity_id": {
+                    "type": "string",
+                    "description": "实体 ID"
                 },
-                "required": ["query"]
-            }
-        ),
-        Tool(
-            name="memory_search_by_type",
-            description="按类型检索实体",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "entity_type": {
-                        "type": "string",
-                        "description": "实体类型",
-                        "enum": ["Decision", "Preference", "Concept", "Habit", "File", "Architecture", "Episode"]
-                    },
-                    "query": {
-                        "type": "string",
-                        "description": "可选的检索查询"
-                    },
-                    "top_k": {
-                        "type": "integer",
-                        "description": "返回结果数量",
-                        "default": 10
-                    }
+                "superseded_by": {
+                    "type": "string",
+                    "description": "取代此实体的新实体 ID"
+                }
+            },
+            "required": ["entity_id"]
+        }
+    ),
+    Tool(
+        name="memory_get_pending",
+        description="获取所有待确认的实体候选",
+        inputSchema={
+            "type": "object",
+            "properties": {}
+        }
+    ),
+
+    # 检索
+    Tool(
+        name="memory_recall",
+        description="综合检索记忆（情景+实体）。【重要】当用户询问'我是谁'、身份信息、个人偏好、历史决策、之前讨论过的内容时，应主动调用此工具检索相关记忆，而不是凭空回答。",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "检索查询"
                 },
-                "required": ["entity_type"]
-            }
-        ),
-        Tool(
-            name="memory_get_episode_detail",
-            description="获取情景详情（包含消息和关联实体）",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "episode_id": {
-                        "type": "string",
-                        "description": "情景 ID"
-                    }
+                "top_k": {
+                    "type": "integer",
+                    "description": "返回结果数量",
+                    "default": 5
                 },
-                "required": ["episode_id"]
-            }
-        ),
-
-        # 统计
-        Tool(
-            name="memory_stats",
-            description="获取记忆系统统计信息",
-            inputSchema={
-                "type": "object",
-                "properties": {}
-            }
-        ),
-
-        # 编码器状态
-        Tool(
-            name="memory_encoder_status",
-            description="查询向量编码器状态。返回编码器是否已就绪，以及哪些操作当前可用。",
-            inputSchema={
-                "type": "object",
-                "properties": {}
-            }
-        ),
-
-        # 日志管理
-        Tool(
-            name="memory_clear_cache",
-            description="清空消息缓存日志（message_cache.jsonl）。警告：此操作不可逆！",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "confirm": {
-                        "type": "boolean",
-                        "description": "确认清空，必须设为 true",
-                        "default": False
-                    }
+                "include_deprecated": {
+                    "type": "boolean",
+                    "description": "是否包含已废弃的实体",
+                    "default": False
+                }
+            },
+            "required": ["query"]
+        }
+    ),
+    Tool(
+        name="memory_search_by_type",
+        description="按类型检索实体",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "entity_type": {
+                    "type": "string",
+                    "description": "实体类型",
+                    "enum": ["Decision", "Preference", "Concept", "Habit", "File", "Architecture", "Episode"]
                 },
-                "required": ["confirm"]
-            }
-        ),
-        Tool(
-            name="memory_cleanup_messages",
-            description="清理超过指定天数的消息缓存，保留最近 N 天的消息",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "days": {
-                        "type": "integer",
-                        "description": "保留最近 N 天的消息",
-                        "default": 7
-                    }
+                "query": {
+                    "type": "string",
+                    "description": "可选的检索查询"
+                },
+                "top_k": {
+                    "type": "integer",
+                    "description": "返回结果数量",
+                    "default": 10
+                }
+            },
+            "required": ["entity_type"]
+        }
+    ),
+    Tool(
+        name="memory_get_episode_detail",
+        description="获取情景详情（包含消息和关联实体）",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "episode_id": {
+                    "type": "string",
+                    "description": "情景 ID"
+                }
+            },
+            "required": ["episode_id"]
+        }
+    ),
+
+    # 统计
+    Tool(
+        name="memory_stats",
+        description="获取记忆系统统计信息",
+        inputSchema={
+            "type": "object",
+            "properties": {}
+        }
+    ),
+
+    # 编码器状态
+    Tool(
+        name="memory_encoder_status",
+        description="查询向量编码器状态。返回编码器是否已就绪，以及哪些操作当前可用。",
+        inputSchema={
+            "type": "object",
+            "properties": {}
+        }
+    ),
+
+    # 日志管理
+    Tool(
+        name="memory_clear_cache",
+        description="清空消息缓存日志（message_cache.jsonl）。警告：此操作不可逆！",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "confirm": {
+                    "type": "boolean",
+                    "description": "确认清空，必须设为 true",
+                    "default": False
+                }
+            },
+            "required": ["confirm"]
+        }
+    ),
+    Tool(
+        name="memory_cleanup_messages",
+        description="清理超过指定天数的消息缓存，保留最近 N 天的消息",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "days": {
+                    "type": "integer",
+                    "description": "保留最近 N 天的消息",
+                    "default": 7
                 }
             }
-        ),
-        Tool(
-            name="memory_list_episodes",
-            description="列出所有历史情景（按时间排序，不依赖语义搜索）。当用户要查看'所有历史情景'时使用此工具，避免语义搜索遗漏。",
-            inputSchema={
-                "type": "object",
-                "properties": {
-                    "order": {
-                        "type": "string",
-                        "description": "排序方式：desc（最新在前）或 asc（最早在前）",
-                        "enum": ["desc", "asc"],
-                        "default": "desc"
-                    },
-                    "limit": {
-                        "type": "integer",
-                        "description": "返回数量限制",
-                        "default": 50
-                    }
+        }
+    ),
+    Tool(
+        name="memory_list_episodes",
+        description="列出所有历史情景（按时间排序，不依赖语义搜索）。当用户要查看'所有历史情景'时使用此工具，避免语义搜索遗漏。",
+        inputSchema={
+            "type": "object",
+            "properties": {
+                "order": {
+                    "type": "string",
+                    "description": "排序方式：desc（最新在前）或 asc（最早在前）",
+                    "enum": ["desc", "asc"],
+                    "default": "desc"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "返回数量限制",
+                    "default": 50
                 }
             }
-        ),
-    ]
+        }
+    ),
+]
 
 
-@server.call_tool()
-async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
-    """调用工具"""
-    manager = get_manager()
+@server.list_tools()
+async def list_tools() -> list[Tool]:
+    """列出所有可用工具"""
+    return _TOOLS
 
-    try:
-        if name == "memory_cache_message":
-            result = manager.cache_message(
-                role=arguments["role"],
-                content=arguments["content"]
-            )
-
-        elif name == "memory_start_episode":
-            result = manager.start_episode(
-                title=arguments["title"],
-                tags=arguments.get("tags", [])
-            )
-
-        elif name == "memory_close_episode":
-            result = manager.close_episode(
-                summary=arguments.get("summary")
-            )
-
-        elif name == "memory_get_current_episode":
-            result = manager.get_current_episode()
-
-        elif name == "memory_add_entity":
-            result = manager.add_entity(
-                entity_type=arguments["entity_type"],
-                content=arguments["content"],
-                reason=arguments.get("reason")
-            )
-
-        elif name == "memory_confirm_entity":
-            result = manager.confirm_entity(
-                candidate_id=arguments["candidate_id"],
-                entity_type=arguments["entity_type"],
-                content=arguments["content"]
-            )
-
-        elif name == "memory_reject_candidate":
-            manager.reject_candidate(arguments["candidate_id"])
-            result = {"status": "rejected", "id": arguments["candidate_id"]}
-
-        elif name == "memory_deprecate_entity":
-            manager.deprecate_entity(
-                entity_id=arguments["entity_id"],
-                superseded_by=arguments.get("superseded_by")
-            )
-            result = {"status": "deprecated", "id": arguments["entity_id"]}
-
-        elif name == "memory_get_pending":
-            result = manager.get_pending_entities()
-
-        elif name == "memory_recall":
-            result = manager.recall(
-                query=arguments["query"],
-                top_k=arguments.get("top_k", 5),
-                include_deprecated=arguments.get("include_deprecated", False)
-            )
-
-        elif name == "memory_search_by_type":
-            result = manager.search_by_type(
-                entity_type=arguments["entity_type"],
-                query=arguments.get("query"),
-                top_k=arguments.get("top_k", 10)
-            )
-
-        elif name == "memory_get_episode_detail":
-            result = manager.get_episode_detail(arguments["episode_id"])
-
-        elif name == "memory_stats":
-            result = manager.get_stats()
-
-        elif name == "memory_encoder_status":
-            from .vector import is_encoder_ready, is_encoder_loading
-            ready = is_encoder_ready()
-            loading = is_encoder_loading()
-            result = {
-                "encoder_ready": ready,
-                "encoder_loading": loading,
-                "status": "ready" if ready else ("loading" if loading else "not_started"),
-                "available_operations": {
-                    "always_available": [
-                        "memory_stats",
-                        "memory_encoder_status",
-                        "memory_get_current_episode",
-                        "memory_get_pending",
-                        "memory_start_episode",
-                        "memory_close_episode",
-                        "memory_add_entity",
-                        "memory_confirm_entity",
-                        "memory_reject_candidate",
-                        "memory_deprecate_entity",
-                        "memory_cache_message",
-                        "memory_search_by_type (无 query 参数时)",
-                        "memory_get_episode_detail",
-                        "memory_list_episodes",
-                        "memory_clear_cache",
-                        "memory_cleanup_messages",
-                    ],
-                    "requires_encoder": [
-                        "memory_recall",
-                        "memory_search_by_type (有 query 参数时)",
-                    ]
-                },
-                "_tip": "编码器首次加载通常需要 10-30 秒，之后会被缓存"
-            }
 
-        elif name == "memory_clear_cache":
-            if not arguments.get("confirm", False):
-                result = {"error": "必须设置 confirm=true 才能清空日志"}
-            else:
-                result = manager.clear_message_cache()
+# ==================== 工具参数 ====================
+# 每个工具的参数解析为一个 slots 数据类：字段与 inputSchema 的 properties 对应，
+# 缺省值集中定义在这里，处理函数按属性取值，不再逐个 arguments.get(..., 默认值)
 
-        elif name == "memory_cleanup_messages":
-            days = arguments.get("days", 7)
-            result = manager.cleanup_old_messages(days=days)
+@dataclass(slots=True)
+class CacheMessageArgs:
+    role: str
+    content: str
 
-        elif name == "memory_list_episodes":
-            result = manager.list_all_episodes(
-                order=arguments.get("order", "desc"),
-                limit=arguments.get("limit", 50)
-            )
 
-        else:
+@dataclass(slots=True)
+class StartEpisodeArgs:
+    title: str
+    tags: list = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class CloseEpisodeArgs:
+    summary: Optional[str] = None
+
+
+@dataclass(slots=True)
+class AddEntityArgs:
+    entity_type: str
+    content: str
+    reason: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ConfirmEntityArgs:
+    candidate_id: str
+    entity_type: str
+    content: str
+
+
+@dataclass(slots=True)
+class RejectCandidateArgs:
+    candidate_id: str
+
+
+@dataclass(slots=True)
+class DeprecateEntityArgs:
+    entity_id: str
+    superseded_by: Optional[str] = None
+
+
+@dataclass(slots=True)
+class RecallArgs:
+    query: str
+    top_k: int = 5
+    include_deprecated: bool = False
+
+
+@dataclass(slots=True)
+class SearchByTypeArgs:
+    entity_type: str
+    query: Optional[str] = None
+    top_k: int = 10
+
+
+@dataclass(slots=True)
+class EpisodeDetailArgs:
+    episode_id: str
+
+
+@dataclass(slots=True)
+class ClearCacheArgs:
+    confirm: bool = False
+
+
+@dataclass(slots=True)
+class CleanupMessagesArgs:
+    days: int = 7
+
+
+@dataclass(slots=True)
+class ListEpisodesArgs:
+    order: str = "desc"
+    limit: int = 50
+
+
+def _parse_args(args_cls: Optional[type], arguments: Optional[dict]) -> Any:
+    """把工具参数解析为对应的数据类（无参数的工具返回 None）"""
+    if args_cls is None:
+        return None
+    try:
+        return args_cls(**arguments)
+    except TypeError:
+        # 客户端多传了 schema 之外的字段：忽略后重试；缺少必填字段时仍抛出 TypeError
+        known = {f.name for f in fields(args_cls)}
+        return args_cls(**{k: v for k, v in (arguments or {}).items() if k in known})
+
+
+# ==================== 工具分发 ====================
+
+def _reject_candidate(manager: MemoryManager, args: RejectCandidateArgs) -> dict:
+    manager.reject_candidate(args.candidate_id)
+    return {"status": "rejected", "id": args.candidate_id}
+
+
+def _deprecate_entity(manager: MemoryManager, args: DeprecateEntityArgs) -> dict:
+    manager.deprecate_entity(
+        entity_id=args.entity_id,
+        superseded_by=args.superseded_by
+    )
+    return {"status": "deprecated", "id": args.entity_id}
+
+
+# memory_encoder_status 的静态部分只构造一次，每次调用浅拷贝后填入编码器状态
+_ENCODER_STATUS_SKELETON = {
+    "encoder_ready": None,
+    "encoder_loading": None,
+    "status": None,
+    "available_operations": {
+        "always_available": [
+            "memory_stats",
+            "memory_encoder_status",
+            "memory_get_current_episode",
+            "memory_get_pending",
+            "memory_start_episode",
+            "memory_close_episode",
+            "memory_add_entity",
+            "memory_confirm_entity",
+            "memory_reject_candidate",
+            "memory_deprecate_entity",
+            "memory_cache_message",
+            "memory_search_by_type (无 query 参数时)",
+            "memory_get_episode_detail",
+            "memory_list_episodes",
+            "memory_clear_cache",
+            "memory_cleanup_messages",
+        ],
+        "requires_encoder": [
+            "memory_recall",
+            "memory_search_by_type (有 query 参数时)",
+        ]
+    },
+    "vector_precision": "float16 传输（向量已归一化，按 float32 存储；相对误差约 1e-3，不影响余弦检索排序）",
+    "_tip": "编码器首次加载通常需要 10-30 秒，之后会被缓存"
+}
+
+
+def _encoder_status(manager: MemoryManager, args: None) -> dict:
+    ready = is_encoder_ready()
+    loading = is_encoder_loading()
+    result = _ENCODER_STATUS_SKELETON.copy()
+    result["encoder_ready"] = ready
+    result["encoder_loading"] = loading
+    result["status"] = "ready" if ready else ("loading" if loading else "not_started")
+    return result
+
+
+def _clear_cache(manager: MemoryManager, args: ClearCacheArgs) -> dict:
+    if not args.confirm:
+        return {"error": "必须设置 confirm=true 才能清空日志"}
+    return manager.clear_message_cache()
+
+
+# 工具名 -> (处理函数 (manager, 参数数据类) -> 结果, 参数数据类)，导入时构造一次，调用时一次字典查找
+_DISPATCH: dict[str, tuple[Callable[[MemoryManager, Any], Any], Optional[type]]] = {
+    "memory_cache_message": (lambda m, a: m.cache_message(
+        role=a.role,
+        content=a.content
+    ), CacheMessageArgs),
+    "memory_start_episode": (lambda m, a: m.start_episode(
+        title=a.title,
+        tags=a.tags
+    ), StartEpisodeArgs),
+    "memory_close_episode": (lambda m, a: m.close_episode(
+        summary=a.summary
+    ), CloseEpisodeArgs),
+    "memory_get_current_episode": (lambda m, a: m.get_current_episode_json(), None),
+    "memory_add_entity": (lambda m, a: m.add_entity(
+        entity_type=a.entity_type,
+        content=a.content,
+        reason=a.reason
+    ), AddEntityArgs),
+    "memory_confirm_entity": (lambda m, a: m.confirm_entity(
+        candidate_id=a.candidate_id,
+        entity_type=a.entity_type,
+        content=a.content
+    ), ConfirmEntityArgs),
+    "memory_reject_candidate": (_reject_candidate, RejectCandidateArgs),
+    "memory_deprecate_entity": (_deprecate_entity, DeprecateEntityArgs),
+    "memory_get_pending": (lambda m, a: m.get_pending_entities(), None),
+    "memory_recall": (lambda m, a: m.recall(
+        query=a.query,
+        top_k=a.top_k,
+        include_deprecated=a.include_deprecated
+    ), RecallArgs),
+    "memory_search_by_type": (lambda m, a: m.search_by_type(
+        entity_type=a.entity_type,
+        query=a.query,
+        top_k=a.top_k
+    ), SearchByTypeArgs),
+    "memory_get_episode_detail": (lambda m, a: m.get_episode_detail(a.episode_id), EpisodeDetailArgs),
+    "memory_stats": (lambda m, a: m.get_stats_json(), None),
+    "memory_encoder_status": (_encoder_status, None),
+    "memory_clear_cache": (_clear_cache, ClearCacheArgs),
+    "memory_cleanup_messages": (lambda m, a: m.cleanup_old_messages(days=a.days), CleanupMessagesArgs),
+    "memory_list_episodes": (lambda m, a: m.list_all_episodes(
+        order=a.order,
+        limit=a.limit
+    ), ListEpisodesArgs),
+}
+
+
+# 只读内存状态、不涉及磁盘/数据库/编码器的工具，直接在事件循环上执行，不必切换线程；
+# 不经过 _run_tool（不取 _tool_lock，也不进入 batch() 争用 _state_lock），避免在事件循环上等待其他线程的慢操作
+_INLINE_TOOLS = frozenset({"memory_encoder_status", "memory_get_pending"})
+
+
+# 返回已序列化 JSON 文本的工具（由 MemoryManager 按状态版本号缓存），结果直接作为响应文本
+_PRESERIALIZED_TOOLS = frozenset({"memory_stats", "memory_get_current_episode"})
+
+
+# MemoryManager 不支持并发调用（当前情景、消息列表、待确认实体等状态没有加锁）。
+# 工具在线程中执行以免阻塞事件循环，但同一时间只执行一个，与在事件循环上逐个执行时的语义一致
+_tool_lock = threading.Lock()
+
+
+def _run_tool(handler: Callable[[MemoryManager, Any], Any], manager: MemoryManager, args: Any) -> Any:
+    # 一次工具调用内对待确认实体的多次修改合并为一次写盘
+    with _tool_lock, manager.batch():
+        return handler(manager, args)
+
+
+def _run_locked(method: Callable[[], Any]) -> Any:
+    """在 _tool_lock 下调用 MemoryManager 的方法（资源读取同样会刷新情景、并入暂存消息）"""
+    with _tool_lock:
+        return method()
+
+
+async def _get_manager_async() -> MemoryManager:
+    """首次初始化（打开 ChromaDB）放到线程中执行，不阻塞事件循环"""
+    manager = memory_manager
+    if manager is not None:
+        return manager
+    return await asyncio.to_thread(get_manager)
+
+
+@server.call_tool()
+async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
+    """
+    调用工具
+
+    MemoryManager 的方法是同步的（ChromaDB 读写、向量编码），放到线程中执行，
+    事件循环在此期间继续处理其他请求和父进程监控；并行到达的工具调用由 _tool_lock 依次执行
+    """
+    # JSON 解析出的工具名不是驻留字符串；驻留后与 _DISPATCH 的字面量键是同一对象，字典查找按指针即可命中
+    name = sys.intern(name)
+    try:
+        manager = await _get_manager_async()
+        entry = _DISPATCH.get(name)
+        if entry is None:
             result = {"error": f"Unknown tool: {name}"}
+        else:
+            handler, args_cls = entry
+            args = _parse_args(args_cls, arguments)
+            if name in _INLINE_TOOLS:
+                result = handler(manager, args)
+            else:
+                result = await asyncio.to_thread(_run_tool, handler, manager, args)
 
         return [TextContent(
             type="text",
-            text=json.dumps(result, ensure_ascii=False, indent=2, default=str)
+            text=result if name in _PRESERIALIZED_TOOLS else _jsonio.dumps_str(result, default=str)
         )]
 
     except Exception as e:
         return [TextContent(
             type="text",
-            text=json.dumps({"error": str(e)}, ensure_ascii=False)
+            text=_jsonio.dumps_str({"error": str(e)})
         )]
 
 
 # ==================== 资源定义 ====================
 
+# 资源列表同样是静态的
+_RESOURCES: list[Resource] = [
+    Resource(
+        uri="memory://stats",
+        name="Memory Stats",
+        description="记忆系统统计信息",
+        mimeType="application/json"
+    ),
+    Resource(
+        uri="memory://current-episode",
+        name="Current Episode",
+        description="当前活跃的情景",
+        mimeType="application/json"
+    ),
+    Resource(
+        uri="memory://pending-entities",
+        name="Pending Entities",
+        description="待确认的实体候选",
+        mimeType="application/json"
+    ),
+]
+
+
 @server.list_resources()
 async def list_resources() -> list[Resource]:
     """列出可用资源"""
-    return [
-        Resource(
-            uri="memory://stats",
-            name="Memory Stats",
-            description="记忆系统统计信息",
-            mimeType="application/json"
-        ),
-        Resource(
-            uri="memory://current-episode",
-            name="Current Episode",
-            description="当前活跃的情景",
-            mimeType="application/json"
-        ),
-        Resource(
-            uri="memory://pending-entities",
-            name="Pending Entities",
-            description="待确认的实体候选",
-            mimeType="application/json"
-        ),
-    ]
+    return _RESOURCES
 
 
 @server.read_resource()
 async def read_resource(uri: str) -> str:
     """读取资源"""
-    manager = get_manager()
+    # 与 call_tool 相同，驻留后与下面的字面量比较时按指针即可判等（SDK 可能传入 URL 对象，先转为 str）
+    uri = sys.intern(str(uri))
+    manager = await _get_manager_async()
 
     if uri == "memory://stats":
-        return json.dumps(manager.get_stats(), ensure_ascii=False, indent=2)
+        return await asyncio.to_thread(_run_locked, manager.get_stats_json)
 
     elif uri == "memory://current-episode":
-        episode = manager.get_current_episode()
-        return json.dumps(episode, ensure_ascii=False, indent=2, default=str)
+        return await asyncio.to_thread(_run_locked, manager.get_current_episode_json)
 
     elif uri == "memory://pending-entities":
         pending = manager.get_pending_entities()
-        return json.dumps(pending, ensure_ascii=False, indent=2, default=str)
+        return _jsonio.dumps_str(pending, default=str)
 
     else:
-        return json.dumps({"error": f"Unknown resource: {uri}"})
+        return _jsonio.dumps_str({"error": f"Unknown resource: {uri}"})
 
 
 # ==================== 启动服务 ====================
 
+# 预热日志与 hook 调试日志同在用户级目录（各平台一致、始终可写）；
+# 以前写到 %APPDATA%/claude-memory，非 Windows 上 APPDATA 为空时会落到当前目录
+WARMUP_LOG_FILE = Path.home() / ".claude" / "memory" / "warmup.log"
+
 def warmup_background():
     """
     后台预热：在独立进程中加载编码器，不阻塞主进程
@@ -592,25 +882,24 @@ def warmup_background():
     改为延迟初始化，避免与 hooks 争抢数据库锁。
     MemoryManager 会在第一次调用工具时通过 get_manager() 初始化。
     """
-    import sys
-    import time
-    from pathlib import Path
-    from datetime import datetime
-    from .vector import start_encoder_warmup
-
-    # 日志文件路径
-    log_file = Path(os.environ.get('APPDATA', '')) / 'claude-memory' / 'warmup.log'
+    # 日志文件只打开一次（行缓冲），打开失败时只输出到 stderr
+    try:
+        WARMUP_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+        log_fp = open(WARMUP_LOG_FILE, 'a', encoding='utf-8', buffering=1)
+        atexit.register(log_fp.close)
+    except OSError:
+        log_fp = None
 
     def log(msg: str):
         """同时输出到 stderr 和文件"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         line = f"[{timestamp}] {msg}"
         print(line, file=sys.stderr)
-        try:
-            with open(log_file, 'a', encoding='utf-8') as f:
-                f.write(line + '\n')
-        except Exception:
-            pass
+        if log_fp is not None:
+            try:
+                log_fp.write(line + '\n')
+            except Exception:
+                pass
 
     try:
         start = time.time()
@@ -629,33 +918,62 @@ def warmup_background():
         log(f"[memory-mcp] Warmup error: {e}")
 
 
+async def _serve_stdio():
+    """在 stdio 上运行 MCP 服务，直到客户端断开"""
+    async with stdio_server() as (read_stream, write_stream):
+        await server.run(
+            read_stream,
+            write_stream,
+            server.create_initialization_options()
+        )
+
+
 async def main():
-    """主入口"""
-    # 启动父进程监控（关键！防止成为僵尸进程）
-    start_parent_monitor()
+    """
+    主入口
+
+    stdio 服务与父进程监控是同一事件循环上的兄弟任务：任一个结束（客户端断开 / 父进程退出）
+    就取消另一个，随后在 finally 中关闭编码器子进程，不会因为直接退出进程而把它遗留为孤儿
+    """
+    # 父进程监控（关键！防止成为僵尸进程）：只是等待一个内核事件，直接作为主事件循环上的任务运行
+    server_task = asyncio.create_task(_serve_stdio(), name="stdio-server")
+    monitor_task = asyncio.create_task(monitor_parent_process(), name="parent-monitor")
+    parent_exited = False
 
     try:
-        # 后台预热：不阻塞服务启动，模型在后台线程加载
+        # 后台预热：不阻塞服务启动，模型在编码器子进程中加载
         warmup_background()
 
-        async with stdio_server() as (read_stream, write_stream):
-            await server.run(
-                read_stream,
-                write_stream,
-                server.create_initialization_options()
-            )
+        done, _ = await asyncio.wait({server_task, monitor_task}, return_when=asyncio.FIRST_COMPLETED)
+        parent_exited = monitor_task in done
+        if server_task in done:
+            # 服务异常退出时在这里抛出
+            server_task.result()
     except Exception as e:
         print(f"[memory-mcp] Server error: {e}", file=sys.stderr)
     finally:
         print("[memory-mcp] Server shutting down.", file=sys.stderr)
-        # 关闭编码器进程池，防止子进程变成孤儿进程
+        monitor_task.cancel()
+        server_task.cancel()
+        # 读 stdin 的工作线程在父进程退出后可能仍阻塞，取消最多等待 SHUTDOWN_GRACE_SECONDS
+        await asyncio.wait({server_task, monitor_task}, timeout=SHUTDOWN_GRACE_SECONDS)
+        # 写出合并写盘中尚未保存的消息：下面的 os._exit 不会执行 atexit 注册的 close()
+        if memory_manager is not None:
+            try:
+                memory_manager.close()
+            except Exception as e:
+                print(f"[memory-mcp] Memory manager close error: {e}", file=sys.stderr)
+        # 关闭编码器进程，防止子进程变成孤儿进程
         try:
-            from .vector import shutdown_encoder
             shutdown_encoder()
             print("[memory-mcp] Encoder pool shutdown complete.", file=sys.stderr)
         except Exception as e:
             print(f"[memory-mcp] Encoder shutdown error: {e}", file=sys.stderr)
 
+    if parent_exited:
+        # 编码器已关闭；仍阻塞在 stdin 上的线程会让 asyncio.run 的收尾一直等待，直接结束进程
+        os._exit(0)
+
 
 def run():
     """同步启动入口"""
@@ -2,16 +2,24 @@ from .store import (
     VectorStore,
     is_encoder_ready,
     is_encoder_loading,
+    wait_for_encoder,
     start_encoder_warmup,
+    begin_shutdown_encoder,
     shutdown_encoder,
     encode_text,
+    encode_texts,
+    clear_encode_cache,
 )
 
 __all__ = [
     "VectorStore",
     "is_encoder_ready",
     "is_encoder_loading",
+    "wait_for_encoder",
     "start_encoder_warmup",
+    "begin_shutdown_encoder",
     "shutdown_encoder",
     "encode_text",
+    "encode_texts",
+    "clear_encode_cache",
 ]
@@ -1,16 +1,221 @@
 """
 编码器工作进程
 
-独立运行，通过 stdin/stdout 的 JSON 行与主进程通信。
+独立运行，通过 stdin/stdout 的二进制帧与主进程通信。
+帧格式：4 字节小端长度前缀 + 1 字节消息类型 + 4 字节请求 ID + 负载（FRAME_HEADER = "<IBI"）
+响应帧原样带回请求的 ID，主进程据此把结果分发给对应的调用方。
 协议：
-  - 主进程发送: {"text": "..."} 或 {"texts": ["...", ...]}
-  - 工作进程返回: {"vector": [...]} 或 {"vectors": [[...], ...]}
-  - 工作进程就绪时发送: {"status": "ready"}
-  - 错误时返回: {"error": "..."}
+  - 主进程发送: MSG_TEXT（UTF-8 文本）或 MSG_TEXTS（4 字节条数 + 每条 4 字节长度 + 拼接的 UTF-8 文本）
+  - 工作进程返回: MSG_VECTORS_F16（4 字节条数 + float16 原始字节，向量已归一化）
+  - 控制消息使用 MSG_JSON：
+      就绪: {"status": "ready"}
+      错误: {"error": "..."}
+      退出: {"cmd": "quit"}
 """
 import sys
 import json
 import os
+import struct
+import select
+import platform
+import threading
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+# 帧格式（与 store.py 保持一致）
+FRAME_HEADER = struct.Struct("<IBI")
+COUNT_HEADER = struct.Struct("<I")
+
+MSG_JSON = 0
+MSG_TEXT = 1
+MSG_TEXTS = 2
+MSG_VECTORS = 3
+MSG_VECTORS_F16 = 4
+
+# 与主进程一致的 64KB 管道缓冲，每帧只在 flush 时产生一次写系统调用
+PIPE_BUFFER_SIZE = 65536
+
+# PyTorch 计算线程数：默认取逻辑核数的一半（近似物理核数）。用满全部逻辑核时超线程/大小核之间互相争抢，
+# 且 MCP 服务与监控进程各有一个工作进程，反而更慢。可用 MEMORY_MCP_ENCODER_THREADS 覆盖
+ENCODER_THREADS = int(os.environ.get("MEMORY_MCP_ENCODER_THREADS") or max(1, (os.cpu_count() or 2) // 2))
+
+# 固定到这些 CPU 核上计算（逗号分隔的核编号，仅 Linux），多个工作进程时由主进程按轮转分配
+ENCODER_CPUS = os.environ.get("MEMORY_MCP_ENCODER_CPUS", "")
+
+# MEMORY_MCP_TORCH_COMPILE=1 时用 torch.compile 编译 Transformer 前向（需要 PyTorch 2.x 和可用的 C 编译器，
+# 首次编译耗时数十秒，只适合长时间运行的场景），默认关闭
+TORCH_COMPILE = os.environ.get("MEMORY_MCP_TORCH_COMPILE", "0") == "1"
+
+# 编码后端：torch（默认）或 onnx（需要 pip install chenxiaofie-memory-mcp[onnx]）。
+# onnx 后端在 CPU 上用 ONNX Runtime 运行同一模型的 int8 量化导出版本，加载失败时退回 torch
+ENCODER_BACKEND = os.environ.get("MEMORY_MCP_ENCODER_BACKEND", "torch").lower()
+
+# onnx 后端加载的模型文件（模型仓库内的相对路径），默认按 CPU 架构选择 int8 量化版本
+ONNX_FILE = os.environ.get("MEMORY_MCP_ONNX_FILE") or (
+    "onnx/model_qint8_arm64.onnx"
+    if platform.machine().lower() in ("arm64", "aarch64")
+    else "onnx/model_quint8_avx2.onnx"
+)
+
+# 就绪前预先编码一批有代表性的文本（中英混合，长度从几个到约 128 个 token），
+# 首个真实请求不再承担分词器与模型的惰性初始化（及编译）开销
+_WARMUP_ZH = "我们决定在这个项目中使用 PostgreSQL 作为主数据库，并用 Redis 缓存会话。"
+_WARMUP_EN = "The user prefers concise answers and wants tests to run before every commit. "
+WARMUP_TEXTS = [
+    "记忆",
+    "memory search",
+    _WARMUP_ZH,
+    _WARMUP_EN,
+    _WARMUP_ZH * 2 + _WARMUP_EN,
+    _WARMUP_EN * 2 + _WARMUP_ZH,
+    _WARMUP_ZH * 4,
+    (_WARMUP_EN + _WARMUP_ZH) * 3,
+]
+
+# 提示内核预读的模型文件（模型仓库内的相对路径）
+_MODEL_FILES = ("model.safetensors", "pytorch_model.bin", "tokenizer.json", "sentencepiece.bpe.model")
+
+
+def write_frame(out, kind: int, payload: bytes, req_id: int = 0):
+    """写入一帧（头部与负载一次写出）"""
+    out.write(FRAME_HEADER.pack(len(payload), kind, req_id) + payload)
+    out.flush()
+
+
+def write_vectors(out, vecs, req_id: int = 0, kind: int = MSG_VECTORS):
+    """
+    写入向量帧（MSG_VECTORS 为 float32，MSG_VECTORS_F16 为 float16）
+
+    头部写入缓冲区后直接写出数组内存（memoryview），不经 tobytes() 和拼接产生两份拷贝；
+    超过缓冲区大小的负载由 BufferedWriter 直接写入管道
+    """
+    body = memoryview(vecs).cast('B')
+    count_header = COUNT_HEADER.pack(len(vecs))
+    out.write(FRAME_HEADER.pack(len(count_header) + body.nbytes, kind, req_id) + count_header)
+    out.write(body)
+    out.flush()
+
+
+def write_json(out, obj: dict, req_id: int = 0):
+    write_frame(out, MSG_JSON, _dumps(obj), req_id)
+
+
+def read_frame(inp):
+    """读取一帧，EOF 时返回 (None, 0, None)"""
+    header = inp.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None, 0, None
+    length, kind, req_id = FRAME_HEADER.unpack(header)
+    payload = inp.read(length)
+    if len(payload) < length:
+        return None, 0, None
+    return kind, req_id, payload
+
+
+def unpack_texts(payload: bytes) -> list:
+    """解析 MSG_TEXTS 负载为文本列表"""
+    count, = COUNT_HEADER.unpack_from(payload)
+    offset = COUNT_HEADER.size
+    lengths = struct.unpack_from(f"<{count}I", payload, offset)
+    offset += 4 * count
+    view = memoryview(payload)
+    texts = []
+    for n in lengths:
+        texts.append(str(view[offset:offset + n], 'utf-8'))
+        offset += n
+    return texts
+
+
+def load_model(model_name: str):
+    """加载模型，返回 (SentenceTransformer, 实际使用的后端)"""
+    from sentence_transformers import SentenceTransformer
+
+    if ENCODER_BACKEND == "onnx":
+        try:
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = ENCODER_THREADS
+            model = SentenceTransformer(model_name, backend="onnx", model_kwargs={
+                "file_name": ONNX_FILE,
+                "provider": "CPUExecutionProvider",
+                "session_options": options,
+            })
+            return model, "onnx"
+        except Exception as e:
+            print(f"[memory-mcp] ONNX backend unavailable, using torch: {e}", file=sys.stderr)
+
+    return SentenceTransformer(model_name), "torch"
+
+
+def limit_cpu_usage():
+    """
+    限制 BLAS/OpenMP 线程数并固定 CPU 核
+
+    OpenMP/MKL 在首次导入时读取线程数环境变量，必须在导入 numpy/torch 之前设置，
+    否则各自按全部逻辑核创建线程池，多个工作进程时互相争抢
+    """
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(name, str(ENCODER_THREADS))
+    if ENCODER_CPUS and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {int(cpu) for cpu in ENCODER_CPUS.split(",")})
+        except (OSError, ValueError) as e:
+            print(f"[memory-mcp] CPU affinity not applied: {e}", file=sys.stderr)
+
+
+def prefetch_model_files(model_name: str):
+    """
+    模型已在本地缓存时，提示内核预读权重与分词器文件（POSIX_FADV_WILLNEED，仅 Unix）
+
+    预读在后台进行，与随后导入 torch 的数秒重叠，加载模型时文件已在页缓存中；
+    模型尚未下载或无法定位时直接跳过
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    try:
+        from huggingface_hub import snapshot_download
+        folder = snapshot_download(repo_id, local_files_only=True)
+    except Exception:
+        return
+
+    names = list(_MODEL_FILES)
+    if ENCODER_BACKEND == "onnx":
+        names[:2] = [ONNX_FILE]
+    for name in names:
+        try:
+            fd = os.open(os.path.join(folder, name), os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def watch_stdin_eof(fd: int, loaded: threading.Event):
+    """
+    模型加载期间（10-30 秒）主循环还没有读 stdin，主进程在此期间退出也不会被察觉。
+    主进程只在收到 ready 之后才发送请求，所以 ready 之前 stdin 变为可读只能是 EOF：直接退出。
+    之后由主循环的 read 读到 EOF 结束，两者都是阻塞等待，不需要轮询父进程
+    """
+    try:
+        select.select([fd], [], [])
+    except (OSError, ValueError):
+        return
+    if not loaded.is_set():
+        os._exit(0)
+
 
 def main():
     # 禁用进度条
@@ -19,42 +224,94 @@ def main():
 
     model_name = sys.argv[1] if len(sys.argv) > 1 else 'paraphrase-multilingual-MiniLM-L12-v2'
 
+    # 协议独占 stdout 的二进制流，第三方库的 print 改道到 stderr，避免破坏帧
+    out = open(sys.stdout.fileno(), 'wb', buffering=PIPE_BUFFER_SIZE, closefd=False)
+    inp = open(sys.stdin.fileno(), 'rb', buffering=PIPE_BUFFER_SIZE, closefd=False)
+    sys.stdout = sys.stderr
+
+    # Windows 的 select 不支持管道，只能等到主循环读到 EOF
+    loaded = threading.Event()
+    if sys.platform != "win32":
+        threading.Thread(target=watch_stdin_eof, args=(inp.fileno(), loaded), daemon=True).start()
+
+    limit_cpu_usage()
+    prefetch_model_files(model_name)
     try:
-        from sentence_transformers import SentenceTransformer
-        model = SentenceTransformer(model_name)
+        import numpy as np
+        import torch
+        # 线程数须在任何并行计算之前设置（set_num_interop_threads 在之后调用会抛出 RuntimeError）
+        try:
+            torch.set_num_threads(ENCODER_THREADS)
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        model, backend = load_model(model_name)
+        model.eval()
     except Exception as e:
-        sys.stdout.write(json.dumps({"error": f"model load failed: {e}"}) + "\n")
-        sys.stdout.flush()
+        write_json(out, {"error": f"model load failed: {e}"})
         return
+    print(f"[memory-mcp] Encoder backend: {backend}", file=sys.stderr)
 
-    # 通知主进程模型已就绪
-    sys.stdout.write(json.dumps({"status": "ready"}) + "\n")
-    sys.stdout.flush()
+    # 有 GPU 时以半精度计算；CPU 上保持 float32 计算，只在输出时转为 float16
+    try:
+        if backend == "torch" and torch.cuda.is_available():
+            model = model.half()
+    except Exception:
+        pass
 
-    # 循环处理编码请求
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
+    eager_model = None
+    if backend == "torch" and TORCH_COMPILE and hasattr(torch, "compile"):
+        try:
+            # 只编译底层 Transformer，分词和池化仍由 SentenceTransformer 完成；序列长度可变，按动态形状编译
+            eager_model = model[0].auto_model
+            model[0].auto_model = torch.compile(eager_model, dynamic=True)
+        except Exception as e:
+            eager_model = None
+            print(f"[memory-mcp] torch.compile unavailable, using eager mode: {e}", file=sys.stderr)
+
+    try:
         try:
-            req = json.loads(line)
+            model.encode(WARMUP_TEXTS, batch_size=32, convert_to_numpy=True, normalize_embeddings=True)
+        except Exception as e:
+            # 编译在首次调用时才真正进行，失败（如缺少 C 编译器）时退回未编译的模型
+            if eager_model is None:
+                raise
+            print(f"[memory-mcp] torch.compile failed, using eager mode: {e}", file=sys.stderr)
+            model[0].auto_model = eager_model
+            model.encode(WARMUP_TEXTS, batch_size=32, convert_to_numpy=True, normalize_embeddings=True)
+    except Exception as e:
+        write_json(out, {"error": f"model warmup failed: {e}"})
+        return
+
+    # 通知主进程模型已就绪（先置位，主进程随后发来的请求不会被当成 EOF）
+    loaded.set()
+    write_json(out, {"status": "ready"})
 
-            if "text" in req:
-                vec = model.encode(req["text"]).tolist()
-                resp = {"vector": vec}
-            elif "texts" in req:
-                vecs = [v.tolist() for v in model.encode(req["texts"])]
-                resp = {"vectors": vecs}
-            elif req.get("cmd") == "quit":
-                break
+    # 循环处理编码请求
+    while True:
+        kind, req_id, payload = read_frame(inp)
+        if kind is None:
+            break
+        try:
+            if kind == MSG_TEXT:
+                texts = [payload.decode('utf-8')]
+            elif kind == MSG_TEXTS:
+                texts = unpack_texts(payload)
+            elif kind == MSG_JSON:
+                req = _loads(payload)
+                if req.get("cmd") == "quit":
+                    break
+                write_json(out, {"error": "unknown request"}, req_id)
+                continue
             else:
-                resp = {"error": "unknown request"}
+                write_json(out, {"error": "unknown request"}, req_id)
+                continue
 
-            sys.stdout.write(json.dumps(resp) + "\n")
-            sys.stdout.flush()
+            # 集合使用余弦距离，向量归一化后以 float16 传输，管道字节数减半（相对误差约 1e-3，不影响检索排序）
+            vecs = model.encode(texts, batch_size=32, convert_to_numpy=True, normalize_embeddings=True)
+            write_vectors(out, np.ascontiguousarray(vecs, dtype=np.float16), req_id, MSG_VECTORS_F16)
         except Exception as e:
-            sys.stdout.write(json.dumps({"error": str(e)}) + "\n")
-            sys.stdout.flush()
+            write_json(out, {"error": str(e)}, req_id)
 
 
 if __name__ == "__main__":
@@ -6,33 +6,96 @@
 1. 使用 subprocess.Popen 启动独立编码器工作进程
 2. 通过显式创建的 stdin/stdout PIPE 通信，避免 MCP stdio 管道继承问题
 3. 模型加载在子进程中，不占用主进程 GIL
+4. 向量以 float32 ndarray 形式从管道直达 ChromaDB，不经过 Python 列表
 """
 
 import chromadb
+import numpy as np
 from chromadb.config import Settings
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 from pathlib import Path
-import json
 import os
+import re
 import sys
+import atexit
+import sqlite3
+import struct
 import logging
 import threading
 import time
+import queue
+import hashlib
+import itertools
 import subprocess
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+
+from .. import _jsonio
 
 logger = logging.getLogger(__name__)
 
 # 模型配置
 MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
 
+# 批量接口每次发送给编码器的最大条数
+ENCODE_BATCH_SIZE = 64
+
+# add_many 最多提前提交几批编码请求：写入 Chroma 的同时编码器已在计算后续批次，
+# 多出的一批让每个编码器工作进程算完手头这批后立即有下一批可取
+ENCODE_PIPELINE_DEPTH = 2
+
+# 并发的单条编码请求合并为一批发送：编码器正忙（已有请求在途）时最多再等这么久收集后续请求，
+# 空闲时不等待，单个请求的延迟不受影响
+ENCODE_COALESCE_WINDOW = 0.005
+
+# 合并的单条请求每批最多条数：更大的批次对 MiniLM 在 CPU 上的吞吐提升已不明显，
+# 反而让整批中每个调用方都等最长那条文本算完
+ENCODE_COALESCE_MAX = 16
+
+# encode_text 的结果缓存（LRU，按文本的 16 字节 blake2b 摘要索引）：重复的检索词不再经过编码器。
+# 超过 ENCODE_CACHE_MAX_TEXT 字节的文本很少重复，不缓存
+ENCODE_CACHE_SIZE = 4096
+ENCODE_CACHE_MAX_TEXT = 4096
+_encode_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+_encode_cache_lock = threading.Lock()
+
 # 全局状态
 _encoder_ready = False
 _encoder_loading = False
 _encoder_lock = threading.Lock()
+# 一次加载结束（成功或失败）时置位，开始新的加载时清除；等待方据此阻塞而不必轮询
+_encoder_settled = threading.Event()
 
-# 编码器子进程
-_worker_proc: Optional[subprocess.Popen] = None
-_worker_lock = threading.Lock()
+# 编码器工作进程数：每个进程各自加载一份模型（数百 MB 内存），且 MCP 服务与监控进程各有自己的编码器，
+# 默认只启动 1 个；并发检索较多的多核机器可用 MEMORY_MCP_ENCODER_WORKERS 增加
+ENCODER_WORKERS = max(1, int(os.environ.get("MEMORY_MCP_ENCODER_WORKERS") or 1))
+
+# 存活的编码器子进程：各自的写线程从同一个发送队列领取请求，空闲的进程先拿到下一个请求
+_workers: List[subprocess.Popen] = []
+# 每个工作进程已写出、尚未收到响应的请求 ID；某个进程退出时只让它手上的请求失败
+_inflight: Dict[subprocess.Popen, set] = {}
+
+# 请求流水线：调用方把请求放入发送队列后立即等待各自的 Future，
+# 写线程负责串行写管道，读线程按 req_id 把响应分发给对应的 Future
+_send_queue: "queue.Queue[Optional[Tuple[int, int, bytes]]]" = queue.Queue()
+_pending: Dict[int, Future] = {}
+_pending_lock = threading.Lock()
+_req_ids = itertools.count(1)
+
+# 工作进程通信帧格式（与 _encoder_worker.py 保持一致）
+# 帧 = 4 字节小端长度 + 1 字节消息类型 + 4 字节请求 ID + 负载
+# 请求 ID 由主进程分配，工作进程原样带回；就绪消息的请求 ID 为 0
+FRAME_HEADER = struct.Struct("<IBI")
+COUNT_HEADER = struct.Struct("<I")
+
+MSG_JSON = 0      # 控制消息（就绪/错误/退出），负载为 JSON
+MSG_TEXT = 1      # 单条文本请求，负载为 UTF-8 文本
+MSG_TEXTS = 2     # 批量文本请求，负载为 <u32 条数><u32 长度 × 条数><拼接的 UTF-8 文本>
+MSG_VECTORS = 3   # 向量响应，负载为 4 字节条数 + float32 原始字节
+MSG_VECTORS_F16 = 4  # 向量响应，负载为 4 字节条数 + float16 原始字节（工作进程默认使用，向量已归一化）
+
+# 管道缓冲区大小：批量响应（N×384×4 字节）可在少量系统调用内读完
+PIPE_BUFFER_SIZE = 65536
 
 
 def is_encoder_ready() -> bool:
@@ -45,118 +108,479 @@ def is_encoder_loading() -> bool:
     return _encoder_loading
 
 
+def wait_for_encoder(timeout: Optional[float] = None) -> bool:
+    """阻塞等待编码器加载结束，返回是否就绪（超时或加载失败时返回 False）"""
+    if _encoder_ready:
+        return True
+    _encoder_settled.wait(timeout)
+    return _encoder_ready
+
+
+# worker 脚本路径与工作目录（模块加载时计算一次）
+_WORKER_SCRIPT = str(Path(__file__).parent / "_encoder_worker.py")
+_WORKER_CWD = str(Path(__file__).parent.parent.parent)
+
+
 def _get_worker_script() -> str:
     """获取 worker 脚本路径"""
-    return str(Path(__file__).parent / "_encoder_worker.py")
+    return _WORKER_SCRIPT
+
+
+def _write_frame(stream, kind: int, payload: bytes, req_id: int = 0):
+    """发送一帧（头部与负载合并为一次写入）"""
+    stream.write(FRAME_HEADER.pack(len(payload), kind, req_id) + payload)
+    stream.flush()
+
+
+def _read_exact(stream, n: int) -> bytes:
+    """从管道读取恰好 n 字节，EOF 时抛出异常"""
+    data = stream.read(n)
+    if len(data) < n:
+        raise EOFError("编码器管道已关闭")
+    return data
+
+
+def _read_frame(stream):
+    """读取一帧，返回 (消息类型, 请求 ID, 负载)"""
+    length, kind, req_id = FRAME_HEADER.unpack(_read_exact(stream, FRAME_HEADER.size))
+    return kind, req_id, _read_exact(stream, length)
+
+
+def _pack_texts(texts: List[str]) -> bytes:
+    """按 MSG_TEXTS 的固定布局打包文本列表（无 JSON 转义，无中间 dict）"""
+    return _pack_encoded([t.encode('utf-8') for t in texts])
+
+
+def _pack_encoded(encoded: List[bytes]) -> bytes:
+    """按 MSG_TEXTS 的固定布局打包已编码为 UTF-8 的文本"""
+    lengths = struct.pack(f"<{len(encoded)}I", *map(len, encoded))
+    return COUNT_HEADER.pack(len(encoded)) + lengths + b"".join(encoded)
+
+
+def _decode_vectors(payload: bytes, kind: int = MSG_VECTORS) -> np.ndarray:
+    """
+    解析向量负载为 (条数, 维度) 的 float32 矩阵
+
+    MSG_VECTORS 为零拷贝视图；MSG_VECTORS_F16 转换为 float32（ChromaDB 按 float32 存储）
+    """
+    count, = COUNT_HEADER.unpack_from(payload)
+    if kind == MSG_VECTORS_F16:
+        flat = np.frombuffer(payload, dtype=np.float16, offset=COUNT_HEADER.size).astype(np.float32)
+    else:
+        flat = np.frombuffer(payload, dtype=np.float32, offset=COUNT_HEADER.size)
+    return flat.reshape(count, -1) if count else flat.reshape(0, 0)
+
+
+def _spawn_worker(env: Optional[Dict[str, str]]) -> subprocess.Popen:
+    """启动一个编码器工作进程（不等待模型加载）"""
+    kwargs = {
+        'stdin': subprocess.PIPE,
+        'stdout': subprocess.PIPE,
+        'stderr': subprocess.PIPE,
+        'bufsize': PIPE_BUFFER_SIZE,
+        'cwd': _WORKER_CWD,
+        'env': env,
+    }
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+
+    proc = subprocess.Popen([sys.executable, _get_worker_script(), MODEL_NAME], **kwargs)
+    print(f"[memory-mcp] Worker pid={proc.pid}, waiting for model load...", file=sys.stderr)
+    return proc
+
+
+def _worker_env(index: int) -> Optional[Dict[str, str]]:
+    """
+    第 index 个工作进程的环境变量（单个工作进程时继承当前环境，返回 None）
+
+    多个工作进程平分计算线程，避免互相超额订阅 CPU（用户显式设置时不覆盖）；
+    Linux 上再把可用核按轮转分给各进程（MEMORY_MCP_ENCODER_CPUS），各自固定在自己的核上计算
+    """
+    if ENCODER_WORKERS <= 1:
+        return None
+    env = dict(os.environ)
+    if not os.environ.get("MEMORY_MCP_ENCODER_THREADS"):
+        threads = max(1, (os.cpu_count() or 2) // 2 // ENCODER_WORKERS)
+        env["MEMORY_MCP_ENCODER_THREADS"] = str(threads)
+    if hasattr(os, "sched_getaffinity") and "MEMORY_MCP_ENCODER_CPUS" not in os.environ:
+        cores = sorted(os.sched_getaffinity(0))
+        if len(cores) >= ENCODER_WORKERS:
+            env["MEMORY_MCP_ENCODER_CPUS"] = ",".join(map(str, cores[index::ENCODER_WORKERS]))
+    return env
+
+
+def _await_ready(proc: subprocess.Popen):
+    """等待工作进程发送 ready（阻塞，在后台线程中运行所以 OK），失败时抛出异常"""
+    try:
+        kind, _, payload = _read_frame(proc.stdout)
+    except EOFError:
+        stderr_out = proc.stderr.read().decode('utf-8', errors='replace')
+        raise RuntimeError(f"Worker produced no output. stderr: {stderr_out[:500]}")
+
+    if kind != MSG_JSON:
+        raise RuntimeError(f"Unexpected worker frame type: {kind}")
+    resp = _jsonio.loads(payload)
+    if "error" in resp:
+        raise RuntimeError(f"Worker error: {resp['error']}")
+    if resp.get("status") != "ready":
+        raise RuntimeError(f"Unexpected worker response: {resp}")
 
 
 def _start_worker():
     """启动编码器工作进程（在后台线程中调用）"""
-    global _worker_proc, _encoder_ready, _encoder_loading
+    global _workers, _encoder_ready, _encoder_loading
 
     with _encoder_lock:
-        if _encoder_ready and _worker_proc and _worker_proc.poll() is None:
+        if _encoder_ready and _workers:
+            _encoder_settled.set()
             return
         if _encoder_loading:
             return
         _encoder_loading = True
 
+    procs: List[subprocess.Popen] = []
     try:
-        worker_script = _get_worker_script()
         print(f"[memory-mcp] Starting encoder worker subprocess...", file=sys.stderr)
 
-        kwargs = {
-            'stdin': subprocess.PIPE,
-            'stdout': subprocess.PIPE,
-            'stderr': subprocess.PIPE,
-            'cwd': str(Path(__file__).parent.parent.parent),
-        }
-        if sys.platform == 'win32':
-            kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
-
-        _worker_proc = subprocess.Popen(
-            [sys.executable, worker_script, MODEL_NAME],
-            **kwargs,
-        )
-
-        print(f"[memory-mcp] Worker pid={_worker_proc.pid}, waiting for model load...", file=sys.stderr)
-
-        # 等待 worker 发送 ready（阻塞，在后台线程中运行所以 OK）
-        first_line = _worker_proc.stdout.readline()
-        if not first_line:
-            stderr_out = _worker_proc.stderr.read().decode('utf-8', errors='replace')
-            raise RuntimeError(f"Worker produced no output. stderr: {stderr_out[:500]}")
+        # 全部进程同时加载模型，再依次等待就绪；至少一个就绪即可提供服务
+        procs = [_spawn_worker(_worker_env(i)) for i in range(ENCODER_WORKERS)]
+        ready = []
+        error = None
+        for proc in procs:
+            try:
+                _await_ready(proc)
+                ready.append(proc)
+            except Exception as e:
+                error = e
+                print(f"[memory-mcp] Worker pid={proc.pid} failed: {e}", file=sys.stderr)
+                if proc.poll() is None:
+                    proc.kill()
+        if not ready:
+            raise error
 
-        resp = json.loads(first_line.decode('utf-8'))
-        if "error" in resp:
-            raise RuntimeError(f"Worker error: {resp['error']}")
-
-        if resp.get("status") == "ready":
-            _encoder_ready = True
-            _encoder_loading = False
-            print("[memory-mcp] Encoder worker ready!", file=sys.stderr)
-        else:
-            raise RuntimeError(f"Unexpected worker response: {resp}")
+        _drain_send_queue()
+        with _pending_lock:
+            _workers = ready
+            for proc in ready:
+                _inflight[proc] = set()
+        for proc in ready:
+            _start_io_threads(proc)
+        # 最后才置位 _encoder_ready：无锁读到 True 的一方看到的 _workers 和 I/O 线程都已就绪
+        _encoder_ready = True
+        _encoder_loading = False
+        _encoder_settled.set()
+        print("[memory-mcp] Encoder worker ready!", file=sys.stderr)
 
     except Exception as e:
         _encoder_loading = False
         print(f"[memory-mcp] Worker start failed: {e}", file=sys.stderr)
         logger.error(f"[memory-mcp] Worker start failed: {e}")
         # 清理
-        if _worker_proc and _worker_proc.poll() is None:
-            _worker_proc.kill()
-        _worker_proc = None
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+        _encoder_settled.set()
 
 
 def start_encoder_warmup():
     """启动编码器预热（非阻塞）"""
+    # 已就绪时不再启动线程去争 _encoder_lock（无锁读取，见 _submit）
+    if _encoder_ready and _workers:
+        return
+    # 在启动线程前清除，保证随后调用 wait_for_encoder 的一方等到这次加载的结果
+    if not (_encoder_ready or _encoder_loading):
+        _encoder_settled.clear()
     threading.Thread(target=_start_worker, daemon=True, name="encoder-warmup").start()
 
 
-def encode_text(text: str, timeout: float = 60.0) -> List[float]:
-    """编码文本，编码器未就绪时直接抛出异常"""
-    if not _encoder_ready:
-        raise RuntimeError("向量编码器尚未就绪，请稍后再试。可运行 memory-mcp-init 预下载模型。")
+def _fail_pending(error: Exception):
+    """让所有未完成的请求以同一个异常结束"""
+    with _pending_lock:
+        futures = list(_pending.values())
+        _pending.clear()
+    for fut in futures:
+        if not fut.done():
+            fut.set_exception(error)
+
+
+def _fail_inflight(proc: subprocess.Popen, error: Exception):
+    """让已写给 proc、尚未收到响应的请求以 error 结束"""
+    with _pending_lock:
+        req_ids = _inflight.pop(proc, ())
+        futures = [_pending.pop(req_id) for req_id in req_ids if req_id in _pending]
+    for fut in futures:
+        try:
+            fut.set_exception(error)
+        except InvalidStateError:
+            pass
 
-    # 发送编码请求
-    with _worker_lock:
-        if _worker_proc is None or _worker_proc.poll() is not None:
-            raise RuntimeError("编码器工作进程已退出")
 
+def _collect_texts(first: Tuple[int, int, bytes], deferred: List) -> List[Tuple[int, int, bytes]]:
+    """
+    从发送队列中收集可与 first 合并的单条文本请求
+
+    编码器已有请求在途时在 ENCODE_COALESCE_WINDOW 内继续等待，否则只取队列中已有的，最多 ENCODE_COALESCE_MAX 条；
+    遇到其他类型的请求（或退出标记）放入 deferred，稍后按原顺序发送
+    """
+    batch = [first]
+    with _pending_lock:
+        busy = len(_pending) > 1
+    deadline = time.monotonic() + (ENCODE_COALESCE_WINDOW if busy else 0.0)
+    while len(batch) < ENCODE_COALESCE_MAX:
+        remaining = deadline - time.monotonic()
+        try:
+            item = _send_queue.get(timeout=remaining) if remaining > 0 else _send_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is None or item[1] != MSG_TEXT:
+            deferred.append(item)
+            break
+        batch.append(item)
+    return batch
+
+
+def _fan_out(batch_fut: Future, members: List[Tuple[int, Future]]):
+    """合并请求完成后把第 i 行向量交给第 i 个调用方"""
+    with _pending_lock:
+        for req_id, _ in members:
+            _pending.pop(req_id, None)
+    error = batch_fut.exception()
+    vectors = None if error is not None else batch_fut.result()
+    for i, (_, fut) in enumerate(members):
         try:
-            req = json.dumps({"text": text}) + "\n"
-            _worker_proc.stdin.write(req.encode('utf-8'))
-            _worker_proc.stdin.flush()
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(vectors[i:i + 1])
+        except InvalidStateError:
+            pass  # 调用方已超时放弃，或工作进程退出时已被 _fail_pending 结束
+
+
+def _write_batch(proc: subprocess.Popen, batch: List[Tuple[int, int, bytes]]):
+    """把多条 MSG_TEXT 请求合并为一个 MSG_TEXTS 请求发送"""
+    members = []
+    with _pending_lock:
+        for req_id, _, _ in batch:
+            fut = _pending.get(req_id)
+            if fut is not None:
+                members.append((req_id, fut))
+    if not members:
+        return
 
-            resp_line = _worker_proc.stdout.readline()
-            if not resp_line:
-                raise RuntimeError("编码器无响应")
+    batch_id = next(_req_ids) & 0xFFFFFFFF
+    batch_fut: Future = Future()
+    with _pending_lock:
+        _pending[batch_id] = batch_fut
+        _inflight.get(proc, set()).add(batch_id)
+    batch_fut.add_done_callback(lambda f: _fan_out(f, members))
+    live = {req_id for req_id, _ in members}
+    payload = _pack_encoded([text for req_id, _, text in batch if req_id in live])
+    _write_frame(proc.stdin, MSG_TEXTS, payload, batch_id)
 
-            resp = json.loads(resp_line.decode('utf-8'))
-            if "error" in resp:
-                raise RuntimeError(f"编码失败: {resp['error']}")
 
-            return resp["vector"]
+def _writer_loop(proc: subprocess.Popen):
+    """
+    写线程：从发送队列取请求写入管道；收到 None 时通知工作进程退出并结束
+
+    并发到达的单条文本请求合并为一个批量请求，编码器一次前向计算处理整批
+    """
+    deferred: List = []
+    while True:
+        item = deferred.pop(0) if deferred else _send_queue.get()
+        if proc not in _inflight:
+            # 工作进程已退出（读线程已清理）：请求留给其他工作进程
+            for pending in [item] + deferred:
+                _send_queue.put(pending)
+            return
+        try:
+            if item is None:
+                _write_frame(proc.stdin, MSG_JSON, b'{"cmd":"quit"}')
+                return
+            req_id, kind, payload = item
+            if kind == MSG_TEXT:
+                batch = _collect_texts(item, deferred)
+                if len(batch) > 1:
+                    _write_batch(proc, batch)
+                    continue
+            with _pending_lock:
+                _inflight.get(proc, set()).add(req_id)
+            _write_frame(proc.stdin, kind, payload, req_id)
         except (BrokenPipeError, OSError) as e:
-            raise RuntimeError(f"编码器通信失败: {e}")
+            _fail_inflight(proc, RuntimeError(f"编码器通信失败: {e}"))
+            for pending in deferred:
+                _send_queue.put(pending)
+            return
 
 
-def shutdown_encoder():
-    """关闭编码器工作进程"""
-    global _worker_proc, _encoder_ready, _encoder_loading
+def _reader_loop(proc: subprocess.Popen):
+    """读线程：读取响应帧并按 req_id 分发给等待中的 Future"""
+    global _encoder_ready
+    inflight = _inflight.get(proc, set())
+    while True:
+        try:
+            kind, req_id, payload = _read_frame(proc.stdout)
+        except (EOFError, OSError):
+            break
+        with _pending_lock:
+            fut = _pending.pop(req_id, None)
+            inflight.discard(req_id)
+        if fut is None:
+            continue  # 调用方已超时放弃
+        if kind == MSG_JSON:
+            resp = _jsonio.loads(payload)
+            fut.set_exception(RuntimeError(f"编码失败: {resp.get('error', resp)}"))
+        else:
+            fut.set_result(_decode_vectors(payload, kind))
+
+    # 管道关闭：工作进程已退出。它手上的请求失败；最后一个工作进程退出时唤醒所有等待者
+    _fail_inflight(proc, RuntimeError("编码器无响应"))
+    with _pending_lock:
+        was_live = proc in _workers
+        if was_live:
+            _workers.remove(proc)
+        last = not _workers
+    if last:
+        if was_live:
+            _encoder_ready = False
+        _fail_pending(RuntimeError("编码器无响应"))
+
 
-    if _worker_proc and _worker_proc.poll() is None:
+def _drain_send_queue():
+    """清掉上一批工作进程遗留的请求与退出标记"""
+    while True:
         try:
-            _worker_proc.stdin.write(b'{"cmd":"quit"}\n')
-            _worker_proc.stdin.flush()
-            _worker_proc.wait(timeout=5)
-        except Exception:
-            _worker_proc.kill()
+            _send_queue.get_nowait()
+        except queue.Empty:
+            break
+
+
+def _start_io_threads(proc: subprocess.Popen):
+    """工作进程就绪后启动它的读写线程"""
+    threading.Thread(target=_writer_loop, args=(proc,), daemon=True, name="encoder-writer").start()
+    threading.Thread(target=_reader_loop, args=(proc,), daemon=True, name="encoder-reader").start()
 
-    _worker_proc = None
+
+def _submit(kind: int, payload: bytes) -> Future:
+    """
+    提交一次编码请求，立即返回 Future（结果为 (条数, 维度) 的 float32 矩阵）
+
+    就绪状态无锁读取，稳定运行后只有登记在途请求时短暂持有 _pending_lock
+    """
+    if not _encoder_ready:
+        raise RuntimeError("向量编码器尚未就绪，请稍后再试。可运行 memory-mcp-init 预下载模型。")
+    if not _workers:
+        raise RuntimeError("编码器工作进程已退出")
+
+    req_id = next(_req_ids) & 0xFFFFFFFF
+    fut: Future = Future()
+    with _pending_lock:
+        _pending[req_id] = fut
+    _send_queue.put((req_id, kind, payload))
+    return fut
+
+
+def _request_vectors(kind: int, payload: bytes, timeout: float) -> np.ndarray:
+    """向工作进程发送一次编码请求并等待结果，返回 (条数, 维度) 矩阵
+
+    多个线程可同时有请求在途，不再互相等待管道往返
+    """
+    return _await_vectors(_submit(kind, payload), timeout)
+
+
+def _await_vectors(fut: Future, timeout: float) -> np.ndarray:
+    """等待编码请求的结果；超时后移除其在途登记，迟到的响应直接丢弃"""
+    try:
+        vectors = fut.result(timeout=timeout)
+    except FutureTimeoutError:
+        with _pending_lock:
+            for req_id, pending in list(_pending.items()):
+                if pending is fut:
+                    del _pending[req_id]
+        raise RuntimeError(f"编码超时（{timeout} 秒）")
+    return vectors
+
+
+def encode_text(text: str, timeout: float = 60.0) -> np.ndarray:
+    """编码文本，返回 float32 向量（只读，可能与其他调用方共享）；编码器未就绪时直接抛出异常"""
+    data = text.encode('utf-8')
+    key = None
+    if len(data) <= ENCODE_CACHE_MAX_TEXT:
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        with _encode_cache_lock:
+            vector = _encode_cache.get(key)
+            if vector is not None:
+                _encode_cache.move_to_end(key)
+                return vector
+
+    vector = _request_vectors(MSG_TEXT, data, timeout)[0]
+    if key is not None:
+        # 合并请求得到的是整批矩阵中的一行视图，复制出来，避免缓存项让整批矩阵常驻内存
+        if vector.base is not None and vector.base.size > vector.size:
+            vector = vector.copy()
+        vector.flags.writeable = False
+        with _encode_cache_lock:
+            _encode_cache[key] = vector
+            while len(_encode_cache) > ENCODE_CACHE_SIZE:
+                _encode_cache.popitem(last=False)
+    return vector
+
+
+def clear_encode_cache():
+    """清空 encode_text 的结果缓存"""
+    with _encode_cache_lock:
+        _encode_cache.clear()
+
+
+def encode_texts(texts: List[str], timeout: float = 60.0) -> np.ndarray:
+    """批量编码文本，一次往返返回 (len(texts), 维度) 的 float32 矩阵"""
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    return _request_vectors(MSG_TEXTS, _pack_texts(texts), timeout)
+
+
+def begin_shutdown_encoder() -> Future:
+    """
+    开始关闭编码器工作进程并立即返回，Future 在工作进程退出后完成
+
+    退出命令排在已提交的请求之后，在途请求仍会拿到结果；调用后不再接受新请求。
+    调用方可以在等待工作进程退出（通常 1-3 秒）的同时处理其他收尾工作
+    """
+    global _workers, _encoder_ready, _encoder_loading
+
+    with _pending_lock:
+        procs = [proc for proc in _workers if proc.poll() is None]
+        _workers = []
     _encoder_ready = False
     _encoder_loading = False
-    logger.info("[memory-mcp] Encoder shut down")
+    # 唤醒仍在等待的调用方
+    _encoder_settled.set()
+
+    done: Future = Future()
+    if not procs:
+        logger.info("[memory-mcp] Encoder shut down")
+        done.set_result(None)
+        return done
+
+    # 每个写线程取到一个 None 后向自己的工作进程发送退出命令并结束
+    for _ in procs:
+        _send_queue.put(None)
+
+    def _join():
+        for proc in procs:
+            try:
+                proc.wait(timeout=5)
+            except Exception:
+                proc.kill()
+        logger.info("[memory-mcp] Encoder shut down")
+        done.set_result(None)
+
+    threading.Thread(target=_join, daemon=True, name="encoder-shutdown").start()
+    return done
+
+
+def shutdown_encoder():
+    """关闭编码器工作进程（阻塞到工作进程退出）"""
+    begin_shutdown_encoder().result()
 
 
 # 兼容旧接口
@@ -168,37 +592,299 @@ def get_encoder(block: bool = True):
     raise RuntimeError("请使用 encode_text() 函数进行编码")
 
 
-class VectorStore:
-    """向量存储封装"""
+def _is_index_error(error: Exception) -> bool:
+    """是否为 HNSW 索引与元数据不一致导致的查询失败（可降级到关键词搜索）"""
+    error_msg = str(error)
+    return "Error finding id" in error_msg or "finding id" in error_msg.lower()
 
-    def __init__(self, db_path: str, collection_name: str = "default"):
-        self.db_path = Path(db_path)
-        self.db_path.mkdir(parents=True, exist_ok=True)
 
+def _format_query_results(results: Dict, q: int, include_distances: bool) -> List[Dict]:
+    """把 collection.query 返回的第 q 个查询的并列列表整理为结果 dict 列表"""
+    rows = zip(results["ids"][q], results["documents"][q], results["metadatas"][q])
+    if include_distances:
+        return [
+            {"id": doc_id, "content": content, "metadata": metadata, "distance": distance}
+            for (doc_id, content, metadata), distance in zip(rows, results["distances"][q])
+        ]
+    return [{"id": doc_id, "content": content, "metadata": metadata} for doc_id, content, metadata in rows]
+
+
+# 关键词索引连接的设置（连接级，每次打开时执行）：索引可由集合重建，WAL 下 synchronous=NORMAL 足够；
+# 提高自动检查点阈值，批量写入时减少检查点次数
+_FTS_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA wal_autocheckpoint=10000;"
+)
+
+
+# 按数据库路径复用 PersistentClient（同一路径的多个集合共享 sqlite 连接与 HNSW 绑定）
+_client_cache: Dict[str, Any] = {}
+_client_lock = threading.Lock()
+
+
+def _get_client(db_path: Path):
+    """获取（或创建）指定路径的 ChromaDB 客户端，WAL 设置每个路径只执行一次"""
+    key = str(db_path.resolve())
+    with _client_lock:
+        client = _client_cache.get(key)
+        if client is not None:
+            return client
+
+        # journal_mode 持久保存在数据库文件里：已是 WAL 时只读一次，不再执行切换（切换需要写锁）。
+        # synchronous 等其余 PRAGMA 只对执行它的连接生效，Chroma 不暴露自己的连接，在这里设置没有意义
         try:
-            import sqlite3
-            db_file = self.db_path / "chroma.sqlite3"
+            db_file = db_path / "chroma.sqlite3"
             if db_file.exists():
                 conn = sqlite3.connect(str(db_file), timeout=5.0)
-                conn.execute("PRAGMA journal_mode=WAL")
-                conn.close()
+                try:
+                    mode, = conn.execute("PRAGMA journal_mode").fetchone()
+                    if mode.lower() != "wal":
+                        conn.execute("PRAGMA journal_mode=WAL")
+                finally:
+                    conn.close()
         except Exception:
             pass
 
-        self.client = chromadb.PersistentClient(
-            path=str(self.db_path),
+        client = chromadb.PersistentClient(
+            path=key,
             settings=Settings(anonymized_telemetry=False)
         )
+        _prefetch_file(db_path / "chroma.sqlite3")
+        _client_cache[key] = client
+        return client
+
+
+def _prefetch_file(path: Path):
+    """提示内核预读整个文件（POSIX_FADV_WILLNEED），减少首次检索的缺页等待；不支持的平台直接跳过"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class VectorStore:
+    """向量存储封装"""
+
+    def __init__(self, db_path: str, collection_name: str = "default", warmup_encoder: bool = False):
+        """
+        Args:
+            warmup_encoder: 为 True 时在打开 ChromaDB 之前先在后台启动编码器，
+                使模型加载与 sqlite/HNSW 初始化重叠；首次 encode_text 仍会等待就绪。
+                短生命周期的 hook 进程保持 False，避免白白拉起模型进程。
+        """
+        if warmup_encoder and not (_encoder_ready or _encoder_loading):
+            start_encoder_warmup()
+
+        self.db_path = Path(db_path)
+        self.db_path.mkdir(parents=True, exist_ok=True)
+
+        self.client = _get_client(self.db_path)
 
         self.collection = self.client.get_or_create_collection(
             name=collection_name,
             metadata={"hnsw:space": "cosine"}
         )
 
+        self.collection_name = collection_name
+        self._fts: Optional[sqlite3.Connection] = None
+        self._fts_lock = threading.Lock()
+        self._init_keyword_index()
+
+        # 写入队列：add/add_async 提交的写入由一个后台线程取出，线程忙时积压的写入合并为一次批量写入
+        self._write_q: "queue.Queue[Tuple[str, str, Dict[str, Any], Future]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+
+    # ==================== 关键词索引（FTS5） ====================
+
+    def _init_keyword_index(self):
+        """
+        打开与 Chroma 同目录的 FTS5 关键词索引（keyword_index.sqlite3）
+
+        - 使用 trigram 分词，支持中文等无空格文本的子串匹配
+        - 不写入 Chroma 自己的 sqlite 文件，避免干扰其迁移与锁
+        - SQLite 不支持 FTS5/trigram 时保持 self._fts = None，降级为 Python 扫描
+        """
+        try:
+            conn = sqlite3.connect(
+                str(self.db_path / "keyword_index.sqlite3"), timeout=5.0, check_same_thread=False
+            )
+            conn.executescript(_FTS_PRAGMAS)
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS mem_fts "
+                "USING fts5(doc_id UNINDEXED, coll UNINDEXED, content, tokenize='trigram')"
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"关键词索引不可用，降级到 Python 扫描: {e}")
+            return
+
+        self._fts = conn
+        try:
+            indexed = conn.execute(
+                "SELECT 1 FROM mem_fts WHERE coll = ? LIMIT 1", (self.collection_name,)
+            ).fetchone()
+            if not indexed and self.collection.count() > 0:
+                # 首次启用：从已有集合回填
+                existing = self.collection.get(include=["documents"])
+                self._index_docs(list(zip(existing["ids"], existing["documents"])))
+        except Exception as e:
+            logger.warning(f"关键词索引回填失败: {e}")
+
+    def _index_docs(self, docs: List[Tuple[str, Optional[str]]]):
+        """写入/覆盖 (doc_id, content) 到关键词索引"""
+        if self._fts is None or not docs:
+            return
+        try:
+            with self._fts_lock, self._fts:
+                self._fts.executemany(
+                    "DELETE FROM mem_fts WHERE doc_id = ? AND coll = ?",
+                    [(doc_id, self.collection_name) for doc_id, _ in docs],
+                )
+                self._fts.executemany(
+                    "INSERT INTO mem_fts (doc_id, coll, content) VALUES (?, ?, ?)",
+                    [(doc_id, self.collection_name, content or "") for doc_id, content in docs],
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"关键词索引写入失败: {e}")
+
+    def _unindex_docs(self, doc_ids: List[str]):
+        """从关键词索引删除文档"""
+        if self._fts is None or not doc_ids:
+            return
+        try:
+            with self._fts_lock, self._fts:
+                self._fts.executemany(
+                    "DELETE FROM mem_fts WHERE doc_id = ? AND coll = ?",
+                    [(doc_id, self.collection_name) for doc_id in doc_ids],
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"关键词索引删除失败: {e}")
+
+    def _fts_match(self, keywords: List[str], limit: int) -> Optional[List[str]]:
+        """
+        用 FTS5 MATCH 查找包含任一关键词的文档，按 bm25 排序返回 doc_id
+
+        trigram 分词无法匹配少于 3 个字符的词，此时返回 None 由调用方降级
+        """
+        if self._fts is None or not keywords or any(len(kw) < 3 for kw in keywords):
+            return None
+        expr = " OR ".join('"' + kw.replace('"', '""') + '"' for kw in keywords)
+        try:
+            with self._fts_lock:
+                rows = self._fts.execute(
+                    "SELECT doc_id FROM mem_fts WHERE mem_fts MATCH ? AND coll = ? "
+                    "ORDER BY bm25(mem_fts) LIMIT ?",
+                    (expr, self.collection_name, limit),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"关键词索引查询失败: {e}")
+            return None
+        return [row[0] for row in rows]
+
     def add(self, doc_id: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """添加一条文档，阻塞到写入完成；与其他线程并发的写入合并为一次批量编码与写入"""
+        return self.add_async(doc_id, content, metadata).result()
+
+    def add_async(self, doc_id: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> Future:
+        """
+        提交一条写入并立即返回 Future（结果为 doc_id，写入失败时为异常）
+
+        调用方需要读到自己的写入（检索、update/delete 同一文档）时，先等待 Future 或调用 flush()
+        """
+        fut: Future = Future()
+        self._write_q.put((doc_id, content, metadata or {}, fut))
+        if self._writer is None:
+            self._start_writer()
+        return fut
+
+    def flush(self):
+        """等待已提交的写入全部完成"""
+        self._write_q.join()
+
+    def _start_writer(self):
+        with self._writer_lock:
+            if self._writer is not None:
+                return
+            self._writer = threading.Thread(
+                target=self._write_loop, daemon=True, name=f"chroma-writer-{self.collection_name}"
+            )
+            self._writer.start()
+            # 进程正常退出前写完队列中剩余的写入
+            atexit.register(self.flush)
+
+    def _write_loop(self):
+        """后台写线程：取出已积压的写入（最多 ENCODE_BATCH_SIZE 条，不额外等待）一次写入"""
+        while True:
+            batch = [self._write_q.get()]
+            while len(batch) < ENCODE_BATCH_SIZE:
+                try:
+                    batch.append(self._write_q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if len(batch) == 1:
+                    doc_id, content, metadata, _ = batch[0]
+                    self._add_one(doc_id, content, metadata)
+                else:
+                    self.add_many([(doc_id, content, metadata) for doc_id, content, metadata, _ in batch])
+            except Exception as e:
+                for *_, fut in batch:
+                    fut.set_exception(e)
+            else:
+                for doc_id, _, _, fut in batch:
+                    fut.set_result(doc_id)
+            finally:
+                for _ in batch:
+                    self._write_q.task_done()
+
+    def _add_one(self, doc_id: str, content: str, metadata: Dict[str, Any]):
+        # 单条写入走 encode_text，可命中编码缓存并与其他单条编码请求合并
         vector = encode_text(content)
-        self.collection.add(ids=[doc_id], embeddings=[vector], documents=[content], metadatas=[metadata or {}])
-        return doc_id
+        self.collection.add(ids=[doc_id], embeddings=[vector], documents=[content], metadatas=[metadata])
+        self._index_docs([(doc_id, content)])
+
+    def add_many(self, items: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> List[str]:
+        """
+        批量添加 (doc_id, content, metadata)，按 ENCODE_BATCH_SIZE 分批编码与写入
+
+        编码与写入流水线进行：每批的编码请求提前提交（最多 ENCODE_PIPELINE_DEPTH + 1 批在途），
+        写入第 N 批时编码器已在计算第 N+1 批。批内内容相同的文档只编码一次
+        """
+        inflight: deque = deque()
+        for start in range(0, len(items), ENCODE_BATCH_SIZE):
+            chunk = items[start:start + ENCODE_BATCH_SIZE]
+            # 每条文档对应的去重后文本下标
+            unique: Dict[str, int] = {}
+            rows = [unique.setdefault(content, len(unique)) for _, content, _ in chunk]
+            inflight.append((chunk, rows, _submit(MSG_TEXTS, _pack_texts(list(unique)))))
+            if len(inflight) > ENCODE_PIPELINE_DEPTH:
+                self._write_chunk(*inflight.popleft())
+        while inflight:
+            self._write_chunk(*inflight.popleft())
+        return [doc_id for doc_id, _, _ in items]
+
+    def _write_chunk(self, chunk: List[Tuple[str, str, Optional[Dict[str, Any]]]], rows: List[int], encoded: Future):
+        vectors = _await_vectors(encoded, 60.0)
+        if len(rows) != len(vectors):
+            vectors = vectors[rows]
+        self.collection.add(
+            ids=[doc_id for doc_id, _, _ in chunk],
+            embeddings=list(vectors),
+            documents=[content for _, content, _ in chunk],
+            metadatas=[metadata or {} for _, _, metadata in chunk],
+        )
+        self._index_docs([(doc_id, content) for doc_id, content, _ in chunk])
 
     def update(self, doc_id: str, content: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None):
         update_kwargs = {"ids": [doc_id]}
@@ -209,45 +895,108 @@ class VectorStore:
         if metadata:
             update_kwargs["metadatas"] = [metadata]
         self.collection.update(**update_kwargs)
+        if content:
+            self._index_docs([(doc_id, content)])
 
     def delete(self, doc_id: str):
         self.collection.delete(ids=[doc_id])
+        self._unindex_docs([doc_id])
 
     def search(self, query: str, top_k: int = 5, where: Optional[Dict] = None, include_distances: bool = False) -> List[Dict]:
         return self._vector_search(query, top_k, where, include_distances)
 
-    def _vector_search(self, query: str, top_k: int = 5, where: Optional[Dict] = None, include_distances: bool = False) -> List[Dict]:
-        vector = encode_text(query)
+    def search_many(self, queries: List[str], top_k: int = 5, where: Optional[Dict] = None, include_distances: bool = False) -> List[List[Dict]]:
+        """
+        批量检索：分批编码后一次 query 多个向量（一次 HNSW 批量遍历），返回与 queries 等长的结果列表
+
+        向量索引损坏时与 search 一样逐条降级到关键词搜索
+        """
+        include = ["documents", "metadatas", "distances"] if include_distances else ["documents", "metadatas"]
+        all_items = []
+        for start in range(0, len(queries), ENCODE_BATCH_SIZE):
+            chunk = queries[start:start + ENCODE_BATCH_SIZE]
+            vectors = encode_texts(chunk)
+            try:
+                results = self.collection.query(
+                    query_embeddings=list(vectors), n_results=top_k, where=where, include=include
+                )
+            except Exception as e:
+                if not _is_index_error(e):
+                    raise
+                logger.warning(f"向量索引可能损坏，降级到关键词搜索: {e}")
+                all_items.extend(self._keyword_search(query, top_k, where) for query in chunk)
+                continue
+            all_items.extend(
+                _format_query_results(results, q, include_distances) for q in range(len(results["ids"]))
+            )
+        return all_items
+
+    def encode(self, query: str) -> np.ndarray:
+        """编码查询文本，结果可传给 search_by_vector 在多次检索间复用（编码器为进程内共享）"""
+        return encode_text(query)
+
+    def search_by_vector(
+        self,
+        vector: np.ndarray,
+        top_k: int = 5,
+        where: Optional[Dict] = None,
+        include_distances: bool = False,
+        query: Optional[str] = None,
+    ) -> List[Dict]:
+        """
+        用已编码的向量检索
+
+        query 为原始查询文本，向量索引损坏时用于降级到关键词搜索；未提供时直接抛出异常
+        """
         try:
             results = self.collection.query(
                 query_embeddings=[vector], n_results=top_k, where=where,
                 include=["documents", "metadatas", "distances"] if include_distances else ["documents", "metadatas"]
             )
         except Exception as e:
-            error_msg = str(e)
-            if "Error finding id" in error_msg or "finding id" in error_msg.lower():
+            if query is not None and _is_index_error(e):
                 logger.warning(f"向量索引可能损坏，降级到关键词搜索: {e}")
                 return self._keyword_search(query, top_k, where)
             raise
 
-        items = []
-        for i in range(len(results["ids"][0])):
-            item = {"id": results["ids"][0][i], "content": results["documents"][0][i], "metadata": results["metadatas"][0][i]}
-            if include_distances:
-                item["distance"] = results["distances"][0][i]
-            items.append(item)
-        return items
+        return _format_query_results(results, 0, include_distances)
+
+    def _vector_search(self, query: str, top_k: int = 5, where: Optional[Dict] = None, include_distances: bool = False) -> List[Dict]:
+        return self.search_by_vector(self.encode(query), top_k, where, include_distances, query=query)
 
     def _keyword_search(self, query: str, top_k: int = 5, where: Optional[Dict] = None) -> List[Dict]:
         keywords = [w.strip() for w in query.split() if len(w.strip()) >= 2]
+
+        # 优先走 FTS5 索引：在 C 层完成匹配与 bm25 排序，再按 where 过滤
+        doc_ids = self._fts_match(keywords, top_k * 10)
+        if doc_ids is not None:
+            if not doc_ids:
+                return []
+            results = self.collection.get(ids=doc_ids, where=where, include=["documents", "metadatas"])
+            by_id = {
+                doc_id: {"id": doc_id, "content": content, "metadata": metadata}
+                for doc_id, content, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+            }
+            return [by_id[doc_id] for doc_id in doc_ids if doc_id in by_id][:top_k]
+
         results = self.collection.get(where=where, limit=top_k * 10, include=["documents", "metadatas"])
         if not results["ids"]:
             return []
 
+        # 关键词只转换一次小写。先用预编译的忽略大小写多选正则在原文上一次扫描判断是否命中任一关键词，
+        # 只有命中的行才转换小写并逐个子串计分，大部分未命中的行不再复制一份小写正文
+        lowered_keywords = [kw.lower() for kw in keywords]
+        any_keyword = None
+        if lowered_keywords:
+            any_keyword = re.compile("|".join(map(re.escape, lowered_keywords)), re.IGNORECASE).search
         scored_items = []
         for i in range(len(results["ids"])):
             content = results["documents"][i] or ""
-            score = sum(1 for kw in keywords if kw.lower() in content.lower())
+            if any_keyword is None or any_keyword(content) is None:
+                score = 0
+            else:
+                lowered = content.lower()
+                score = sum(1 for kw in lowered_keywords if kw in lowered)
             if score > 0 or not keywords:
                 scored_items.append({"id": results["ids"][i], "content": content, "metadata": results["metadatas"][i], "_score": score})
 
@@ -264,22 +1013,61 @@ class VectorStore:
             return None
         return {"id": results["ids"][0], "content": results["documents"][0], "metadata": results["metadatas"][0]}
 
-    def get_by_type(self, entity_type: str, limit: int = 10, status: str = "active") -> List[Dict]:
+    def get_many(self, doc_ids: List[str]) -> List[Dict]:
+        """按 ID 批量获取，结果保持 doc_ids 的顺序（不存在的 ID 被忽略）"""
+        if not doc_ids:
+            return []
+        results = self.collection.get(ids=doc_ids, include=["documents", "metadatas"])
+        return self._sorted_by_ids(doc_ids, self._rows(results, with_content=True))
+
+    def get_by_type(
+        self, entity_type: str, limit: int = 10, status: str = "active", with_content: bool = True
+    ) -> List[Dict]:
+        """
+        按类型和状态获取记录
+
+        with_content=False 时只取元数据（不含 content 字段），
+        适合先按元数据排序/筛选、再用 get_many 取正文的场景
+        """
         results = self.collection.get(
             where={"$and": [{"type": entity_type}, {"status": status}]},
-            limit=limit, include=["documents", "metadatas"]
+            limit=limit, include=["documents", "metadatas"] if with_content else ["metadatas"]
         )
-        items = []
-        for i in range(len(results["ids"])):
-            items.append({"id": results["ids"][i], "content": results["documents"][i], "metadata": results["metadatas"][i]})
-        return items
+        return self._rows(results, with_content)
+
+    def get_ids_by_type(self, entity_type: str, limit: int = 10, status: str = "active") -> List[str]:
+        """只返回匹配记录的 ID，不传输文档与元数据"""
+        results = self.collection.get(
+            where={"$and": [{"type": entity_type}, {"status": status}]},
+            limit=limit, include=[]
+        )
+        return results["ids"]
 
     def count(self) -> int:
         return self.collection.count()
 
-    def list_all(self, limit: int = 100) -> List[Dict]:
-        results = self.collection.get(limit=limit, include=["documents", "metadatas"])
-        items = []
-        for i in range(len(results["ids"])):
-            items.append({"id": results["ids"][i], "content": results["documents"][i], "metadata": results["metadatas"][i]})
-        return items
+    def list_all_ids(self, limit: int = 100) -> List[str]:
+        """只列出 ID，不传输文档与元数据"""
+        return self.collection.get(limit=limit, include=[])["ids"]
+
+    def list_all(self, limit: int = 100, with_content: bool = True) -> List[Dict]:
+        results = self.collection.get(
+            limit=limit, include=["documents", "metadatas"] if with_content else ["metadatas"]
+        )
+        return self._rows(results, with_content)
+
+    @staticmethod
+    def _rows(results: Dict, with_content: bool) -> List[Dict]:
+        """把 collection.get 的列式结果转换为记录列表"""
+        if not with_content:
+            return [{"id": doc_id, "metadata": metadata} for doc_id, metadata in zip(results["ids"], results["metadatas"])]
+        return [
+            {"id": doc_id, "content": content, "metadata": metadata}
+            for doc_id, content, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
+
+    @staticmethod
+    def _sorted_by_ids(doc_ids: List[str], items: List[Dict]) -> List[Dict]:
+        """按给定 ID 顺序重排记录"""
+        by_id = {item["id"]: item for item in items}
+        return [by_id[i] for i in doc_ids if i in by_id]
@@ -0,0 +1,84 @@
+"""
+实体检测：RE2 Set 预筛（fast 可选依赖）与逐个 re 匹配的结果必须一致
+
+运行：pip install google-re2 pytest && pytest tests/
+"""
+import random
+
+import pytest
+
+re2 = pytest.importorskip("re2")
+
+from memory_mcp.memory.manager import MemoryManager
+
+# 覆盖各类规则的片段，随机拼接出消息
+FRAGMENTS = [
+    "我", "我们", "用户", "决定", "确定", "选择", "采用", "使用", "了", "方案", "作为", "来",
+    "最终", "最佳", "架构", "设计", "模式", "分层", "模块化", "微服务", "基于", "喜欢", "偏好",
+    "prefer", "PREFER", "倾向于", "是指", "是什么", "什么是", "解释一下", "我是", "我叫", "我的名字是",
+    "的", "习惯", "总是", "通常", "每次都", "修改", "main.py", "app.ts", "文件负责", "PostgreSQL",
+    "Redis", "后端工程师", "hello", "world", "今天", "天气", "不错", "，", ",", "。", "！", "？",
+    " ", "\n", ".", "$",
+]
+
+EXAMPLES = [
+    "",
+    "hello world.",
+    "今天的天气不错",
+    "我是后端工程师",
+    "我是后端工程师\n",
+    "用户是前端开发者\n",
+    "我决定使用 PostgreSQL 作为主数据库",
+    "我们最终采用了微服务架构来拆分订单系统",
+    "I prefer tabs over spaces in this project",
+    "修改 memory_mcp/server.py 里的分发逻辑",
+]
+
+
+def _random_messages(count: int, seed: int = 20260215):
+    rng = random.Random(seed)
+    for _ in range(count):
+        text = "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 24)))
+        if rng.random() < 0.3:
+            text += "\n"
+        yield text
+
+
+def _detect(manager: MemoryManager, content: str):
+    return [
+        (c["type"], c["extracted_content"], c["confidence"], c["detection_method"])
+        for c in manager._detect_candidates(content)
+    ]
+
+
+@pytest.fixture
+def managers(monkeypatch):
+    """(启用 RE2 预筛的实例, 逐个模式匹配的实例)；_detect_candidates 不依赖实例状态"""
+    if MemoryManager._PATTERN_SET is None:
+        pytest.skip("RE2 Set 不可用")
+    fast = object.__new__(MemoryManager)
+    plain = object.__new__(MemoryManager)
+    monkeypatch.setattr(plain, "_PATTERN_SET", None)
+    return fast, plain
+
+
+@pytest.mark.parametrize("content", EXAMPLES)
+def test_prefilter_matches_plain_re_examples(managers, content):
+    fast, plain = managers
+    assert _detect(fast, content) == _detect(plain, content)
+
+
+def test_prefilter_matches_plain_re_random(managers):
+    fast, plain = managers
+    for content in _random_messages(5000):
+        assert _detect(fast, content) == _detect(plain, content), content
+
+
+def test_prefilter_without_matches_returns_empty():
+    prefilter = MemoryManager._PATTERN_SET
+    if prefilter is None:
+        pytest.skip("RE2 Set 不可用")
+    # 没有任何模式命中时 RE2 Set.Match 返回 None，只剩不经预筛的模式
+    assert prefilter.match("hello world.") == prefilter._unfiltered
+    assert prefilter.match("今天的天气不错") == prefilter._unfiltered
+    assert prefilter.match("\ud800") is None